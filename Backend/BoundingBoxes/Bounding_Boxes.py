@@ -1,29 +1,52 @@
-from ultralytics import YOLO
 import cv2
 from PIL import Image
 import os
+import sys
 import numpy as np
 
-def detect_and_crop_objects(image_path, output_folder):
-    model = YOLO('yolov8n.pt')
+# Use the shared pipeline from the Backend package directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline import DetectionPipeline
+
+# Only the detection stages are used; the crops are written at full resolution instead
+pipeline = DetectionPipeline(encode_crops=False)
+
+def crop_objects(data, output_folder):
+    """
+    Detect the objects in an encoded image and write each one's crop to a folder
     
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    Args:
+        data (bytes): The encoded image
+        output_folder (str): Where the crops are written
     
-    image = cv2.imread(image_path)
+    Returns:
+        list[str]: Paths of the written crops
     
-    results = model(image)
+    Raises:
+        ValueError: The data is not a decodable image
+    """
+    image = pipeline.decode(data)
+    boxes = pipeline.detect([image])[0]
+    detections = pipeline.crop(image, pipeline.filter(image, boxes), "image")
     
-    for idx, detection in enumerate(results[0].boxes.data):
-        x1, y1, x2, y2, conf, cls = detection.tolist()
-        x1, y1, x2, y2 = map(int, [x1, y1, x2, y2])
-        
-        class_name = results[0].names[int(cls)]
-        
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    
+    paths = []
+    for idx, detection in enumerate(detections):
+        x1, y1, x2, y2 = detection["box"]
         cropped_object = image[y1:y2, x1:x2]
         
-        output_path = os.path.join(output_folder, f"{class_name}_{idx}_conf{conf:.2f}.jpg")
+        output_path = os.path.join(output_folder, f"{detection['class_name']}_{idx}_conf{detection['confidence']:.2f}.jpg")
         cv2.imwrite(output_path, cropped_object)
+        paths.append(output_path)
+    
+    return paths
+
+def detect_and_crop_objects(image_path, output_folder):
+    with open(image_path, "rb") as image_file:
+        return crop_objects(image_file.read(), output_folder)
 
 if __name__ == "__main__":
     image_path = "image.jpg"
@@ -0,0 +1,171 @@
+"""
+Admission control and event-loop health for the async API.
+
+An async endpoint accepts every connection it is given, so without a limit a burst of
+uploads queues up inside the process: each request holds its image in memory and waits
+for the inference executor while clients time out anyway. AdmissionController bounds
+that work instead:
+
+- at most API_MAX_IN_FLIGHT requests run the pipeline at once;
+- up to API_MAX_QUEUE more wait for a slot, for at most API_QUEUE_TIMEOUT_SECONDS;
+- anything beyond is rejected right away with 429, a request that waited too long with
+  503, and every request with 503 while the event loop lags more than
+  API_MAX_LOOP_LAG_SECONDS. Rejections carry a Retry-After estimated from recent
+  request durations, so clients and load balancers back off instead of retrying at once.
+
+EventLoopLagMonitor measures how late the loop wakes up from a short sleep, which is how
+long any callback (including new requests) currently waits for the loop. Lag that grows
+means something blocks the loop or the process is CPU-starved. It is exported as
+emberaid_event_loop_lag_seconds.
+"""
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from metrics import REGISTRY
+
+# Load environment variables
+load_dotenv()
+
+# Requests running the pipeline at once
+API_MAX_IN_FLIGHT = int(os.getenv("API_MAX_IN_FLIGHT", "8"))
+# Requests waiting for a slot before new ones are rejected with 429
+API_MAX_QUEUE = int(os.getenv("API_MAX_QUEUE", "16"))
+# Longest a request waits for a slot before it is rejected with 503
+API_QUEUE_TIMEOUT_SECONDS = float(os.getenv("API_QUEUE_TIMEOUT_SECONDS", "10"))
+# Reject new requests with 503 while the event loop lags more than this (0 disables)
+API_MAX_LOOP_LAG_SECONDS = float(os.getenv("API_MAX_LOOP_LAG_SECONDS", "0.5"))
+# How often the event-loop lag is sampled
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.25"))
+
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LOOP_LAG = REGISTRY.gauge("emberaid_event_loop_lag_seconds", "Latest event-loop lag sample")
+LOOP_LAG_SECONDS = REGISTRY.histogram("emberaid_event_loop_lag_sample_seconds", "Event-loop lag samples",
+                                      buckets=LOOP_LAG_BUCKETS)
+ADMISSION_REJECTIONS = REGISTRY.counter("emberaid_admission_rejections_total", "Requests rejected by admission control",
+                                        ["status", "reason"])
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram("emberaid_admission_wait_seconds", "Time requests waited for a slot")
+
+
+class AdmissionRejected(Exception):
+    """A request was turned away; the API answers with status and a Retry-After header"""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(f"Server busy ({reason}), retry in {retry_after}s")
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class EventLoopLagMonitor:
+    """Samples the running loop's scheduling delay in a background task"""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL_SECONDS):
+        self.interval = interval
+        self.lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.lag = lag
+            LOOP_LAG.set(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def start(self):
+        """Start sampling on the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class AdmissionController:
+    """Bounds the requests running and waiting, rejecting the rest with a Retry-After"""
+
+    def __init__(self, max_in_flight=API_MAX_IN_FLIGHT, max_queue=API_MAX_QUEUE,
+                 queue_timeout=API_QUEUE_TIMEOUT_SECONDS, max_loop_lag=API_MAX_LOOP_LAG_SECONDS, lag_monitor=None):
+        self.max_in_flight = max(max_in_flight, 1)
+        self.max_queue = max(max_queue, 0)
+        self.queue_timeout = queue_timeout
+        self.max_loop_lag = max_loop_lag
+        self.lag_monitor = lag_monitor
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of how long an admitted request holds its slot
+        self._average_seconds = 1.0
+        self._slots = None
+        self._stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_queue_timeout": 0,
+            "rejected_loop_lag": 0,
+        }
+
+    def retry_after(self):
+        """Seconds until a slot is likely free for a new request"""
+        backlog = self.waiting + max(self.in_flight - self.max_in_flight + 1, 1)
+        return max(math.ceil(self._average_seconds * backlog / self.max_in_flight), 1)
+
+    def _reject(self, status, reason):
+        self._stats[f"rejected_{reason}"] += 1
+        ADMISSION_REJECTIONS.inc(status=status, reason=reason)
+        raise AdmissionRejected(status, self.retry_after(), reason)
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        Hold a pipeline slot for the duration of the block
+
+        Raises:
+            AdmissionRejected: The queue is full (429), the wait timed out (503) or the
+                event loop is lagging (503)
+        """
+        if self._slots is None:
+            # Created on first use so it belongs to the serving loop
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        if self.max_loop_lag and self.lag_monitor is not None and self.lag_monitor.lag > self.max_loop_lag:
+            self._reject(503, "loop_lag")
+        if self.in_flight + self.waiting >= self.max_in_flight + self.max_queue:
+            self._reject(429, "queue_full")
+
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject(503, "queue_timeout")
+        finally:
+            self.waiting -= 1
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+        self.in_flight += 1
+        self._stats["admitted"] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            self._average_seconds = 0.8 * self._average_seconds + 0.2 * (time.perf_counter() - start)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["in_flight"] = self.in_flight
+        stats["waiting"] = self.waiting
+        stats["average_request_seconds"] = self._average_seconds
+        return stats
@@ -0,0 +1,214 @@
+"""
+Content-addressed cache for vision analysis results.
+
+Each crop is keyed twice: by the SHA-256 of its encoded bytes (exact repeats, e.g. the
+same photo uploaded again) and by a 64-bit difference hash (dHash) of its pixels, which
+also matches crops that are visually near-identical. A near match is accepted when the
+detector labels agree and the Hamming distance between the dHashes is within a
+configurable threshold. Hashes that are themselves within that distance of all 0s or all
+1s (flat or low-detail crops) say little about the content and only match exactly.
+
+Near matches are found through a multi-index: each dHash is split into threshold + 1
+bands and indexed by every band, since two hashes within the threshold must agree on at
+least one band. A lookup then only compares the few entries that share a band with it.
+
+Entries live in an in-memory LRU index and can optionally be mirrored to a SQLite file
+so analyses survive restarts.
+"""
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Cache tuning (overridable through the environment)
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "4096"))
+ANALYSIS_CACHE_MAX_DISTANCE = int(os.getenv("ANALYSIS_CACHE_MAX_DISTANCE", "4"))
+# Path of the SQLite file for the persistent store; leave empty for memory only
+ANALYSIS_CACHE_DB = os.getenv("ANALYSIS_CACHE_DB", "")
+
+# Bits in a dHash with the default hash size
+HASH_BITS = 64
+
+
+def exact_hash(image_bytes):
+    """SHA-256 hex digest of the encoded image bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def dhash(image, hash_size=8):
+    """
+    Compute a difference hash of an image
+
+    Args:
+        image: Encoded image bytes, a PIL image, or an RGB/BGR/grayscale numpy array
+        hash_size (int): Hash side length; the hash has hash_size ** 2 bits
+
+    Returns:
+        int: The perceptual hash
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    elif isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes"""
+    return (a ^ b).bit_count()
+
+
+def hash_bands(phash, count, bits=HASH_BITS):
+    """Split a hash into ``count`` contiguous bands, returned as (band index, value) pairs"""
+    bands = []
+    shift = bits
+    for index in range(count):
+        width = bits // count + (1 if index < bits % count else 0)
+        shift -= width
+        bands.append((index, (phash >> shift) & ((1 << width) - 1)))
+    return bands
+
+
+class AnalysisCache:
+    """Exact + perceptual hash cache of analysis results"""
+
+    def __init__(self, max_entries=ANALYSIS_CACHE_MAX_ENTRIES, max_distance=ANALYSIS_CACHE_MAX_DISTANCE,
+                 db_path=ANALYSIS_CACHE_DB):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._band_count = min(max_distance + 1, HASH_BITS) if max_distance >= 0 else 0
+        self._entries = OrderedDict()  # exact hash -> (perceptual hash, label, result)
+        self._bands = {}  # (label, band index, band value) -> exact hashes
+        self._lock = threading.Lock()
+        self._stats = {
+            "exact_hits": 0,
+            "near_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache "
+                "(exact_hash TEXT PRIMARY KEY, perceptual_hash TEXT NOT NULL, result TEXT NOT NULL, label TEXT)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(analysis_cache)")]
+            if "label" not in columns:
+                # Stores written before labels were recorded; their rows only match unlabeled crops
+                self._db.execute("ALTER TABLE analysis_cache ADD COLUMN label TEXT")
+            self._db.commit()
+            # Warm the in-memory index from the persistent store
+            rows = self._db.execute(
+                "SELECT exact_hash, perceptual_hash, label, result FROM analysis_cache ORDER BY rowid DESC LIMIT ?",
+                (max_entries,)
+            ).fetchall()
+            for key, phash, label, result in reversed(rows):
+                self._add(key, int(phash, 16), label, json.loads(result))
+
+    def _near_matchable(self, phash):
+        """Whether a hash carries enough detail to be matched by distance"""
+        return self._band_count > 0 and self.max_distance < phash.bit_count() < HASH_BITS - self.max_distance
+
+    def _add(self, key, phash, label, result):
+        """Insert or replace an entry and index its bands (lock held)"""
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (phash, label, result)
+        if self._near_matchable(phash):
+            for index, value in hash_bands(phash, self._band_count):
+                self._bands.setdefault((label, index, value), set()).add(key)
+
+    def _remove(self, key):
+        """Drop an entry and its band index entries (lock held)"""
+        phash, label, _ = self._entries.pop(key)
+        if self._near_matchable(phash):
+            for index, value in hash_bands(phash, self._band_count):
+                bucket = self._bands.get((label, index, value))
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._bands[(label, index, value)]
+
+    def lookup(self, image_bytes, perceptual_hash=None, label=None):
+        """
+        Find a cached result for an encoded image
+
+        Args:
+            image_bytes (bytes): The encoded image
+            perceptual_hash (int): Precomputed dHash; computed by decoding the bytes if omitted
+            label (str): Detector label of the crop; near matches must have the same label
+
+        Returns:
+            tuple: (result, keys) where result is a copy of the cached analysis or None,
+                and keys is the (exact, perceptual, label) triple to pass to store() on a miss
+        """
+        key = exact_hash(image_bytes)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return dict(entry[2]), (key, entry[0], label)
+
+        phash = perceptual_hash if perceptual_hash is not None else dhash(image_bytes)
+        with self._lock:
+            best_key = None
+            if self._near_matchable(phash):
+                candidates = set()
+                for index, value in hash_bands(phash, self._band_count):
+                    candidates.update(self._bands.get((label, index, value), ()))
+                best_distance = self.max_distance + 1
+                for candidate_key in candidates:
+                    distance = hamming_distance(phash, self._entries[candidate_key][0])
+                    if distance < best_distance:
+                        best_key = candidate_key
+                        best_distance = distance
+
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self._stats["near_hits"] += 1
+                return dict(self._entries[best_key][2]), (key, phash, label)
+
+            self._stats["misses"] += 1
+            return None, (key, phash, label)
+
+    def store(self, keys, result):
+        """Cache an analysis under the keys returned by lookup()"""
+        key, phash, label = keys
+        with self._lock:
+            self._add(key, phash, label, dict(result))
+            while len(self._entries) > self.max_entries:
+                evicted_key = next(iter(self._entries))
+                self._remove(evicted_key)
+                self._stats["evictions"] += 1
+                if self._db is not None:
+                    self._db.execute("DELETE FROM analysis_cache WHERE exact_hash = ?", (evicted_key,))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (exact_hash, perceptual_hash, label, result) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, format(phash, "016x"), label, json.dumps(result))
+                )
+                self._db.commit()
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current index size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["exact_hits"] + stats["near_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["exact_hits"] + stats["near_hits"]) / lookups if lookups else 0.0
+        return stats
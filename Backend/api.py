@@ -1,21 +1,32 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-import uuid
 import os
-import numpy as np
-import cv2
-from ultralytics import YOLO
-import base64
-from PIL import Image
-import io
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
+import sys
 
-# Import price scraper
-from PriceScraper import get_product_price
+# Import price scraper and backend helpers
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from PriceScraper import get_cache_stats, get_retailer_stats, get_single_flight_stats
+from detector import get_detector
+from pipeline import DetectionPipeline
+from metrics import REGISTRY, instrument_fastapi, listen_to_scraper
+from admission import AdmissionController, AdmissionRejected, EventLoopLagMonitor
 
-app = FastAPI()
+# Event-loop lag sampling and the request limits that use it
+lag_monitor = EventLoopLagMonitor()
+admission = AdmissionController(lag_monitor=lag_monitor)
+
+@asynccontextmanager
+async def lifespan(app):
+    lag_monitor.start()
+    yield
+    await lag_monitor.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS to allow requests from frontend
 app.add_middleware(
@@ -26,12 +37,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load YOLO model - do this once at startup for efficiency
-model = YOLO('yolov8n.pt')
+# Stage timings, Server-Timing headers and the /metrics endpoint
+instrument_fastapi(app)
+listen_to_scraper()
+REGISTRY.register_stats("price_cache", get_cache_stats)
+REGISTRY.register_stats("price_single_flight", get_single_flight_stats)
+REGISTRY.register_stats("retailer", get_retailer_stats, label="host")
+REGISTRY.register_stats("admission", admission.stats)
 
-# Temporary folder for uploads
-UPLOAD_FOLDER = "temp_uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Load the shared detector once at startup (warm model pool, backend chosen by DETECTOR_BACKEND)
+detector = get_detector()
+
+# Objects are priced by their detector label, so crops are only hashed (for grouping
+# look-alike objects), never encoded. CPU stages run on the bounded inference executor
+# and pricing is awaited on the event loop.
+pipeline = DetectionPipeline(detector=detector, encode_crops=False, hash_crops=True)
 
 class DetectedItem(BaseModel):
     id: str
@@ -41,6 +61,8 @@ class DetectedItem(BaseModel):
     valueSource: Optional[str] = None
     sourceUrl: Optional[str] = None
     isPriceModified: bool = False
+    quantity: int = 1
+    groupId: Optional[str] = None
 
 @app.post("/api/detect-objects", response_model=List[DetectedItem])
 async def detect_objects(file: UploadFile = File(...)):
@@ -48,93 +70,26 @@ async def detect_objects(file: UploadFile = File(...)):
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Save uploaded file
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(UPLOAD_FOLDER, f"{file_id}_{file.filename}")
-    
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+    data = await file.read()
     
+    # Shed load early instead of queueing without bound
     try:
-        # Run object detection
-        image = cv2.imread(file_path)
-        results = model(image)
-        
-        detected_items = []
-        
-        for idx, detection in enumerate(results[0].boxes.data):
-            x1, y1, x2, y2, conf, cls = detection.tolist()
-            x1, y1, x2, y2 = map(int, [x1, y1, x2, y2])
-            
-            # Get class name from the model's class names dictionary
-            class_name = results[0].names[int(cls)]
-            
-            # Calculate normalized bounding box coordinates (0-1 range)
-            img_height, img_width = image.shape[:2]
-            
-            # Calculate normalized values
-            norm_x = x1 / img_width
-            norm_y = y1 / img_height
-            norm_width = (x2 - x1) / img_width
-            norm_height = (y2 - y1) / img_height
-            
-            # Extract cropped object for additional processing if needed
-            cropped_object = image[y1:y2, x1:x2]
-            
-            # Create item dictionary for detected object
-            item_id = f"{file_id}_{idx}"
-            
-            # Create product info for price search
-            product_info = {
-                "name": class_name,
-                # You would ideally have more details like color, material, etc.
-                # These could come from additional ML models or image analysis
-            }
-            
-            # Get pricing information
-            pricing_result = get_product_price(product_info)
-            
-            # Extract price if found, otherwise None
-            price = None
-            value_source = None
-            source_url = None
-            
-            if pricing_result and "price" in pricing_result:
-                # Try to extract numeric price from string like "$123.45"
-                price_str = pricing_result.get("price", "").replace("$", "").replace(",", "")
-                try:
-                    price = float(price_str)
-                except (ValueError, TypeError):
-                    price = None
-                
-                value_source = pricing_result.get("source", None)
-                source_url = pricing_result.get("link", None)
-            
-            detected_item = DetectedItem(
-                id=item_id,
-                label=class_name,
-                boundingBox={
-                    "x": norm_x,
-                    "y": norm_y,
-                    "width": norm_width,
-                    "height": norm_height
-                },
-                estimatedValue=price,
-                valueSource=value_source,
-                sourceUrl=source_url,
-                isPriceModified=False
-            )
-            
-            detected_items.append(detected_item)
-        
-        return detected_items
-        
+        async with admission.admit():
+            return await detect_items(data)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def detect_items(data):
+    try:
+        result = (await pipeline.run_async([("image", data)]))["image"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
-    finally:
-        # Clean up the file after processing
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    
+    # Decode errors come back per upload
+    if "detail" in result:
+        raise HTTPException(status_code=400, detail=result["detail"])
+    
+    return result["items"]
 
 if __name__ == "__main__":
     uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
@@ -1,19 +1,17 @@
 from fastapi import FastAPI, UploadFile, File
-import shutil
+from fastapi.concurrency import run_in_threadpool
 import os
-from Backend.BoundingBoxes.Bounding_Boxes import detect_and_crop_objects
+from Backend.BoundingBoxes.Bounding_Boxes import crop_objects
 from typing import List
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
 
-# Configure upload and output directories
-UPLOAD_DIR = "uploaded_images"
+# Configure output directory
 OUTPUT_DIR = "detected_objects"
 
-# Create directories if they don't exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Create directory if it doesn't exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 app.add_middleware(
@@ -34,18 +32,18 @@ async def upload_and_detect_objects(file: UploadFile = File(...)):
                 content={"error": "Only image files are allowed"}
             )
         
-        # Create file path for uploaded image
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
+        # The upload is cropped in memory, only the crops are written
+        data = await file.read()
         
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Process the image using your existing function
+        # Detect and crop through the shared pipeline, off the event loop
         output_folder = os.path.join(OUTPUT_DIR, f"{os.path.splitext(file.filename)[0]}")
-        detect_and_crop_objects(file_path, output_folder)
-
-        
+        try:
+            await run_in_threadpool(crop_objects, data, output_folder)
+        except ValueError as e:
+            return JSONResponse(
+                status_code=400,
+                content={"error": str(e)}
+            )
         
         return {
             "message": "Image processed successfully",
@@ -0,0 +1,314 @@
+"""
+Offline benchmark of the detection -> analysis -> pricing pipeline.
+
+Drives the Flask detect endpoint in process with the checked-in sample photos
+(BoundingBoxes/image.jpg and temp_uploads/*.jpg). Nothing leaves the machine: the vision
+model is replaced by FakeVisionBackend with a configurable latency, and the retailer
+hosts are pointed at a local HTTP server replaying the saved Walmart and Target search
+pages from PriceScraper/fixtures.
+
+For every concurrency level it reports requests/sec and p50/p95/p99 latency of the whole
+request and of each pipeline stage (taken from the Server-Timing header), plus the peak
+RSS of the process. Stage durations are per request, summed over the objects when a
+stage runs once per object (e.g. price). Results can be written as JSON and compared
+with an earlier run.
+
+Caches are disabled by default (--cache cold) so every request does the full work; use
+--cache warm to measure repeat traffic.
+
+Usage (from the Backend directory):
+    python benchmark.py [--concurrency 1,4,8] [--requests 20] [--output results.json]
+                        [--compare baseline.json]
+"""
+import argparse
+import glob
+import http.server
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+FIXTURES_DIR = os.path.join(REPO_DIR, "PriceScraper", "fixtures")
+DEFAULT_IMAGES = [os.path.join(BACKEND_DIR, "BoundingBoxes", "image.jpg")] + \
+    sorted(glob.glob(os.path.join(BACKEND_DIR, "temp_uploads", "*.jpg")))
+
+# Recorded search page served for each retailer's search path
+STUB_PAGES = {
+    "/search": "walmart_search.html",
+    "/s": "target_search.html",
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+def start_retailer_stub(latency):
+    """
+    Serve the recorded search pages on a local port
+
+    Args:
+        latency (float): Seconds to wait before answering each request
+
+    Returns:
+        ThreadingHTTPServer: The running server (its port is server.server_port)
+    """
+    pages = {}
+    for path, name in STUB_PAGES.items():
+        with open(os.path.join(FIXTURES_DIR, name), "rb") as page_file:
+            pages[path] = page_file.read()
+
+    class RetailerHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = pages.get(self.path.split("?", 1)[0])
+            if latency:
+                time.sleep(latency)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The scraper stops reading once it has enough products
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    class RetailerServer(http.server.ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            # Connections closed early by the scraper are expected
+            if not isinstance(sys.exc_info()[1], ConnectionError):
+                super().handle_error(request, client_address)
+
+    server = RetailerServer(("127.0.0.1", 0), RetailerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_environment(cache):
+    """Settings that must be in place before the API modules are imported"""
+    os.environ["SERVER_TIMING"] = "1"
+    # Pacing the stub server would only measure the rate limiter
+    os.environ.setdefault("SCRAPER_RATE_LIMIT", "0")
+    # Never read or write a persistent cache during a benchmark
+    os.environ["PRICE_CACHE_DB"] = ""
+    os.environ["ANALYSIS_CACHE_DB"] = ""
+    if cache == "cold":
+        os.environ["PRICE_CACHE_TTL_SECONDS"] = "0"
+        os.environ["PRICE_CACHE_NEGATIVE_TTL_SECONDS"] = "0"
+        os.environ["ANALYSIS_CACHE_MAX_ENTRIES"] = "0"
+
+
+def parse_server_timing(header):
+    """Map each stage in a Server-Timing header to its duration in milliseconds"""
+    stages = {}
+    for entry in (header or "").split(","):
+        parts = [part.strip() for part in entry.split(";")]
+        for part in parts[1:]:
+            if part.startswith("dur="):
+                stages[parts[0]] = float(part[4:])
+    return stages
+
+
+def summarize(samples):
+    """p50/p95/p99 and mean of a list of milliseconds"""
+    if not samples:
+        return {}
+    values = np.asarray(samples, dtype=np.float64)
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    summary["mean"] = round(float(values.mean()), 2)
+    return summary
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_level(app, images, concurrency, requests):
+    """
+    Send requests from concurrent clients and collect their timings
+
+    Args:
+        app: The Flask app
+        images (list[tuple]): (filename, bytes) uploads, sent round-robin
+        concurrency (int): Number of clients sending at once
+        requests (int): Total requests for this level
+
+    Returns:
+        dict: Throughput, latency and per-stage summaries
+    """
+    latencies = []
+    stages = {}
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(idx):
+        nonlocal errors
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        name, data = images[idx % len(images)]
+        start = time.perf_counter()
+        response = client.post("/api/detect-objects", data={"file": (io.BytesIO(data), name, "image/jpeg")},
+                               content_type="multipart/form-data")
+        elapsed = (time.perf_counter() - start) * 1000
+        timing = parse_server_timing(response.headers.get("Server-Timing"))
+        with lock:
+            if response.status_code != 200:
+                errors += 1
+                return
+            latencies.append(elapsed)
+            for stage, duration in timing.items():
+                stages.setdefault(stage, []).append(duration)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        list(clients.map(send, range(requests)))
+    wall = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency_ms": summarize(latencies),
+        "stages_ms": {stage: summarize(samples) for stage, samples in sorted(stages.items()) if stage != "total"},
+    }
+
+
+def print_level(level):
+    latency = level["latency_ms"]
+    print(f"\nconcurrency {level['concurrency']}: {level['requests_per_second']:.2f} req/s, "
+          f"p50 {latency.get('p50', 0):.1f} ms, p95 {latency.get('p95', 0):.1f} ms, "
+          f"p99 {latency.get('p99', 0):.1f} ms, errors {level['errors']}")
+    for stage, summary in level["stages_ms"].items():
+        print(f"  {stage:<16} p50 {summary['p50']:>9.1f}  p95 {summary['p95']:>9.1f}  p99 {summary['p99']:>9.1f} ms")
+
+
+def change(before, after):
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(baseline, results):
+    """Print the differences between a baseline run and this one"""
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'}:")
+    print(f"  peak RSS {baseline['peak_rss_mb']} -> {results['peak_rss_mb']} MB "
+          f"({change(baseline['peak_rss_mb'], results['peak_rss_mb'])})")
+    levels = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in results["levels"]:
+        before = levels.get(level["concurrency"])
+        if before is None:
+            continue
+        print(f"  concurrency {level['concurrency']}: req/s {before['requests_per_second']} -> "
+              f"{level['requests_per_second']} ({change(before['requests_per_second'], level['requests_per_second'])})")
+        for p in PERCENTILES:
+            key = f"p{p}"
+            old, new = before["latency_ms"].get(key), level["latency_ms"].get(key)
+            if old is not None and new is not None:
+                print(f"    latency {key} {old} -> {new} ms ({change(old, new)})")
+        for stage, summary in level["stages_ms"].items():
+            old = before["stages_ms"].get(stage, {}).get("p50")
+            if old is not None:
+                print(f"    {stage} p50 {old} -> {summary['p50']} ms ({change(old, summary['p50'])})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the detection -> price pipeline")
+    parser.add_argument("--concurrency", default="1,4", help="Comma-separated client counts")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per concurrency level")
+    parser.add_argument("--images", nargs="*", default=DEFAULT_IMAGES, help="Photos to upload, round-robin")
+    parser.add_argument("--vision-latency", type=float, default=0.5, help="Seconds per fake vision call")
+    parser.add_argument("--retailer-latency", type=float, default=0.2, help="Seconds per stub retailer response")
+    parser.add_argument("--cache", choices=("cold", "warm"), default="cold")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results JSON of an earlier run")
+    args = parser.parse_args()
+
+    configure_environment(args.cache)
+    sys.path.insert(0, BACKEND_DIR)
+    sys.path.insert(0, REPO_DIR)
+    from PriceScraper.http_session import SessionManager, set_session_manager
+    import flask_api
+    from simple_image_analyzer import FakeVisionBackend
+
+    stub = start_retailer_stub(args.retailer_latency)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    set_session_manager(SessionManager(host_overrides={"www.walmart.com": stub_url, "www.target.com": stub_url}))
+    flask_api.image_analyzer.backend = FakeVisionBackend(latency=args.vision_latency)
+
+    images = []
+    for path in args.images:
+        with open(path, "rb") as image_file:
+            images.append((os.path.basename(path), image_file.read()))
+    if not images:
+        parser.error("No images to upload")
+
+    # One untimed request loads the model pool and warms the connection pools
+    run_level(flask_api.flask_api, images[:1], 1, 1)
+
+    levels = []
+    for concurrency in [int(value) for value in args.concurrency.split(",") if value.strip()]:
+        level = run_level(flask_api.flask_api, images, concurrency, args.requests)
+        print_level(level)
+        levels.append(level)
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "images": [name for name, _ in images],
+            "requests": args.requests,
+            "vision_latency": args.vision_latency,
+            "retailer_latency": args.retailer_latency,
+            "cache": args.cache,
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "levels": levels,
+    }
+    print(f"\nPeak RSS: {results['peak_rss_mb']} MB")
+    stub.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+            output_file.write("\n")
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(json.load(baseline_file), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+In-memory crop preprocessing and encoding for detected objects.
+
+Crops are taken as numpy views of the decoded frame and encoded straight to JPEG bytes,
+so the crop -> encode -> analyze path never touches the disk. The perceptual hash used
+by the analysis cache is computed from the same pixels, and the base64 payload for the
+vision request is built at most once per crop.
+
+Before encoding, each crop is fitted to an upload budget: it is downscaled to a maximum
+long edge and/or pixel count, and the JPEG quality is chosen to fit a byte budget.
+Tiny crops can optionally be padded or letterboxed up to a minimum size. The vision
+model does not need full phone-camera resolution, and smaller payloads upload faster
+and cost fewer tokens.
+
+Writing crops to disk is only done for debugging, when SAVE_DETECTED_CROPS is set.
+"""
+import base64
+import os
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from analysis_cache import dhash
+
+# Load environment variables
+load_dotenv()
+
+# Preprocessing budget (overridable through the environment, 0 disables a limit)
+CROP_MAX_LONG_EDGE = int(os.getenv("CROP_MAX_LONG_EDGE", "768"))
+CROP_MAX_PIXELS = int(os.getenv("CROP_MAX_PIXELS", "0"))
+CROP_MAX_BYTES = int(os.getenv("CROP_MAX_BYTES", "120000"))
+CROP_MAX_QUALITY = int(os.getenv("CROP_MAX_QUALITY", os.getenv("CROP_JPEG_QUALITY", "90")))
+CROP_MIN_QUALITY = int(os.getenv("CROP_MIN_QUALITY", "50"))
+# Tiny crops: "none", "pad" (center on a canvas) or "letterbox" (upscale, then pad)
+CROP_PAD_MODE = os.getenv("CROP_PAD_MODE", "none")
+CROP_MIN_EDGE = int(os.getenv("CROP_MIN_EDGE", "64"))
+# Persist every crop under DETECTED_OBJECTS_FOLDER/<request id>/ for debugging
+SAVE_DETECTED_CROPS = os.getenv("SAVE_DETECTED_CROPS", "").lower() in ("1", "true", "yes")
+
+# Neutral gray used for padding
+PAD_COLOR = (114, 114, 114)
+# Shrinking when even the minimum quality exceeds the byte budget
+MAX_SHRINK_FACTOR = 0.9
+MIN_SHRINK_EDGE = 16
+# Granularity of the JPEG quality search
+QUALITY_STEP = 5
+
+
+class EncodedCrop:
+    """A detected object's crop, encoded once and shared by caching and upload"""
+
+    def __init__(self, jpeg, perceptual_hash=None, label=None, metrics=None):
+        """
+        Args:
+            jpeg (bytes): The JPEG-encoded crop
+            perceptual_hash (int): dHash of the crop pixels, computed from the bytes if omitted
+            label (str): Detector class name, used as a fallback object name
+            metrics (dict): Preprocessing metrics (sizes, quality, byte counts)
+        """
+        self.jpeg = jpeg
+        self.perceptual_hash = perceptual_hash
+        self.label = label
+        self.metrics = metrics or {}
+        self._base64 = None
+
+    @property
+    def base64(self):
+        """Base64 text of the JPEG, built on first use"""
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.jpeg).decode('utf-8')
+        return self._base64
+
+
+def _encode_jpeg(pixels, quality):
+    ok, encoded = cv2.imencode('.jpg', pixels, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("Failed to encode crop")
+    return encoded.tobytes()
+
+
+class CropPreprocessor:
+    """Fits crops to a resolution and byte budget before they are sent for analysis"""
+
+    def __init__(self, max_long_edge=CROP_MAX_LONG_EDGE, max_pixels=CROP_MAX_PIXELS, max_bytes=CROP_MAX_BYTES,
+                 max_quality=CROP_MAX_QUALITY, min_quality=CROP_MIN_QUALITY, pad_mode=CROP_PAD_MODE,
+                 min_edge=CROP_MIN_EDGE):
+        """
+        Args:
+            max_long_edge (int): Longest allowed side in pixels (0 for no limit)
+            max_pixels (int): Largest allowed width * height (0 for no limit)
+            max_bytes (int): Target JPEG size in bytes (0 to always use max_quality)
+            max_quality (int): JPEG quality tried first
+            min_quality (int): Lowest JPEG quality before the crop is shrunk further
+            pad_mode (str): "none", "pad" or "letterbox" for crops smaller than min_edge
+            min_edge (int): Minimum side length for pad_mode
+        """
+        if pad_mode not in ("none", "pad", "letterbox"):
+            raise ValueError(f"Unknown pad mode: {pad_mode}")
+        self.max_long_edge = max_long_edge
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
+        self.max_quality = max_quality
+        self.min_quality = min(min_quality, max_quality)
+        self.pad_mode = pad_mode
+        self.min_edge = min_edge
+
+    def _target_scale(self, height, width):
+        """Downscale factor (<= 1) satisfying the long-edge and pixel budgets"""
+        scale = 1.0
+        if self.max_long_edge and max(height, width) > self.max_long_edge:
+            scale = self.max_long_edge / max(height, width)
+        if self.max_pixels and height * width * scale * scale > self.max_pixels:
+            scale = (self.max_pixels / (height * width)) ** 0.5
+        return scale
+
+    @staticmethod
+    def _resize(pixels, scale):
+        height, width = pixels.shape[:2]
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        return cv2.resize(pixels, size, interpolation=interpolation)
+
+    def _pad(self, pixels):
+        """Pad or letterbox a crop whose short side is below min_edge"""
+        height, width = pixels.shape[:2]
+        if self.pad_mode == "none" or min(height, width) >= self.min_edge:
+            return pixels
+        if self.pad_mode == "letterbox":
+            pixels = self._resize(pixels, self.min_edge / max(height, width))
+            height, width = pixels.shape[:2]
+        canvas_height, canvas_width = max(height, self.min_edge), max(width, self.min_edge)
+        canvas = np.full((canvas_height, canvas_width, pixels.shape[2]), PAD_COLOR, dtype=pixels.dtype)
+        top, left = (canvas_height - height) // 2, (canvas_width - width) // 2
+        canvas[top:top + height, left:left + width] = pixels
+        return canvas
+
+    def _encode_within_budget(self, pixels):
+        """
+        Encode at the highest quality that fits max_bytes, shrinking the crop if needed
+
+        Returns:
+            tuple: (jpeg bytes, quality, final pixels, encode attempts)
+        """
+        attempts = 0
+        while True:
+            jpeg = _encode_jpeg(pixels, self.max_quality)
+            attempts += 1
+            if not self.max_bytes or len(jpeg) <= self.max_bytes:
+                return jpeg, self.max_quality, pixels, attempts
+
+            smallest = _encode_jpeg(pixels, self.min_quality)
+            attempts += 1
+            if len(smallest) > self.max_bytes:
+                if min(pixels.shape[:2]) <= MIN_SHRINK_EDGE:
+                    return smallest, self.min_quality, pixels, attempts
+                # Encoded size grows roughly with pixel count, so shrink by the square root
+                pixels = self._resize(pixels, min((self.max_bytes / len(smallest)) ** 0.5, MAX_SHRINK_FACTOR))
+                continue
+
+            # Binary search (in QUALITY_STEP increments) for the highest quality that fits
+            best = (smallest, self.min_quality)
+            qualities = list(range(self.min_quality + QUALITY_STEP, self.max_quality, QUALITY_STEP))
+            low, high = 0, len(qualities) - 1
+            while low <= high:
+                middle = (low + high) // 2
+                candidate = _encode_jpeg(pixels, qualities[middle])
+                attempts += 1
+                if len(candidate) <= self.max_bytes:
+                    best = (candidate, qualities[middle])
+                    low = middle + 1
+                else:
+                    high = middle - 1
+            return best[0], best[1], pixels, attempts
+
+    def __call__(self, frame, box, label=None):
+        """
+        Crop a box out of a BGR frame, fit it to the budget and encode it
+
+        Args:
+            frame (np.ndarray): Decoded BGR image
+            box (tuple): Pixel coordinates (x1, y1, x2, y2)
+            label (str): Detector class name
+
+        Returns:
+            EncodedCrop: The encoded crop, with per-crop metrics
+        """
+        x1, y1, x2, y2 = box
+        # A view into the frame, no pixel copy
+        view = frame[y1:y2, x1:x2]
+        source_height, source_width = view.shape[:2]
+
+        scale = self._target_scale(source_height, source_width)
+        pixels = self._resize(view, scale) if scale < 1 else view
+        pixels = self._pad(pixels)
+
+        # OpenCV encodes BGR directly, so no color conversion is needed
+        jpeg, quality, pixels, attempts = self._encode_within_budget(pixels)
+
+        metrics = {
+            "source_size": [source_width, source_height],
+            "encoded_size": [pixels.shape[1], pixels.shape[0]],
+            "bytes_before": int(view.nbytes),
+            "bytes_after": len(jpeg),
+            "quality": quality,
+            "encode_attempts": attempts,
+        }
+        perceptual_hash = dhash(cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY))
+        return EncodedCrop(jpeg, perceptual_hash, label, metrics)
+
+
+# Preprocessing stage used by encode_crop unless another one is passed in
+default_preprocessor = CropPreprocessor()
+
+
+def encode_crop(frame, box, label=None, preprocessor=None):
+    """
+    Crop a box out of a BGR frame and encode it in memory
+
+    Args:
+        frame (np.ndarray): Decoded BGR image
+        box (tuple): Pixel coordinates (x1, y1, x2, y2)
+        label (str): Detector class name
+        preprocessor (CropPreprocessor): Budget to apply, the module default if omitted
+
+    Returns:
+        EncodedCrop: The encoded crop
+    """
+    return (preprocessor or default_preprocessor)(frame, box, label)
+
+
+def crop_hash(frame, box):
+    """
+    dHash of a box's pixels without encoding the crop, for grouping look-alike objects
+
+    Args:
+        frame (np.ndarray): Decoded BGR image
+        box (tuple): Pixel coordinates (x1, y1, x2, y2)
+
+    Returns:
+        int: The perceptual hash
+    """
+    x1, y1, x2, y2 = box
+    return dhash(cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY))
+
+
+def summarize_crop_metrics(crops):
+    """Total bytes before/after preprocessing for a list of EncodedCrops"""
+    before = sum(crop.metrics.get("bytes_before", 0) for crop in crops)
+    after = sum(crop.metrics.get("bytes_after", len(crop.jpeg)) for crop in crops)
+    return {
+        "crops": len(crops),
+        "bytes_before": before,
+        "bytes_after": after,
+    }
+
+
+def save_crop(crop, folder, filename):
+    """Write an encoded crop to disk (debugging only)"""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, filename)
+    with open(path, "wb") as crop_file:
+        crop_file.write(crop.jpeg)
+    return path
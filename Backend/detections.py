@@ -0,0 +1,133 @@
+"""
+Vectorized post-processing of raw detector output.
+
+The detector returns one (N, 6) array of [x1, y1, x2, y2, confidence, class_id] rows
+per frame. postprocess() turns that into a Detections result in a single numpy pass:
+boxes are clipped to the frame and snapped to integer pixels, filtered by confidence,
+class, minimum area and per-class top-k, and normalized to 0-1 coordinates. Boxes that
+are empty after clipping are always dropped, since they cannot be cropped or encoded.
+"""
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Filters applied on top of the detector's own confidence threshold (0 / empty disables)
+DETECTION_MIN_CONFIDENCE = float(os.getenv("DETECTION_MIN_CONFIDENCE", "0"))
+DETECTION_CLASSES = [name.strip() for name in os.getenv("DETECTION_CLASSES", "").split(",") if name.strip()]
+DETECTION_EXCLUDE_CLASSES = [name.strip() for name in os.getenv("DETECTION_EXCLUDE_CLASSES", "").split(",")
+                             if name.strip()]
+DETECTION_MAX_PER_CLASS = int(os.getenv("DETECTION_MAX_PER_CLASS", "0"))
+# Smallest box kept, in pixels of the frame
+DETECTION_MIN_AREA = int(os.getenv("DETECTION_MIN_AREA", "0"))
+
+
+class Detections:
+    """Struct-of-arrays result for the detections in one frame, in detector order"""
+
+    def __init__(self, boxes, normalized, confidences, class_ids, class_names):
+        """
+        Args:
+            boxes (np.ndarray): (N, 4) int32 pixel boxes as x1, y1, x2, y2
+            normalized (np.ndarray): (N, 4) float64 boxes as x, y, width, height in 0-1
+            confidences (np.ndarray): (N,) float32 scores
+            class_ids (np.ndarray): (N,) int32 class ids
+            class_names (list[str]): Class name of each detection
+        """
+        self.boxes = boxes
+        self.normalized = normalized
+        self.confidences = confidences
+        self.class_ids = class_ids
+        self.class_names = class_names
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def items(self):
+        """
+        Iterate over the detections as plain Python values
+
+        Yields:
+            tuple: (index, (x1, y1, x2, y2), class name, confidence, bounding box dict)
+        """
+        boxes = self.boxes.tolist()
+        normalized = self.normalized.tolist()
+        confidences = self.confidences.tolist()
+        for idx, (box, (x, y, width, height), confidence, class_name) in enumerate(
+                zip(boxes, normalized, confidences, self.class_names)):
+            yield idx, tuple(box), class_name, confidence, {"x": x, "y": y, "width": width, "height": height}
+
+
+def _class_ids_for(names, class_names):
+    """Ids of the given class names in a detector's names mapping"""
+    wanted = set(class_names)
+    return np.array([class_id for class_id, name in names.items() if name in wanted], dtype=np.int64)
+
+
+def _rank_within_class(class_ids, confidences):
+    """Rank of each detection among detections of the same class, 0 for the most confident"""
+    order = np.lexsort((-confidences, class_ids))
+    sorted_classes = class_ids[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_classes[1:] != sorted_classes[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(order)])
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+    return ranks
+
+
+def postprocess(raw, frame_shape, names, min_confidence=DETECTION_MIN_CONFIDENCE, classes=None,
+                exclude_classes=None, max_per_class=DETECTION_MAX_PER_CLASS, min_area=DETECTION_MIN_AREA):
+    """
+    Clip, filter and normalize one frame's raw detections in a single vectorized pass
+
+    Args:
+        raw (np.ndarray): (N, 6) rows of [x1, y1, x2, y2, confidence, class_id]
+        frame_shape (tuple): Shape of the frame the boxes belong to
+        names (dict): Detector class id -> class name
+        min_confidence (float): Minimum confidence kept
+        classes (list[str]): Only keep these class names (DETECTION_CLASSES if omitted)
+        exclude_classes (list[str]): Drop these class names (DETECTION_EXCLUDE_CLASSES if omitted)
+        max_per_class (int): Keep at most this many detections per class (0 for no limit)
+        min_area (int): Minimum box area in pixels
+
+    Returns:
+        Detections: The kept detections
+    """
+    classes = DETECTION_CLASSES if classes is None else classes
+    exclude_classes = DETECTION_EXCLUDE_CLASSES if exclude_classes is None else exclude_classes
+    height, width = frame_shape[:2]
+
+    raw = np.asarray(raw, dtype=np.float32).reshape(-1, 6)
+    boxes = np.empty((len(raw), 4), dtype=np.int32)
+    boxes[:, [0, 2]] = np.clip(raw[:, [0, 2]], 0, width)
+    boxes[:, [1, 3]] = np.clip(raw[:, [1, 3]], 0, height)
+    confidences = raw[:, 4]
+    class_ids = raw[:, 5].astype(np.int32)
+
+    box_widths = boxes[:, 2] - boxes[:, 0]
+    box_heights = boxes[:, 3] - boxes[:, 1]
+    keep = (box_widths > 0) & (box_heights > 0)
+    if min_area:
+        keep &= box_widths * box_heights >= min_area
+    if min_confidence:
+        keep &= confidences >= min_confidence
+    if classes:
+        keep &= np.isin(class_ids, _class_ids_for(names, classes))
+    if exclude_classes:
+        keep &= ~np.isin(class_ids, _class_ids_for(names, exclude_classes))
+    if max_per_class and keep.any():
+        ranks = np.full(len(keep), max_per_class, dtype=np.int64)
+        ranks[keep] = _rank_within_class(class_ids[keep], confidences[keep])
+        keep &= ranks < max_per_class
+
+    boxes = boxes[keep]
+    frame_size = np.array([width, height], dtype=np.float64)
+    normalized = np.empty((len(boxes), 4), dtype=np.float64)
+    normalized[:, :2] = boxes[:, :2] / frame_size
+    normalized[:, 2:] = (boxes[:, 2:] - boxes[:, :2]) / frame_size
+
+    class_ids = class_ids[keep]
+    return Detections(boxes, normalized, confidences[keep], class_ids,
+                      [names[class_id] for class_id in class_ids.tolist()])
@@ -0,0 +1,421 @@
+"""
+Shared YOLO detector: one warm model pool per process behind a common detect() API.
+
+Every entry point used to load YOLO('yolov8n.pt') on its own (and Bounding_Boxes even
+reloaded it on every call). get_detector() loads the configured model once per process,
+runs a warmup inference so graph optimization and lazy initialization are paid at
+startup, and hands out instances from a small pool so concurrent requests never share
+a model object.
+
+Three CPU backends are supported:
+
+- "pytorch": the ultralytics model, with torch intra/inter-op thread counts applied
+- "onnx": an exported ONNX model run directly on ONNX Runtime
+- "openvino": an exported OpenVINO IR model
+
+The exported backends are run here rather than through ultralytics so their session
+thread counts can be tuned. Pre-processing (letterbox) and post-processing (NMS) for
+them are done in numpy and match ultralytics' defaults. Missing exports are created
+from the .pt weights on first use.
+
+detect(frames) returns one float32 array of shape (N, 6) per frame, with rows
+[x1, y1, x2, y2, confidence, class_id] in the frame's pixel coordinates.
+"""
+import ast
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from tiling import DETECTOR_TILING, greedy_merge, should_tile, tile_windows
+
+# Load environment variables
+load_dotenv()
+
+# Detector configuration (overridable through the environment)
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "pytorch")
+DETECTOR_WEIGHTS = os.getenv("DETECTOR_WEIGHTS", "yolov8n.pt")
+# Path of an exported model; derived from the weights name if empty
+DETECTOR_MODEL_PATH = os.getenv("DETECTOR_MODEL_PATH", "")
+DETECTOR_INPUT_SIZE = int(os.getenv("DETECTOR_INPUT_SIZE", "640"))
+DETECTOR_CONFIDENCE = float(os.getenv("DETECTOR_CONFIDENCE", "0.25"))
+DETECTOR_IOU = float(os.getenv("DETECTOR_IOU", "0.7"))
+DETECTOR_MAX_DETECTIONS = int(os.getenv("DETECTOR_MAX_DETECTIONS", "300"))
+# CPU threads per model instance (0 keeps the runtime's default)
+DETECTOR_INTRA_OP_THREADS = int(os.getenv("DETECTOR_INTRA_OP_THREADS", "0"))
+DETECTOR_INTER_OP_THREADS = int(os.getenv("DETECTOR_INTER_OP_THREADS", "0"))
+# Number of warm model instances available for concurrent inference
+DETECTOR_POOL_SIZE = int(os.getenv("DETECTOR_POOL_SIZE", "1"))
+DETECTOR_WARMUP = os.getenv("DETECTOR_WARMUP", "1").lower() in ("1", "true", "yes")
+# Frames per forward pass
+DETECT_BATCH_SIZE = int(os.getenv("DETECT_BATCH_SIZE", "8"))
+
+LETTERBOX_COLOR = (114, 114, 114)
+# Offset added per class so a single NMS pass never suppresses across classes
+CLASS_OFFSET = 7680
+
+
+def nms(boxes, scores, iou_threshold):
+    """
+    Greedy non-maximum suppression
+
+    Args:
+        boxes (np.ndarray): (N, 4) boxes as x1, y1, x2, y2
+        scores (np.ndarray): (N,) scores
+        iou_threshold (float): Boxes overlapping a kept box by more than this are dropped
+
+    Returns:
+        np.ndarray: Indices of kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / np.maximum(areas[best] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def class_aware_nms(detections, iou_threshold, max_detections=DETECTOR_MAX_DETECTIONS):
+    """NMS over (N, 6) detection rows that only suppresses boxes of the same class"""
+    if len(detections) == 0:
+        return detections
+    offset_boxes = detections[:, :4] + detections[:, 5:6] * CLASS_OFFSET
+    keep = nms(offset_boxes, detections[:, 4], iou_threshold)[:max_detections]
+    return detections[keep]
+
+
+def letterbox(frame, size):
+    """
+    Resize a frame to fit a size x size square, padding the rest (ultralytics style)
+
+    Returns:
+        tuple: (padded image, scale ratio, (left pad, top pad))
+    """
+    height, width = frame.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    if (new_width, new_height) != (width, height):
+        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_width) / 2, (size - new_height) / 2
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    padded = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return padded, ratio, (left, top)
+
+
+class _ExportedModel:
+    """Shared letterbox -> infer -> NMS path for exported YOLOv8 models"""
+
+    def __init__(self, input_size, confidence, iou):
+        self.input_size = input_size
+        self.confidence = confidence
+        self.iou = iou
+        self.names = {}
+        # Frames per forward pass the model accepts, None for a dynamic batch dimension
+        self.max_batch = None
+
+    def _infer(self, batch):
+        """Run the raw model on an (N, 3, S, S) float32 batch, returning (N, 4 + classes, anchors)"""
+        raise NotImplementedError
+
+    def __call__(self, frames):
+        inputs = []
+        transforms = []
+        for frame in frames:
+            padded, ratio, pad = letterbox(frame, self.input_size)
+            inputs.append(padded)
+            transforms.append((ratio, pad, frame.shape[:2]))
+
+        # BGR HWC uint8 -> RGB CHW float32 in [0, 1]
+        batch = np.stack(inputs)[..., ::-1].transpose(0, 3, 1, 2)
+        batch = np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+        output = self._infer(batch)
+
+        results = []
+        for prediction, (ratio, (left, top), (height, width)) in zip(output, transforms):
+            prediction = prediction.T  # (anchors, 4 + classes)
+            scores = prediction[:, 4:]
+            class_ids = scores.argmax(axis=1)
+            confidences = scores[np.arange(len(scores)), class_ids]
+            mask = confidences > self.confidence
+            xywh = prediction[mask, :4]
+            boxes = np.empty_like(xywh)
+            boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+            boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+
+            detections = np.concatenate(
+                [boxes, confidences[mask, None], class_ids[mask, None].astype(np.float32)], axis=1
+            ).astype(np.float32)
+            detections = class_aware_nms(detections, self.iou)
+
+            # Undo the letterbox and clip to the frame
+            detections[:, [0, 2]] = ((detections[:, [0, 2]] - left) / ratio).clip(0, width)
+            detections[:, [1, 3]] = ((detections[:, [1, 3]] - top) / ratio).clip(0, height)
+            results.append(detections)
+        return results
+
+
+class OnnxRuntimeModel(_ExportedModel):
+    """YOLOv8 exported to ONNX, run on ONNX Runtime's CPU provider"""
+
+    def __init__(self, path, input_size, confidence, iou, intra_op_threads=0, inter_op_threads=0):
+        super().__init__(input_size, confidence, iou)
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        self.session = onnxruntime.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int):
+            self.max_batch = batch_dim
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if "names" in metadata:
+            self.names = ast.literal_eval(metadata["names"])
+
+    def _infer(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVinoModel(_ExportedModel):
+    """YOLOv8 exported to OpenVINO IR, compiled for the CPU device"""
+
+    def __init__(self, path, input_size, confidence, iou, intra_op_threads=0, inter_op_threads=0):
+        super().__init__(input_size, confidence, iou)
+        import openvino
+        import yaml
+
+        if os.path.isdir(path):
+            path = next(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".xml"))
+        config = {}
+        if intra_op_threads:
+            config["INFERENCE_NUM_THREADS"] = intra_op_threads
+        if inter_op_threads:
+            config["NUM_STREAMS"] = inter_op_threads
+        core = openvino.Core()
+        self.compiled = core.compile_model(core.read_model(path), "CPU", config)
+        self.output = self.compiled.output(0)
+        batch_dim = self.compiled.input(0).get_partial_shape()[0]
+        if batch_dim.is_static:
+            self.max_batch = batch_dim.get_length()
+
+        metadata_path = os.path.join(os.path.dirname(path), "metadata.yaml")
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as metadata_file:
+                self.names = yaml.safe_load(metadata_file).get("names", {})
+
+    def _infer(self, batch):
+        return self.compiled(batch)[self.output]
+
+
+class UltralyticsModel:
+    """The ultralytics PyTorch model"""
+
+    def __init__(self, weights, input_size, confidence, iou, intra_op_threads=0, inter_op_threads=0):
+        import torch
+        from ultralytics import YOLO
+
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            try:
+                torch.set_num_interop_threads(inter_op_threads)
+            except RuntimeError as e:
+                # Can only be set before torch starts any inter-op work
+                print(f"Could not set inter-op threads: {str(e)}")
+        self.model = YOLO(weights)
+        self.names = self.model.names
+        self.input_size = input_size
+        self.confidence = confidence
+        self.iou = iou
+
+    def __call__(self, frames):
+        results = self.model(frames, imgsz=self.input_size, conf=self.confidence, iou=self.iou, verbose=False)
+        return [result.boxes.data.cpu().numpy().astype(np.float32) for result in results]
+
+
+def export_model(weights, backend, input_size):
+    """Export .pt weights for an exported backend and return the exported path"""
+    from ultralytics import YOLO
+
+    export_format = {"onnx": "onnx", "openvino": "openvino"}[backend]
+    print(f"Exporting {weights} to {export_format}...")
+    # A dynamic batch dimension, so that tiles and multi-image requests share forward passes
+    return YOLO(weights).export(format=export_format, imgsz=input_size, dynamic=True)
+
+
+def default_model_path(weights, backend):
+    """Where ultralytics writes the export of the given weights"""
+    stem = os.path.splitext(weights)[0]
+    return f"{stem}.onnx" if backend == "onnx" else f"{stem}_openvino_model"
+
+
+class Detector:
+    """A pool of warm model instances behind a thread-safe detect() call"""
+
+    def __init__(self, backend=DETECTOR_BACKEND, weights=DETECTOR_WEIGHTS, model_path=DETECTOR_MODEL_PATH,
+                 input_size=DETECTOR_INPUT_SIZE, confidence=DETECTOR_CONFIDENCE, iou=DETECTOR_IOU,
+                 intra_op_threads=DETECTOR_INTRA_OP_THREADS, inter_op_threads=DETECTOR_INTER_OP_THREADS,
+                 pool_size=DETECTOR_POOL_SIZE, batch_size=DETECT_BATCH_SIZE, warmup=DETECTOR_WARMUP,
+                 tiling=DETECTOR_TILING):
+        """
+        Args:
+            backend (str): "pytorch", "onnx" or "openvino"
+            weights (str): ultralytics .pt weights
+            model_path (str): Exported model for the onnx/openvino backends
+            input_size (int): Square inference size
+            confidence (float): Minimum confidence kept
+            iou (float): NMS IoU threshold
+            intra_op_threads (int): Threads used inside each operator (0 for default)
+            inter_op_threads (int): Operators run in parallel (0 for default)
+            pool_size (int): Number of model instances for concurrent detect() calls
+            batch_size (int): Frames per forward pass
+            warmup (bool): Run a dummy inference on every instance at load time
+            tiling (str): "auto", "always" or "off" for tiled inference on large frames
+        """
+        if backend not in ("pytorch", "onnx", "openvino"):
+            raise ValueError(f"Unknown detector backend: {backend}")
+        if tiling not in ("auto", "always", "off"):
+            raise ValueError(f"Unknown tiling mode: {tiling}")
+        self.tiling = tiling
+        self.backend = backend
+        self.input_size = input_size
+        self.batch_size = max(batch_size, 1)
+
+        if backend == "pytorch":
+            factory = lambda: UltralyticsModel(weights, input_size, confidence, iou,
+                                               intra_op_threads, inter_op_threads)
+        else:
+            model_path = model_path or default_model_path(weights, backend)
+            if not os.path.exists(model_path):
+                model_path = export_model(weights, backend, input_size)
+            model_class = OnnxRuntimeModel if backend == "onnx" else OpenVinoModel
+            factory = lambda: model_class(model_path, input_size, confidence, iou,
+                                          intra_op_threads, inter_op_threads)
+
+        start = time.perf_counter()
+        self._pool = queue.Queue()
+        self._models = [factory() for _ in range(max(pool_size, 1))]
+        for model in self._models:
+            self._pool.put(model)
+        self.names = self._models[0].names
+        max_batch = getattr(self._models[0], "max_batch", None)
+        if max_batch and self.batch_size > max_batch:
+            # Models exported with a fixed batch size only take that many frames per pass
+            print(f"Detector model has a fixed batch size of {max_batch}, lowering batch_size from {self.batch_size}")
+            self.batch_size = max_batch
+        if warmup:
+            self.warmup()
+        print(f"Loaded {backend} detector x{len(self._models)} in {time.perf_counter() - start:.2f}s")
+
+    def warmup(self):
+        """Run a dummy inference on every model instance, before any detect() call (e.g. in a forked worker)"""
+        blank = np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8)
+        for model in self._models:
+            model([blank])
+
+    def detect(self, frames, timings=None):
+        """
+        Detect objects in a list of BGR frames, in forward passes of batch_size frames
+
+        Large frames are detected in overlapping tiles plus one full-frame pass when
+        tiling applies (see tiling.py); all tiles of all frames share the same batches.
+
+        Args:
+            frames (list[np.ndarray]): BGR frames
+            timings (dict): If given, filled with seconds spent per stage ("tile", "infer", "merge")
+
+        Returns:
+            list[np.ndarray]: One (N, 6) array of [x1, y1, x2, y2, conf, class_id] per frame
+        """
+        start = time.perf_counter()
+        # Windows per frame; the first window is always the full frame
+        windows = []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            frame_windows = [(0, 0, width, height)]
+            if should_tile(height, width, self.tiling):
+                frame_windows.extend(tile_windows(height, width))
+            windows.append(frame_windows)
+        inputs = [frame[y1:y2, x1:x2] for frame, frame_windows in zip(frames, windows)
+                  for x1, y1, x2, y2 in frame_windows]
+        tiled = time.perf_counter()
+
+        model = self._pool.get()
+        try:
+            outputs = []
+            for batch_start in range(0, len(inputs), self.batch_size):
+                outputs.extend(model(inputs[batch_start:batch_start + self.batch_size]))
+        finally:
+            self._pool.put(model)
+        inferred = time.perf_counter()
+
+        results = []
+        position = 0
+        for frame_windows in windows:
+            frame_outputs = outputs[position:position + len(frame_windows)]
+            position += len(frame_windows)
+            if len(frame_windows) == 1:
+                results.append(frame_outputs[0])
+                continue
+            # Shift tile boxes back into frame coordinates and merge across tiles
+            shifted = []
+            for (x1, y1, _, _), output in zip(frame_windows, frame_outputs):
+                output = output.copy()
+                output[:, [0, 2]] += x1
+                output[:, [1, 3]] += y1
+                shifted.append(output)
+            results.append(greedy_merge(np.concatenate(shifted)))
+        merged = time.perf_counter()
+
+        if timings is not None:
+            timings["tile"] = timings.get("tile", 0.0) + tiled - start
+            timings["infer"] = timings.get("infer", 0.0) + inferred - tiled
+            timings["merge"] = timings.get("merge", 0.0) + merged - inferred
+            timings["inputs"] = timings.get("inputs", 0) + len(inputs)
+        return results
+
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+def get_detector(backend=None, weights=None):
+    """
+    Return the process-wide detector for a backend and weights, loading it on first use
+
+    Defaults to DETECTOR_BACKEND and DETECTOR_WEIGHTS.
+    """
+    key = (backend or DETECTOR_BACKEND, weights or DETECTOR_WEIGHTS)
+    with _detectors_lock:
+        detector = _detectors.get(key)
+        if detector is None:
+            detector = Detector(backend=key[0], weights=key[1])
+            _detectors[key] = detector
+        return detector
+
+
+def warm_up_detectors():
+    """Warm up every detector loaded in this process (e.g. after forking a worker)"""
+    with _detectors_lock:
+        detectors = list(_detectors.values())
+    for detector in detectors:
+        detector.warmup()
@@ -1,22 +1,19 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
-import uuid
-import cv2
-import numpy as np
-from PIL import Image
-import io
-import base64
-from ultralytics import YOLO
 import traceback
 from dotenv import load_dotenv
-import re
 import sys
+import threading
 
 # Import price scraper and simplified image analyzer
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from PriceScraper import get_product_price
+from PriceScraper import get_cache_stats, get_retailer_stats, get_single_flight_stats
 from simple_image_analyzer import SimpleImageAnalyzer
+from detector import get_detector
+from pipeline import DetectionPipeline
+from jobs import JobManager, format_ndjson, format_sse
+from metrics import REGISTRY, instrument_flask, listen_to_scraper
 
 # Load environment variables
 load_dotenv()
@@ -24,19 +21,48 @@ load_dotenv()
 flask_api = Flask(__name__)
 CORS(flask_api)  # Enable CORS for all routes
 
-# Load YOLO model
-model = YOLO('yolov8n.pt')
+# Stage timings, Server-Timing headers and the /metrics endpoint
+instrument_flask(flask_api)
+listen_to_scraper()
+
+# Load the shared detector (warm model pool, backend chosen by DETECTOR_BACKEND)
+detector = get_detector()
 
 # Initialize image analysis
 image_analyzer = SimpleImageAnalyzer()
 
-# Temporary folders
-UPLOAD_FOLDER = "temp_uploads"
-DETECTED_OBJECTS_FOLDER = "detected_objects"
+# Component counters exported on /metrics
+REGISTRY.register_stats("price_cache", get_cache_stats)
+REGISTRY.register_stats("price_single_flight", get_single_flight_stats)
+REGISTRY.register_stats("retailer", get_retailer_stats, label="host")
+REGISTRY.register_stats("analysis_cache", image_analyzer.cache_stats)
+REGISTRY.register_stats("analysis_single_flight", image_analyzer.single_flight_stats)
+
+# decode -> detect -> crop -> analyze -> price, with the analyze -> price chain fanned out
+# on a bounded worker pool
+pipeline = DetectionPipeline(detector=detector, analyzer=image_analyzer)
+
+# Background detection jobs (in-memory job store by default)
+job_manager = JobManager()
+
+# Worker processes serving this app (set by serve.py)
+SERVE_WORKER_PROCESSES = int(os.getenv("SERVE_WORKER_PROCESSES", "1"))
+
+# Multi-photo claims: images per request and time budget
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "50"))
+BATCH_DEADLINE_SECONDS = float(os.getenv("BATCH_DEADLINE_SECONDS", "300"))
 
-# Create directories if they don't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DETECTED_OBJECTS_FOLDER, exist_ok=True)
+def upload_keys(files):
+    """Key each uploaded file by its filename, disambiguating repeated names with #2, #3, ..."""
+    keys = []
+    for file in files:
+        key = file.filename or "image"
+        suffix = 2
+        while key in keys:
+            key = f"{file.filename or 'image'}#{suffix}"
+            suffix += 1
+        keys.append(key)
+    return keys
 
 @flask_api.route('/api/detect-objects', methods=['POST'])
 def detect_objects():
@@ -52,149 +78,175 @@ def detect_objects():
     if not file.content_type.startswith('image/'):
         return jsonify({"detail": "File must be an image"}), 400
     
-    # Generate unique filename and save
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(UPLOAD_FOLDER, f"{file_id}_{file.filename}")
-    file.save(file_path)
-    
-    # Clean detected objects folder before processing new image
-    for filename in os.listdir(DETECTED_OBJECTS_FOLDER):
-        os.remove(os.path.join(DETECTED_OBJECTS_FOLDER, filename))
-    
+    # Decode the upload straight from memory
     try:
-        # Run object detection
-        image = cv2.imread(file_path)
-        results = model(image)
-        
-        detected_items = []
+        detections, _, errors = pipeline.detect_uploads([("image", file.read())])
+        if errors:
+            return jsonify({"detail": errors["image"]}), 400
         
-        for idx, detection in enumerate(results[0].boxes.data):
-            x1, y1, x2, y2, conf, cls = detection.tolist()
-            x1, y1, x2, y2 = map(int, [x1, y1, x2, y2])
-            
-            class_name = results[0].names[int(cls)]
-            
-            # Calculate normalized coordinates
-            img_height, img_width = image.shape[:2]
-            norm_x = x1 / img_width
-            norm_y = y1 / img_height
-            norm_width = (x2 - x1) / img_width
-            norm_height = (y2 - y1) / img_height
-            
-            # Extract and save cropped object
-            cropped_object = image[y1:y2, x1:x2]
-            
-            # Convert BGR to RGB (OpenCV uses BGR by default)
-            cropped_object_rgb = cv2.cvtColor(cropped_object, cv2.COLOR_BGR2RGB)
-            
-            # Save as JPEG using PIL (which handles image formats better)
-            cropped_path = os.path.join(DETECTED_OBJECTS_FOLDER, f"{class_name}_{idx}.jpg")
-            Image.fromarray(cropped_object_rgb).save(cropped_path, format='JPEG', quality=95)
-            
-            try:
-                # Analyze the cropped image
-                analysis = image_analyzer.analyze(cropped_path)
-                
-                product_info = {
-                    "name": analysis.get("name", class_name),
-                    "color": analysis.get("color"),
-                    "height": analysis.get("height"),
-                    "width": analysis.get("width"),
-                    "depth": analysis.get("depth"),
-                    "material": analysis.get("material")
-                }
-            except Exception as analysis_error:
-                print(f"Error analyzing image {cropped_path}: {str(analysis_error)}")
-                product_info = {
-                    "name": class_name
-                }
-            
-            # Get pricing information
-            pricing_result = get_product_price(product_info)
-            
-            # Extract price if found, otherwise None
-            price = None
-            value_source = None
-            source_url = None
-            
-            if pricing_result and "price" in pricing_result:
-                # Try to extract numeric price from string like "$123.45" or "Now$21999Now $219.99"
-                price_str = pricing_result.get("price", "")
-                
-                # Clean up the price string
-                # First, try to find a pattern like "$XXX.XX" in the string
-                price_matches = re.findall(r'\$(\d+\.\d+)', price_str)
-                
-                if price_matches:
-                    # Take the first match that looks like a proper price
-                    try:
-                        price = float(price_matches[0])
-                    except (ValueError, TypeError):
-                        price = None
-                else:
-                    # If no matches found, try the original approach with some more cleanup
-                    price_str = price_str.replace("$", "").replace(",", "")
-                    # Remove any text around the price
-                    price_str = re.sub(r'[^\d.]', '', price_str)
-                    try:
-                        price = float(price_str)
-                        # If price seems unreasonably high for a single item, divide by 10
-                        if price > 10000:
-                            price = price / 10
-                    except (ValueError, TypeError):
-                        price = None
-                
-                # Get source information
-                value_source = pricing_result.get("source", None)
-                source_url = pricing_result.get("link", None)
-                
-                # If we found multiple items (e.g., "Set of 5 chairs"), try to divide the price
-                item_description = pricing_result.get("title", "").lower()
-                set_match = re.search(r'set of (\d+)', item_description)
-                if set_match and price is not None:
-                    try:
-                        num_items = int(set_match.group(1))
-                        if num_items > 1:
-                            price = price / num_items
-                            print(f"Adjusted price for set: {price_str} → ${price:.2f} each (set of {num_items})")
-                    except (ValueError, TypeError):
-                        pass
-            
-            # Create the final object with all attributes
-            detected_item = {
-                "id": f"{file_id}_{idx}",
-                "label": product_info.get("name", class_name),
-                "boundingBox": {
-                    "x": norm_x,
-                    "y": norm_y,
-                    "width": norm_width,
-                    "height": norm_height
-                },
-                "estimatedValue": price,
-                "valueSource": value_source,
-                "sourceUrl": source_url,
-                "isPriceModified": False,
-                # Add additional details that might be useful on the frontend
-                "details": {
-                    "color": product_info.get("color"),
-                    "material": product_info.get("material"),
-                    "dimensions": f"{product_info.get('height', 0)}cm x {product_info.get('width', 0)}cm x {product_info.get('depth', 0)}cm"
-                }
-            }
-            
-            detected_items.append(detected_item)
-        
-        return jsonify(detected_items)
+        # Analyze and price every detected object concurrently
+        return jsonify(pipeline.analyze_and_price(detections))
     
     except Exception as e:
         print(f"Error processing image: {str(e)}")
         print(traceback.format_exc())
         return jsonify({"detail": f"Error processing image: {str(e)}"}), 500
+
+@flask_api.route('/api/detect-objects/batch', methods=['POST'])
+def detect_objects_batch():
+    """
+    Detect, analyze and price the objects in every photo of a claim
+    
+    Expects one or more images under the "files" form field. Detection runs in batched
+    forward passes across all images, and analysis/pricing is fanned out across the
+    whole claim at once. The response maps each upload's filename to its items, or to
+    an error detail if that image could not be processed.
+    """
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({"detail": "No files provided"}), 400
+    if len(files) > BATCH_MAX_IMAGES:
+        return jsonify({"detail": f"At most {BATCH_MAX_IMAGES} images per batch"}), 400
+    
+    response = {}
+    uploads = []  # (key, bytes)
+    
+    for file, key in zip(files, upload_keys(files)):
+        if not file.content_type or not file.content_type.startswith('image/'):
+            response[key] = {"detail": "File must be an image"}
+            continue
+        
+        response[key] = None
+        uploads.append((key, file.read()))
+    
+    try:
+        # One batched detector call and one fan-out over every object in the claim
+        response.update(pipeline.run(uploads, deadline_seconds=BATCH_DEADLINE_SECONDS))
+        
+        return jsonify(response)
+    
+    except Exception as e:
+        print(f"Error processing batch: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({"detail": f"Error processing batch: {str(e)}"}), 500
+
+def run_detection_job(job, uploads):
+    """
+    Job body: detect, analyze and price every uploaded image, emitting items as they finish
+    
+    Args:
+        job (JobContext): Progress reporting handle
+        uploads (list): (key, bytes) pairs for each uploaded image
+    """
+    detections, owners, errors = pipeline.detect_uploads(uploads)
+    for key, detail in errors.items():
+        job.emit("error", image=key, detail=detail)
+    job.set_total(len(detections))
+    
+    emitted = set()
+    emitted_lock = threading.Lock()
+    
+    def emit_item(idx, item):
+        with emitted_lock:
+            if idx in emitted:
+                return
+            emitted.add(idx)
+        job.emit("item", image=owners[idx], item=item)
+    
+    deadline_seconds = BATCH_DEADLINE_SECONDS if len(uploads) - len(errors) > 1 else None
+    detected_items = pipeline.analyze_and_price(detections, deadline_seconds=deadline_seconds, on_item=emit_item)
+    
+    # Items that missed the deadline (or whose analysis failed) are reported unpriced
+    for idx, item in enumerate(detected_items):
+        emit_item(idx, item)
+
+def jobs_available():
+    """Jobs can only be followed if every worker process sees the same job store"""
+    return job_manager.store.shared or SERVE_WORKER_PROCESSES <= 1
+
+def jobs_unavailable():
+    detail = ("Background jobs need a shared job store when served by more than one worker; "
+              "use /api/detect-objects/batch instead")
+    return jsonify({"detail": detail}), 503
+
+@flask_api.route('/api/detect-objects/jobs', methods=['POST'])
+def create_detection_job():
+    """
+    Start a background detection job and return its id immediately
+    
+    Accepts a single image under "file" or several under "files". Progress can be
+    polled at /api/detect-objects/jobs/<job_id> or streamed from .../events.
+    """
+    if not jobs_available():
+        return jobs_unavailable()
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if not files:
+        return jsonify({"detail": "No file provided"}), 400
+    if len(files) > BATCH_MAX_IMAGES:
+        return jsonify({"detail": f"At most {BATCH_MAX_IMAGES} images per job"}), 400
+    for file in files:
+        if not file.content_type or not file.content_type.startswith('image/'):
+            return jsonify({"detail": f"File must be an image: {file.filename}"}), 400
+    
+    # Read the bodies now: the request stream is gone once this handler returns
+    uploads = [(key, file.read()) for file, key in zip(files, upload_keys(files))]
+    
+    job_id = job_manager.submit(lambda job: run_detection_job(job, uploads),
+                                metadata={"images": [key for key, _ in uploads]})
+    
+    return jsonify({
+        "jobId": job_id,
+        "status": "queued",
+        "statusUrl": f"/api/detect-objects/jobs/{job_id}",
+        "eventsUrl": f"/api/detect-objects/jobs/{job_id}/events"
+    }), 202
+
+@flask_api.route('/api/detect-objects/jobs/<job_id>', methods=['GET'])
+def get_detection_job(job_id):
+    """Return the job's status and the items finished so far"""
+    if not jobs_available():
+        return jobs_unavailable()
+    job = job_manager.store.get(job_id)
+    if job is None:
+        return jsonify({"detail": "Job not found"}), 404
+    return jsonify(job)
+
+@flask_api.route('/api/detect-objects/jobs/<job_id>/events', methods=['GET'])
+def stream_detection_job(job_id):
+    """
+    Stream the job's events as they happen
+    
+    Server-Sent Events by default; pass ?format=ndjson (or Accept: application/x-ndjson)
+    for newline-delimited JSON. Each finished item arrives as an "item" event and the
+    stream ends with a "status" event once the job is done or has failed.
+    """
+    if not jobs_available():
+        return jobs_unavailable()
+    if job_manager.store.get(job_id) is None:
+        return jsonify({"detail": "Job not found"}), 404
+    
+    if request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        formatter, mimetype = format_ndjson, 'application/x-ndjson'
+    else:
+        formatter, mimetype = format_sse, 'text/event-stream'
     
-    finally:
-        # Clean up the uploaded file after processing
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    def generate():
+        for event in job_manager.stream(job_id):
+            yield formatter(event)
+    
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@flask_api.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Cache, request-coalescing and retailer health counters for pricing and image analysis"""
+    return jsonify({
+        "priceCache": get_cache_stats(),
+        "priceSingleFlight": get_single_flight_stats(),
+        "retailers": get_retailer_stats(),
+        "analysisCache": image_analyzer.cache_stats(),
+        "analysisSingleFlight": image_analyzer.single_flight_stats()
+    })
 
 if __name__ == '__main__':
     flask_api.run(host='0.0.0.0', port=8000, debug=True) 
\ No newline at end of file
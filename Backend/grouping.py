@@ -0,0 +1,125 @@
+"""
+Near-duplicate grouping of detections before analysis and pricing.
+
+Cluttered rooms produce many detections of the same kind of object (a stack of bowls,
+a row of chairs), and each one used to cost its own vision call and price scrape.
+Detections of the same class in the same photo are grouped when their boxes overlap
+(IoU) or their crops look alike (dHash distance). Groups are the connected components
+of those links, so each group is analyzed and priced once through its most confident
+member and the shared result is fanned back out to every member with a quantity.
+"""
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+GROUP_DUPLICATES = os.getenv("GROUP_DUPLICATES", "1").lower() in ("1", "true", "yes")
+# Same-class boxes overlapping at least this much are grouped (0 disables)
+GROUP_IOU_THRESHOLD = float(os.getenv("GROUP_IOU_THRESHOLD", "0.5"))
+# Same-class crops whose 64-bit dHashes differ in at most this many bits are grouped (-1 disables)
+GROUP_MAX_HASH_DISTANCE = int(os.getenv("GROUP_MAX_HASH_DISTANCE", "4"))
+
+
+def pairwise_iou(boxes):
+    """(N, N) IoU matrix for (N, 4) boxes as x1, y1, x2, y2"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    inter_w = np.clip(np.minimum(boxes[:, None, 2], boxes[None, :, 2]) -
+                      np.maximum(boxes[:, None, 0], boxes[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(boxes[:, None, 3], boxes[None, :, 3]) -
+                      np.maximum(boxes[:, None, 1], boxes[None, :, 1]), 0, None)
+    inter = inter_w * inter_h
+    return inter / np.maximum(areas[:, None] + areas[None, :] - inter, 1e-9)
+
+
+def pairwise_hamming(hashes):
+    """(N, N) matrix of bit differences between 64-bit hashes"""
+    values = np.asarray(hashes, dtype=np.uint64).reshape(-1)
+    xor = values[:, None] ^ values[None, :]
+    return np.unpackbits(xor.view(np.uint8), axis=-1).reshape(len(values), len(values), 64).sum(axis=-1)
+
+
+def group_labels(boxes, class_ids, image_ids, hashes=None, iou_threshold=GROUP_IOU_THRESHOLD,
+                 max_hash_distance=GROUP_MAX_HASH_DISTANCE):
+    """
+    Connected components of near-duplicate links between detections
+
+    Args:
+        boxes (np.ndarray): (N, 4) pixel boxes
+        class_ids (np.ndarray): (N,) class of each detection
+        image_ids (np.ndarray): (N,) photo each detection came from
+        hashes (list[int]): Perceptual hash of each crop, or None to link on IoU only
+        iou_threshold (float): Minimum IoU for an overlap link (0 disables)
+        max_hash_distance (int): Maximum dHash distance for a similarity link (-1 disables)
+
+    Returns:
+        np.ndarray: (N,) group label of each detection (the index of one member)
+    """
+    count = len(class_ids)
+    class_ids = np.asarray(class_ids)
+    image_ids = np.asarray(image_ids)
+    candidates = (class_ids[:, None] == class_ids[None, :]) & (image_ids[:, None] == image_ids[None, :])
+
+    links = np.zeros((count, count), dtype=bool)
+    if iou_threshold > 0:
+        links |= pairwise_iou(boxes) >= iou_threshold
+    if hashes is not None and max_hash_distance >= 0 and None not in hashes:
+        links |= pairwise_hamming(hashes) <= max_hash_distance
+    links &= candidates
+
+    # Union-find over the linked pairs
+    parents = list(range(count))
+
+    def find(node):
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    for first, second in np.argwhere(np.triu(links, k=1)).tolist():
+        root_first, root_second = find(first), find(second)
+        if root_first != root_second:
+            parents[max(root_first, root_second)] = min(root_first, root_second)
+    return np.array([find(node) for node in range(count)], dtype=np.int64)
+
+
+def group_detections(detections, iou_threshold=GROUP_IOU_THRESHOLD, max_hash_distance=GROUP_MAX_HASH_DISTANCE):
+    """
+    Group near-duplicate detections from DetectionPipeline.crop
+
+    Args:
+        detections (list[dict]): Detections with "box", "class_name", "file_id",
+            "confidence" and "perceptual_hash" (None when the crop was not hashed) keys
+        iou_threshold (float): Minimum IoU for an overlap link
+        max_hash_distance (int): Maximum dHash distance for a similarity link
+
+    Returns:
+        list[list[int]]: Detection indices per group, in detection order, each group
+        starting with its representative (the most confident member)
+    """
+    if not detections:
+        return []
+    if not GROUP_DUPLICATES:
+        return [[idx] for idx in range(len(detections))]
+
+    _, class_ids = np.unique([detection["class_name"] for detection in detections], return_inverse=True)
+    _, image_ids = np.unique([detection["file_id"] for detection in detections], return_inverse=True)
+    # Look-alike crops can only be linked when every detection has a hashed crop
+    hashes = [detection.get("perceptual_hash") for detection in detections]
+    if any(phash is None for phash in hashes):
+        hashes = None
+    labels = group_labels(
+        [detection["box"] for detection in detections],
+        class_ids,
+        image_ids,
+        hashes=hashes,
+        iou_threshold=iou_threshold,
+        max_hash_distance=max_hash_distance,
+    )
+
+    groups = {}
+    for idx, label in enumerate(labels.tolist()):
+        groups.setdefault(label, []).append(idx)
+    return [sorted(members, key=lambda idx: -detections[idx]["confidence"]) for members in groups.values()]
@@ -0,0 +1,116 @@
+"""
+Decode uploaded images straight from the request buffer.
+
+Uploads are decoded with cv2.imdecode from the in-memory bytes instead of being written
+to temp_uploads/ and read back. Only the image header is parsed up front (size and EXIF
+orientation). When the frame is far larger than the detector input, OpenCV's reduced
+JPEG decode modes (1/2, 1/4, 1/8 scale) are used, which skip most of the IDCT work. The
+decoded frame is then rotated/flipped according to its EXIF orientation so boxes line up
+with what the user sees.
+"""
+import io
+import os
+import cv2
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Detector input size; frames are never reduced below DECODE_MIN_LONG_EDGE so crops keep detail
+DETECTOR_INPUT_SIZE = int(os.getenv("DETECTOR_INPUT_SIZE", "640"))
+DECODE_MIN_LONG_EDGE = int(os.getenv("DECODE_MIN_LONG_EDGE", "1280"))
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+def read_header(data):
+    """
+    Read an image's size, format and EXIF orientation without decoding its pixels
+
+    Returns:
+        tuple: (width, height, format, orientation), or None if the header can't be parsed
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            return image.width, image.height, image.format, orientation
+    except Exception:
+        return None
+
+
+def choose_reduction(width, height, target_size=DETECTOR_INPUT_SIZE, min_long_edge=DECODE_MIN_LONG_EDGE):
+    """Largest JPEG reduction factor that keeps the long edge at or above the minimum"""
+    long_edge = max(width, height)
+    floor = max(target_size, min_long_edge)
+    for factor in sorted(REDUCED_DECODE_FLAGS, reverse=True):
+        if long_edge / factor >= floor:
+            return factor
+    return 1
+
+
+def apply_exif_orientation(frame, orientation):
+    """Rotate/flip a decoded frame so it is displayed upright"""
+    if orientation == 2:
+        return cv2.flip(frame, 1)
+    if orientation == 3:
+        return cv2.rotate(frame, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(frame, 0)
+    if orientation == 5:
+        return cv2.transpose(frame)
+    if orientation == 6:
+        return cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(frame), -1)
+    if orientation == 8:
+        return cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return frame
+
+
+def decode_upload(data, target_size=DETECTOR_INPUT_SIZE, min_long_edge=DECODE_MIN_LONG_EDGE):
+    """
+    Decode an uploaded image from memory into an upright BGR frame
+
+    Args:
+        data (bytes): The uploaded file contents
+        target_size (int): Detector input size
+        min_long_edge (int): Never reduce the frame's long edge below this
+
+    Returns:
+        np.ndarray: The decoded BGR frame
+
+    Raises:
+        ValueError: If the data is not a decodable image
+    """
+    if not data:
+        raise ValueError("Empty upload")
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    header = read_header(data)
+
+    flags = cv2.IMREAD_COLOR
+    orientation = 1
+    if header is not None:
+        width, height, image_format, orientation = header
+        if image_format == "JPEG":
+            factor = choose_reduction(width, height, target_size, min_long_edge)
+            if factor > 1:
+                flags = REDUCED_DECODE_FLAGS[factor]
+
+    # Orientation is applied explicitly below, so OpenCV must not apply it as well
+    try:
+        frame = cv2.imdecode(buffer, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    except cv2.error as e:
+        raise ValueError(f"Could not decode image: {e}") from e
+    if frame is None:
+        raise ValueError("Could not decode image")
+
+    return apply_exif_orientation(frame, orientation)
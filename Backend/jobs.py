@@ -0,0 +1,245 @@
+"""
+Background detection jobs with incremental results.
+
+A job is submitted with a callable that does the work on a bounded worker pool and
+reports progress through a JobContext as it goes. Every report is appended to the job's
+event log in a JobStore, so clients can fetch a snapshot at any time or follow the log
+as a stream (Server-Sent Events or NDJSON) and see each item as soon as it is priced.
+
+JobStore is the extension point for sharing job state between processes; the default
+InMemoryJobStore keeps everything in this process. Jobs then live and die with that
+process: served by several worker processes, a job can only be read from the worker
+that started it, and a recycled or restarted worker takes its jobs with it. serve.py
+refuses the job endpoints with more than one worker and never recycles a single worker
+unless the store says it is shared.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Finished jobs are kept this long before being dropped from the store
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+# How long a stream waits for new events before sending a keep-alive
+JOB_STREAM_KEEPALIVE_SECONDS = float(os.getenv("JOB_STREAM_KEEPALIVE_SECONDS", "15"))
+
+FINISHED_STATUSES = ("done", "failed")
+
+
+class JobStore:
+    """Storage for job state and event logs"""
+
+    # Whether every process sees the same jobs (e.g. a store backed by Redis or a database)
+    shared = False
+
+    def create(self, job_id, metadata):
+        """Register a new queued job"""
+        raise NotImplementedError
+
+    def update(self, job_id, **fields):
+        """Update top-level job fields such as status, total or error"""
+        raise NotImplementedError
+
+    def append_event(self, job_id, event):
+        """Append an event to the job's log and wake up any readers"""
+        raise NotImplementedError
+
+    def finish(self, job_id, status, **fields):
+        """
+        Append the final "status" event and mark the job finished
+
+        The event must be in the log by the time readers see the finished status, since
+        they stop reading then. Stores that can do both atomically should override this.
+        """
+        event = {"type": "status", "status": status}
+        if fields.get("error") is not None:
+            event["error"] = fields["error"]
+        self.append_event(job_id, event)
+        self.update(job_id, status=status, **fields)
+
+    def get(self, job_id):
+        """Return a snapshot of the job (without its event log), or None if unknown"""
+        raise NotImplementedError
+
+    def read_events(self, job_id, cursor, timeout):
+        """
+        Return events after ``cursor``, waiting up to ``timeout`` seconds for new ones
+
+        Returns:
+            tuple: (events, new cursor, whether the job has finished)
+        """
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+    """Job store backed by a dict, for a single process"""
+
+    def __init__(self, ttl_seconds=JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._condition = threading.Condition()
+
+    def _prune(self):
+        """Drop finished jobs older than the TTL (lock held)"""
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["status"] in FINISHED_STATUSES and now - job["updated_at"] > self.ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def create(self, job_id, metadata):
+        with self._condition:
+            self._prune()
+            now = time.time()
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "total": None,
+                "error": None,
+                "metadata": dict(metadata),
+                "created_at": now,
+                "updated_at": now,
+                "events": [],
+            }
+
+    def update(self, job_id, **fields):
+        with self._condition:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = time.time()
+            self._condition.notify_all()
+
+    def append_event(self, job_id, event):
+        with self._condition:
+            job = self._jobs[job_id]
+            job["events"].append(event)
+            job["updated_at"] = time.time()
+            self._condition.notify_all()
+
+    def finish(self, job_id, status, **fields):
+        # Holding the condition for both keeps readers from seeing one without the other
+        with self._condition:
+            super().finish(job_id, status, **fields)
+
+    def get(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = {key: value for key, value in job.items() if key != "events"}
+            snapshot["items"] = [event for event in job["events"] if event.get("type") == "item"]
+            return snapshot
+
+    def read_events(self, job_id, cursor, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return [], cursor, True
+                finished = job["status"] in FINISHED_STATUSES
+                if len(job["events"]) > cursor or finished:
+                    return job["events"][cursor:], len(job["events"]), finished
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], cursor, False
+                self._condition.wait(remaining)
+
+
+class JobContext:
+    """Handle passed to a job's work function for reporting progress"""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+
+    def set_total(self, total):
+        """Record how many items the job will produce, once known"""
+        self.store.update(self.job_id, total=total)
+
+    def emit(self, event_type, **payload):
+        """Append an event (e.g. a finished item) to the job's log"""
+        self.store.append_event(self.job_id, dict(payload, type=event_type))
+
+
+class JobManager:
+    """Runs jobs on a bounded worker pool and records their progress in a JobStore"""
+
+    def __init__(self, store=None, max_workers=JOB_WORKERS):
+        self.store = store if store is not None else InMemoryJobStore()
+        self.max_workers = max_workers
+        # The executor is created lazily so that importing this module never starts threads
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="jobs")
+            return self._executor
+
+    def submit(self, work, metadata=None):
+        """
+        Queue a job
+
+        Args:
+            work (callable): Called with a JobContext; its return value is ignored
+            metadata (dict): Extra fields stored with the job
+
+        Returns:
+            str: The new job's id
+        """
+        job_id = str(uuid.uuid4())
+        self.store.create(job_id, metadata or {})
+        self._get_executor().submit(self._run, job_id, work)
+        return job_id
+
+    def _run(self, job_id, work):
+        self.store.update(job_id, status="running")
+        try:
+            work(JobContext(self.store, job_id))
+        except Exception as e:
+            print(f"Job {job_id} failed: {str(e)}")
+            print(traceback.format_exc())
+            self.store.finish(job_id, "failed", error=str(e))
+            return
+        self.store.finish(job_id, "done")
+
+    def stream(self, job_id, keepalive_seconds=JOB_STREAM_KEEPALIVE_SECONDS):
+        """
+        Yield the job's events as they arrive, ending once the job has finished
+
+        Yields None when no event arrived within ``keepalive_seconds``, so callers can
+        send a keep-alive.
+        """
+        cursor = 0
+        while True:
+            events, cursor, finished = self.store.read_events(job_id, cursor, keepalive_seconds)
+            for event in events:
+                yield event
+            if finished:
+                return
+            if not events:
+                yield None
+
+
+def format_sse(event):
+    """Format an event (or a keep-alive for None) as a Server-Sent Events message"""
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def format_ndjson(event):
+    """Format an event as one NDJSON line (keep-alives become blank lines)"""
+    if event is None:
+        return "\n"
+    return json.dumps(event) + "\n"
@@ -0,0 +1,397 @@
+"""
+Lightweight metrics and per-request tracing for the detection APIs.
+
+Metrics are kept in process memory and rendered in the Prometheus text format on
+/metrics:
+
+- emberaid_stage_seconds{stage}: latency histogram of every pipeline stage (decode,
+  detect, crop_encode, group, analyze, vision_call, price, price_parse, ...)
+- emberaid_stage_in_flight{stage}: stages currently running
+- emberaid_http_requests_total{endpoint,status}, emberaid_http_request_seconds{endpoint}
+  and emberaid_http_requests_in_flight{endpoint} for the API itself
+- emberaid_scraper_requests_total{host,status}, emberaid_scraper_request_seconds{host}
+  and emberaid_provider_search_seconds{provider,outcome} from the price scraper's
+  telemetry events
+- gauges read from component stats at scrape time (cache hit ratios, request
+  coalescing, retailer breakers), added with register_stats
+
+Every request also carries a Trace of the stages it ran, summed per stage, which is
+returned in a Server-Timing response header unless SERVER_TIMING=0. Stages that run on
+worker threads are included when the work was submitted with contextvars copied (as
+ObjectPipeline does).
+
+Each worker process keeps its own metrics; scrape every worker, or run a single one.
+"""
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Return per-request stage timings in a Server-Timing header
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1").lower() not in ("0", "false", "no")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from a cache hit to a slow vision call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    """A named family of series, one per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            lines.extend(line for key, value in series for line in self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down"""
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (not yet cumulative) counts, then the sum
+                series = self._series[key] = [0] * len(self.buckets) + [0.0]
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[idx] += 1
+                    break
+            series[-1] += value
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics of one process, plus stats sources read at scrape time"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._stats_sources = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_stats(self, prefix, stats_fn, label=None):
+        """
+        Export a component's stats dict as gauges, read on every scrape
+
+        Args:
+            prefix (str): Metric name prefix, e.g. "price_cache"
+            stats_fn (callable): Returns a dict of numbers, or with label, a dict of such
+                dicts keyed by the label value (e.g. per-host stats)
+            label (str): Label name for the outer keys of a nested stats dict
+        """
+        with self._lock:
+            self._stats_sources = [source for source in self._stats_sources if source[0] != prefix]
+            self._stats_sources.append((prefix, stats_fn, label))
+
+    def _render_stats(self):
+        with self._lock:
+            sources = list(self._stats_sources)
+        lines = []
+        for prefix, stats_fn, label in sources:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                print(f"Could not read {prefix} stats: {e}")
+                continue
+            rows = stats.items() if label else [(None, stats)]
+            families = {}
+            for label_value, values in rows:
+                pairs = [(label, label_value)] if label else []
+                for key, value in values.items():
+                    if isinstance(value, str):
+                        # States become one series per value, e.g. breaker_state="open"
+                        families.setdefault(key, []).append((pairs + [(key, value)], 1))
+                    elif isinstance(value, (int, float)):
+                        families.setdefault(key, []).append((pairs, int(value) if isinstance(value, bool) else value))
+            for key, series in sorted(families.items()):
+                name = f"emberaid_{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                for pairs, value in series:
+                    lines.append(f"{name}{_format_labels((), (), pairs)} {_format_value(value)}")
+        return lines
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines = [line for metric in metrics for line in metric.render()]
+        lines.extend(self._render_stats())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("emberaid_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+STAGE_IN_FLIGHT = REGISTRY.gauge("emberaid_stage_in_flight", "Pipeline stages currently running", ["stage"])
+HTTP_REQUESTS = REGISTRY.counter("emberaid_http_requests_total", "API requests served", ["endpoint", "status"])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("emberaid_http_request_seconds", "API request latency", ["endpoint"])
+HTTP_IN_FLIGHT = REGISTRY.gauge("emberaid_http_requests_in_flight", "API requests being served", ["endpoint"])
+SCRAPER_REQUESTS = REGISTRY.counter("emberaid_scraper_requests_total", "Outbound retailer requests",
+                                    ["host", "status"])
+SCRAPER_REQUEST_SECONDS = REGISTRY.histogram("emberaid_scraper_request_seconds", "Outbound retailer request latency",
+                                             ["host"])
+PROVIDER_SEARCH_SECONDS = REGISTRY.histogram("emberaid_provider_search_seconds", "Price provider search latency",
+                                             ["provider", "outcome"])
+
+
+class Trace:
+    """Stage timings of one request, summed per stage"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = {}  # stage -> [total seconds, count]
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            span = self.spans.setdefault(stage, [0.0, 0])
+            span[0] += seconds
+            span[1] += 1
+
+    def server_timing(self):
+        """Format as a Server-Timing header value (durations in milliseconds)"""
+        with self._lock:
+            spans = [(stage, seconds, count) for stage, (seconds, count) in self.spans.items()]
+        entries = [f'{stage};dur={seconds * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+                   for stage, seconds, count in spans]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_trace = contextvars.ContextVar("emberaid_trace", default=None)
+
+
+def start_trace():
+    """Start tracing the current request, returning the Trace and a token for end_trace"""
+    trace = Trace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def observe_stage(stage, seconds):
+    """Record a stage that was timed elsewhere (e.g. the detector's own timings)"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a pipeline stage, in the histograms and the current request's trace"""
+    STAGE_IN_FLIGHT.inc(stage=name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_IN_FLIGHT.dec(stage=name)
+        observe_stage(name, time.perf_counter() - start)
+
+
+def _on_scraper_event(event, seconds, labels):
+    if event == "http_request":
+        SCRAPER_REQUESTS.inc(host=labels["host"], status=labels["status"])
+        if seconds is not None:
+            SCRAPER_REQUEST_SECONDS.observe(seconds, host=labels["host"])
+    elif event == "provider_search":
+        PROVIDER_SEARCH_SECONDS.observe(seconds, provider=labels["provider"], outcome=labels["outcome"])
+
+
+def listen_to_scraper():
+    """Feed the price scraper's telemetry events into the metrics"""
+    from PriceScraper import telemetry
+    telemetry.add_listener(_on_scraper_event)
+
+
+def instrument_flask(app, registry=REGISTRY):
+    """Time every request of a Flask app, add Server-Timing headers and serve /metrics"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_request():
+        g.metrics_endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        g.metrics_trace, g.metrics_token = start_trace()
+        HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+    @app.after_request
+    def _finish_request(response):
+        trace = g.pop("metrics_trace", None)
+        if trace is None:
+            return response
+        endpoint = g.metrics_endpoint
+        HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - trace.start, endpoint=endpoint)
+        if SERVER_TIMING and trace.spans:
+            response.headers["Server-Timing"] = trace.server_timing()
+        return response
+
+    @app.teardown_request
+    def _end_request(error=None):
+        token = g.pop("metrics_token", None)
+        if token is None:
+            return
+        HTTP_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+        if g.pop("metrics_trace", None) is not None:
+            # after_request never ran (unhandled exception)
+            HTTP_REQUESTS.inc(endpoint=g.metrics_endpoint, status=500)
+        try:
+            end_trace(token)
+        except (ValueError, RuntimeError):
+            # Streaming responses finish in a different context
+            pass
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def _route_path(app, scope):
+    """The route template a request matches (keeps path parameters out of the labels)"""
+    from starlette.routing import Match
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+def instrument_fastapi(app, registry=REGISTRY):
+    """Time every request of a FastAPI app, add Server-Timing headers and serve /metrics"""
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+
+    @app.middleware("http")
+    async def _metrics_middleware(request: Request, call_next):
+        endpoint = _route_path(app, request.scope)
+        trace, token = start_trace()
+        HTTP_IN_FLIGHT.inc(endpoint=endpoint)
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            if SERVER_TIMING and trace.spans:
+                response.headers["Server-Timing"] = trace.server_timing()
+            return response
+        finally:
+            HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+            HTTP_REQUESTS.inc(endpoint=endpoint, status=status)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - trace.start, endpoint=endpoint)
+            end_trace(token)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(registry.render(), headers={"Content-Type": CONTENT_TYPE})
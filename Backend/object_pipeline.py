@@ -0,0 +1,156 @@
+"""
+Bounded concurrent execution of the per-object analyze -> price chain.
+
+Every detection in a photo goes through the same two slow, I/O bound stages
+(vision analysis, then price scraping). Running them one detection at a time
+makes request latency grow linearly with the number of objects, so this module
+runs the chain for all detections on a shared worker pool, with a separate
+concurrency limit per stage and an overall per-request deadline. Work runs with a copy
+of the submitting thread's context, so per-request state such as the metrics trace
+follows each detection through both stages.
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Pipeline tuning (overridable through the environment)
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "8"))
+ANALYZE_CONCURRENCY = int(os.getenv("ANALYZE_CONCURRENCY", "4"))
+PRICE_CONCURRENCY = int(os.getenv("PRICE_CONCURRENCY", "4"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "90"))
+
+
+class ObjectPipeline:
+    """Runs the analyze -> price chain for many detections on a bounded worker pool"""
+
+    def __init__(self, max_workers=PIPELINE_MAX_WORKERS, analyze_concurrency=ANALYZE_CONCURRENCY,
+                 price_concurrency=PRICE_CONCURRENCY, deadline_seconds=REQUEST_DEADLINE_SECONDS):
+        self.max_workers = max_workers
+        self.deadline_seconds = deadline_seconds
+        self._analyze_slots = threading.BoundedSemaphore(analyze_concurrency)
+        self._price_slots = threading.BoundedSemaphore(price_concurrency)
+        # The executor is created lazily so that importing this module never starts threads
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="object-pipeline")
+            return self._executor
+
+    @staticmethod
+    def _acquire(slots, deadline):
+        """Wait for a stage slot, giving up once the request deadline has passed"""
+        remaining = deadline - time.monotonic()
+        return remaining > 0 and slots.acquire(timeout=remaining)
+
+    def run(self, items, analyze, price, deadline_seconds=None, batch_size=1, on_result=None):
+        """
+        Runs analyze -> price for every item concurrently.
+
+        Args:
+            items (list): Per-detection inputs, passed to ``analyze``
+            analyze (callable): Maps a list of items to a list of product_info dicts in the
+                same order
+            price (callable): Maps a product_info dict to a pricing result
+            deadline_seconds (float): Overall time budget, defaults to the pipeline's
+            batch_size (int): Number of items handed to ``analyze`` per call
+            on_result (callable): Called as on_result(index, product_info, pricing_result)
+                from a worker thread as soon as each item finishes both stages
+
+        Returns:
+            list[tuple]: (product_info, pricing_result) for each item, in input order.
+                Stages that did not complete before the deadline are returned as None.
+        """
+        if not items:
+            return []
+
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+        deadline = time.monotonic() + deadline_seconds
+        batch_size = max(batch_size, 1)
+
+        executor = self._get_executor()
+        product_infos = [None] * len(items)
+        price_futures = {}
+        state_lock = threading.Lock()
+        closed = [False]
+
+        def report(idx, product_info, pricing_result):
+            if on_result is None:
+                return
+            try:
+                on_result(idx, product_info, pricing_result)
+            except Exception as e:
+                print(f"Error reporting object {idx}: {str(e)}")
+
+        def price_item(idx, product_info):
+            if not self._acquire(self._price_slots, deadline):
+                return None
+            try:
+                pricing_result = price(product_info)
+            finally:
+                self._price_slots.release()
+            report(idx, product_info, pricing_result)
+            return pricing_result
+
+        def analyze_chunk(start, chunk):
+            if not self._acquire(self._analyze_slots, deadline):
+                return
+            try:
+                infos = analyze(chunk)
+            finally:
+                self._analyze_slots.release()
+
+            # Each item is priced as soon as its own analysis is available
+            with state_lock:
+                for offset, product_info in enumerate(infos):
+                    product_infos[start + offset] = product_info
+                    if product_info is not None and not closed[0]:
+                        price_futures[start + offset] = executor.submit(contextvars.copy_context().run, price_item,
+                                                                     start + offset, product_info)
+
+        chunk_futures = [executor.submit(contextvars.copy_context().run, analyze_chunk, start,
+                                         items[start:start + batch_size])
+                         for start in range(0, len(items), batch_size)]
+
+        wait(chunk_futures, timeout=max(deadline - time.monotonic(), 0))
+        with state_lock:
+            # Analyses finishing after this point are no longer priced
+            closed[0] = True
+            pending_prices = dict(price_futures)
+            analyzed = list(product_infos)
+        wait(list(pending_prices.values()), timeout=max(deadline - time.monotonic(), 0))
+
+        for future in chunk_futures:
+            if not future.done():
+                # Queued work is dropped; already running stages finish in the background
+                future.cancel()
+            elif not future.cancelled() and future.exception() is not None:
+                print(f"Error analyzing objects: {str(future.exception())}")
+
+        results = []
+        for idx in range(len(items)):
+            product_info = analyzed[idx]
+            pricing_result = None
+            future = pending_prices.get(idx)
+            if future is not None:
+                if future.done() and future.exception() is None:
+                    pricing_result = future.result()
+                elif future.done():
+                    print(f"Error pricing object {idx}: {str(future.exception())}")
+                else:
+                    future.cancel()
+            if product_info is None or (future is not None and not future.done()):
+                print(f"Object {idx} did not finish within {deadline_seconds}s deadline")
+            results.append((product_info, pricing_result))
+
+        return results
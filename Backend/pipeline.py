@@ -0,0 +1,501 @@
+"""
+The detection pipeline shared by every entry point.
+
+The Flask and FastAPI APIs, the Bounding_Boxes cropper and process_images all run some
+part of the same chain:
+
+    decode -> detect -> filter -> crop -> group -> analyze -> price
+
+DetectionPipeline implements each stage once, as a method timed under the stage's name
+in the metrics trace, and composes them for whole uploads. Entry points are thin
+adapters that pick the stages they need, so caching, batching, grouping and concurrency
+work apply to all of them at once.
+
+Execution depends on the caller:
+
+- Synchronous callers (Flask request threads, background jobs, scripts) run the CPU
+  stages on their own thread and fan analyze -> price out through ObjectPipeline, which
+  bounds each stage's concurrency and enforces the request deadline.
+- Async callers use the *_async methods, which run every stage on the executor
+  configured for it (the executors argument, keyed by stage name). CPU stages default to
+  a bounded inference executor shared by all pipelines (INFERENCE_WORKERS threads, the
+  detector pool size by default), the vision call to the loop's default executor, and
+  pricing is awaited natively on the loop.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from PriceScraper import get_product_price, get_product_price_async, parse_price
+from crops import SAVE_DETECTED_CROPS, EncodedCrop, crop_hash, encode_crop, save_crop, summarize_crop_metrics
+from detections import postprocess
+from detector import DETECTOR_POOL_SIZE, get_detector
+from grouping import group_detections
+from image_decode import decode_upload
+from metrics import observe_stage, stage
+from object_pipeline import ObjectPipeline
+
+# Load environment variables
+load_dotenv()
+
+# Threads for the CPU-bound stages of async runs, bounded to the detector pool so that
+# waiting requests queue in admission control rather than on the executor
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(DETECTOR_POOL_SIZE, 1))))
+
+# Debug output folder for crops (only written when SAVE_DETECTED_CROPS is set)
+DETECTED_OBJECTS_FOLDER = os.getenv("DETECTED_OBJECTS_FOLDER", "detected_objects")
+
+# Stages that run on the inference executor unless configured otherwise
+CPU_STAGES = ("decode", "detect", "filter", "crop", "group")
+
+_inference_executor = None
+_inference_executor_lock = threading.Lock()
+
+
+def get_inference_executor():
+    """Return the shared inference executor, creating it on first use"""
+    global _inference_executor
+    with _inference_executor_lock:
+        if _inference_executor is None:
+            _inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+        return _inference_executor
+
+
+def extract_price(pricing_result):
+    """
+    Extract a numeric price and its source from a pricing result
+
+    Returns:
+        tuple: (price, value_source, source_url), with None for anything not found
+    """
+    if not pricing_result or "price" not in pricing_result:
+        return None, None, None
+
+    # Normalize strings like "$123.45", "Now$21999Now $219.99" or "$12.99 - $24.99"
+    with stage("price_parse"):
+        parsed = parse_price(pricing_result.get("price"), pricing_result.get("name", ""))
+
+    # Listings of several items (e.g., "Set of 5 chairs") are priced per item
+    price = parsed.unit_price
+    if parsed.unit_count > 1 and price is not None:
+        print(f"Adjusted price for set: {parsed.raw} → ${price:.2f} each (set of {parsed.unit_count})")
+
+    return price, pricing_result.get("source"), pricing_result.get("link")
+
+
+def build_detected_item(detection, product_info, pricing_result, quantity=1, group_id=None):
+    """
+    Build the response item for one analyzed and priced detection
+
+    Args:
+        detection (dict): Detection from DetectionPipeline.crop
+        product_info (dict): Analysis result, None if analysis did not finish
+        pricing_result (dict): Pricing result, None if pricing did not finish
+        quantity (int): Number of near-duplicate detections sharing this result
+        group_id (str): Id of the group's representative detection
+    """
+    class_name = detection["class_name"]
+    if product_info is None:
+        product_info = {"name": class_name}
+
+    price, value_source, source_url = extract_price(pricing_result)
+
+    return {
+        "id": detection["id"],
+        "label": product_info.get("name", class_name),
+        "boundingBox": detection["boundingBox"],
+        "estimatedValue": price,
+        "valueSource": value_source,
+        "sourceUrl": source_url,
+        "isPriceModified": False,
+        "quantity": quantity,
+        "groupId": group_id or detection["id"],
+        # Additional details that might be useful on the frontend
+        "details": {
+            "color": product_info.get("color"),
+            "material": product_info.get("material"),
+            "dimensions": f"{product_info.get('height', 0)}cm x {product_info.get('width', 0)}cm x {product_info.get('depth', 0)}cm"
+        }
+    }
+
+
+class DetectionPipeline:
+    """decode -> detect -> filter -> crop -> group -> analyze -> price for uploaded photos"""
+
+    def __init__(self, detector=None, analyzer=None, object_pipeline=None, executors=None, encode_crops=True,
+                 hash_crops=False, save_crops=SAVE_DETECTED_CROPS, crops_folder=DETECTED_OBJECTS_FOLDER):
+        """
+        Args:
+            detector (Detector): Object detector, the shared one (loaded on first use) if omitted
+            analyzer (SimpleImageAnalyzer): Vision analysis of each crop; without one, objects
+                are priced by their detector label
+            object_pipeline (ObjectPipeline): Worker pool for synchronous analyze -> price runs
+            executors (dict): Executor per stage name for async runs (see the module docstring)
+            encode_crops (bool): Encode each detection's crop (needed for analysis; also
+                hashes it for grouping look-alike crops)
+            hash_crops (bool): Without encoding, still hash each crop's pixels so that
+                look-alike crops can be grouped
+            save_crops (bool): Also write every crop under crops_folder/<request id>/
+            crops_folder (str): Where saved crops go
+        """
+        self._detector = detector
+        self.analyzer = analyzer
+        self.object_pipeline = object_pipeline or ObjectPipeline()
+        self.executors = dict(executors or {})
+        self.encode_crops = encode_crops
+        self.hash_crops = hash_crops
+        self.save_crops = save_crops
+        self.crops_folder = crops_folder
+
+    @property
+    def detector(self):
+        if self._detector is None:
+            self._detector = get_detector()
+        return self._detector
+
+    # Stages
+
+    def decode(self, data):
+        """Decode uploaded image bytes into a BGR frame, raising ValueError if they are not an image"""
+        with stage("decode"):
+            return decode_upload(data)
+
+    def detect(self, images):
+        """Run the detector over a list of frames, returning one (N, 6) box array per frame"""
+        timings = {}
+        with stage("detect"):
+            results = self.detector.detect(images, timings=timings)
+        for name in ("tile", "infer", "merge"):
+            observe_stage(f"detect_{name}", timings[name])
+        print(f"Detected {len(images)} image(s) in {timings['inputs']} detector inputs: "
+              f"tile {timings['tile']:.3f}s, infer {timings['infer']:.3f}s, merge {timings['merge']:.3f}s")
+        return results
+
+    def filter(self, image, boxes):
+        """Clip, filter and normalize one frame's boxes (empty boxes are dropped here)"""
+        with stage("filter"):
+            return postprocess(boxes, image.shape, self.detector.names)
+
+    def crop(self, image, detections, file_id):
+        """
+        Build the detection dicts for one frame, cropping and encoding each object in memory
+
+        Args:
+            image (np.ndarray): The decoded frame
+            detections (Detections): The frame's filtered detections
+            file_id (str): Id of the upload, used for detection ids and saved crops
+
+        Returns:
+            list[dict]: Detections with "id", "file_id", "class_name", "confidence", "box",
+            "crop" (an EncodedCrop, None when crops are not encoded), "perceptual_hash"
+            (None when crops are neither encoded nor hashed) and "boundingBox" keys
+        """
+        collected = []
+        for idx, box, class_name, conf, bounding_box in detections.items():
+            crop = None
+            perceptual_hash = None
+            if self.encode_crops:
+                with stage("crop_encode"):
+                    crop = encode_crop(image, box, label=class_name)
+                perceptual_hash = crop.perceptual_hash
+
+                # Persist crops only when debugging, in a per-request folder
+                if self.save_crops:
+                    save_crop(crop, os.path.join(self.crops_folder, file_id), f"{class_name}_{idx}.jpg")
+            elif self.hash_crops:
+                with stage("crop_hash"):
+                    perceptual_hash = crop_hash(image, box)
+
+            collected.append({
+                "id": f"{file_id}_{idx}",
+                "file_id": file_id,
+                "class_name": class_name,
+                "confidence": conf,
+                "box": box,
+                "crop": crop,
+                "perceptual_hash": perceptual_hash,
+                "boundingBox": bounding_box
+            })
+        return collected
+
+    def group(self, detections):
+        """Group near-duplicate detections, each group starting with its representative"""
+        with stage("group"):
+            return group_detections(detections)
+
+    def analyze(self, detections):
+        """Analyze a batch of detections and build the product info used for pricing"""
+        if self.analyzer is None:
+            return [{"name": detection["class_name"]} for detection in detections]
+        try:
+            # Analyze the cropped images, packed into as few vision requests as possible
+            with stage("analyze"):
+                analyses = self.analyzer.analyze_batch([detection["crop"] for detection in detections])
+        except Exception as analysis_error:
+            print(f"Error analyzing images: {str(analysis_error)}")
+            return [{"name": detection["class_name"]} for detection in detections]
+
+        return [{
+            "name": analysis.get("name", detection["class_name"]),
+            "color": analysis.get("color"),
+            "height": analysis.get("height"),
+            "width": analysis.get("width"),
+            "depth": analysis.get("depth"),
+            "material": analysis.get("material")
+        } for detection, analysis in zip(detections, analyses)]
+
+    def price(self, product_info):
+        """Look up a product's price"""
+        with stage("price"):
+            return get_product_price(product_info)
+
+    async def price_async(self, product_info):
+        """Look up a product's price on the running event loop"""
+        with stage("price"):
+            return await get_product_price_async(product_info)
+
+    # Synchronous runs
+
+    def load_crops(self, paths):
+        """
+        Detections for crops already on disk (e.g. written by Bounding_Boxes), one per file
+
+        The object's label is taken from the filename up to the first underscore.
+        """
+        detections = []
+        for path in paths:
+            with open(path, "rb") as crop_file:
+                jpeg = crop_file.read()
+            filename = os.path.basename(path)
+            class_name = os.path.splitext(filename)[0].split("_")[0]
+            detections.append({
+                "id": filename,
+                "file_id": filename,
+                "class_name": class_name,
+                "confidence": 1.0,
+                "box": (0, 0, 0, 0),
+                "crop": EncodedCrop(jpeg, label=class_name),
+                "perceptual_hash": None,
+                "boundingBox": None
+            })
+        return detections
+
+    def detect_uploads(self, uploads):
+        """
+        decode -> detect -> filter -> crop for a set of uploads, in one batched detector call
+
+        Args:
+            uploads (list[tuple]): (key, image bytes) pairs
+
+        Returns:
+            tuple: (detections, key of each detection, {key: error detail} for uploads
+            that could not be decoded)
+        """
+        images = []  # (key, file_id, image)
+        errors = {}
+        for key, data in uploads:
+            try:
+                images.append((key, str(uuid.uuid4()), self.decode(data)))
+            except ValueError as e:
+                errors[key] = str(e)
+
+        detections = []
+        owners = []
+        if images:
+            results = self.detect([image for _, _, image in images])
+            for (key, file_id, image), boxes in zip(images, results):
+                image_detections = self.crop(image, self.filter(image, boxes), file_id)
+                detections.extend(image_detections)
+                owners.extend([key] * len(image_detections))
+        return detections, owners, errors
+
+    def _log_crop_sizes(self, detections):
+        if self.encode_crops:
+            crop_summary = summarize_crop_metrics([detection["crop"] for detection in detections])
+            print(f"Encoded {crop_summary['crops']} crops: {crop_summary['bytes_before']} -> "
+                  f"{crop_summary['bytes_after']} bytes")
+
+    @staticmethod
+    def _fan_out(detections, groups, group_idx, product_info, pricing_result):
+        """Response items for every member of a group, as (detection index, item)"""
+        members = groups[group_idx]
+        group_id = detections[members[0]]["id"]
+        return [(idx, build_detected_item(detections[idx], product_info, pricing_result,
+                                          quantity=len(members), group_id=group_id))
+                for idx in members]
+
+    def _collect_items(self, detections, groups, results):
+        detected_items = [None] * len(detections)
+        for group_idx, (product_info, pricing_result) in enumerate(results):
+            for idx, item in self._fan_out(detections, groups, group_idx, product_info, pricing_result):
+                detected_items[idx] = item
+        return detected_items
+
+    def analyze_and_price(self, detections, deadline_seconds=None, on_item=None):
+        """
+        Analyze and price every detection concurrently and build the response items
+
+        Near-duplicates are analyzed and priced once, through each group's representative.
+
+        Args:
+            detections (list): Detections from detect_uploads, crop or load_crops
+            deadline_seconds (float): Time budget, the object pipeline's default if omitted
+            on_item (callable): Called as on_item(index, item) as soon as each item is priced
+
+        Returns:
+            list[dict]: Response items in detection order
+        """
+        self._log_crop_sizes(detections)
+        groups = self.group(detections)
+        representatives = [detections[members[0]] for members in groups]
+        print(f"Grouped {len(detections)} detections into {len(groups)} groups")
+
+        on_result = None
+        if on_item is not None:
+            def on_result(group_idx, product_info, pricing_result):
+                for idx, item in self._fan_out(detections, groups, group_idx, product_info, pricing_result):
+                    on_item(idx, item)
+
+        batch_size = self.analyzer.batch_size if self.analyzer is not None else len(representatives)
+        results = self.object_pipeline.run(representatives, self.analyze, self.price,
+                                           deadline_seconds=deadline_seconds, batch_size=batch_size,
+                                           on_result=on_result)
+        return self._collect_items(detections, groups, results)
+
+    def run(self, uploads, deadline_seconds=None, on_item=None):
+        """
+        The whole pipeline for a set of uploads
+
+        Args:
+            uploads (list[tuple]): (key, image bytes) pairs with unique keys
+            deadline_seconds (float): Time budget for analysis and pricing
+            on_item (callable): Called as on_item(key, item) as soon as each item is priced
+
+        Returns:
+            dict: {"items": [...]} per key, or {"detail": ...} for an upload that could
+            not be decoded, in upload order
+        """
+        detections, owners, errors = self.detect_uploads(uploads)
+        response = {key: {"detail": errors[key]} if key in errors else {"items": []} for key, _ in uploads}
+
+        report = None
+        if on_item is not None:
+            def report(idx, item):
+                on_item(owners[idx], item)
+
+        detected_items = self.analyze_and_price(detections, deadline_seconds=deadline_seconds, on_item=report)
+        for key, detected_item in zip(owners, detected_items):
+            response[key]["items"].append(detected_item)
+        return response
+
+    # Async runs
+
+    def executor_for(self, stage_name):
+        """The executor an async run uses for a stage (None is the loop's default executor)"""
+        if stage_name in self.executors:
+            return self.executors[stage_name]
+        if stage_name in CPU_STAGES:
+            return get_inference_executor()
+        return None
+
+    async def run_stage(self, stage_name, fn, *args):
+        """Run a blocking stage on its executor, keeping the caller's trace"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor_for(stage_name), functools.partial(context.run, fn, *args))
+
+    async def detect_uploads_async(self, uploads):
+        """Async version of detect_uploads"""
+        images = []  # (key, file_id, image)
+        errors = {}
+        for key, data in uploads:
+            try:
+                images.append((key, str(uuid.uuid4()), await self.run_stage("decode", self.decode, data)))
+            except ValueError as e:
+                errors[key] = str(e)
+
+        detections = []
+        owners = []
+        if images:
+            results = await self.run_stage("detect", self.detect, [image for _, _, image in images])
+            for (key, file_id, image), boxes in zip(images, results):
+                filtered = await self.run_stage("filter", self.filter, image, boxes)
+                image_detections = await self.run_stage("crop", self.crop, image, filtered, file_id)
+                detections.extend(image_detections)
+                owners.extend([key] * len(image_detections))
+        return detections, owners, errors
+
+    async def analyze_and_price_async(self, detections, deadline_seconds=None):
+        """
+        Async version of analyze_and_price
+
+        Analysis batches run on the "analyze" executor and each group is priced on the loop
+        as soon as its analysis is available. The deadline covers both stages: anything
+        unfinished when it passes is returned unanalyzed or unpriced.
+        """
+        if deadline_seconds is None:
+            deadline_seconds = self.object_pipeline.deadline_seconds
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + deadline_seconds
+
+        self._log_crop_sizes(detections)
+        groups = await self.run_stage("group", self.group, detections)
+        representatives = [detections[members[0]] for members in groups]
+        if not representatives:
+            return []
+
+        product_infos = [None] * len(representatives)
+        price_tasks = {}
+
+        async def analyze_chunk(start, chunk):
+            if self.analyzer is None:
+                infos = self.analyze(chunk)
+            else:
+                infos = await self.run_stage("analyze", self.analyze, chunk)
+            for offset, product_info in enumerate(infos):
+                product_infos[start + offset] = product_info
+                price_tasks[start + offset] = asyncio.ensure_future(self.price_async(product_info))
+            # Cancelling this chunk (at the deadline) cancels its pricing too
+            await asyncio.gather(*(price_tasks[start + offset] for offset in range(len(infos))),
+                                 return_exceptions=True)
+
+        batch_size = max(self.analyzer.batch_size, 1) if self.analyzer is not None else len(representatives)
+        chunk_tasks = [asyncio.ensure_future(analyze_chunk(start, representatives[start:start + batch_size]))
+                       for start in range(0, len(representatives), batch_size)]
+        await asyncio.wait(chunk_tasks, timeout=max(deadline - loop.time(), 0))
+        for task in chunk_tasks:
+            if not task.done():
+                # An analysis already running on its executor finishes in the background
+                task.cancel()
+            elif not task.cancelled() and task.exception() is not None:
+                print(f"Error analyzing objects: {str(task.exception())}")
+
+        pricing_results = []
+        for idx in range(len(representatives)):
+            task = price_tasks.get(idx)
+            if task is None or not task.done():
+                print(f"Object {idx} did not finish within {deadline_seconds}s deadline")
+                pricing_results.append(None)
+            elif task.cancelled():
+                print(f"Pricing object {idx} was cancelled")
+                pricing_results.append(None)
+            elif task.exception() is not None:
+                print(f"Error pricing object {idx}: {str(task.exception())}")
+                pricing_results.append(None)
+            else:
+                pricing_results.append(task.result())
+
+        return self._collect_items(detections, groups, list(zip(product_infos, pricing_results)))
+
+    async def run_async(self, uploads, deadline_seconds=None):
+        """Async version of run"""
+        detections, owners, errors = await self.detect_uploads_async(uploads)
+        response = {key: {"detail": errors[key]} if key in errors else {"items": []} for key, _ in uploads}
+        detected_items = await self.analyze_and_price_async(detections, deadline_seconds=deadline_seconds)
+        for key, detected_item in zip(owners, detected_items):
+            response[key]["items"].append(detected_item)
+        return response
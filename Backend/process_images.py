@@ -5,8 +5,14 @@ from agents import Agent, Runner
 from base64 import b64encode
 from typing import Optional
 import json
+import sys
 from dotenv import load_dotenv
-from PriceScraper.__init__ import get_product_price
+
+# Use the shared pipeline from the Backend package directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pipeline import DetectionPipeline
+from simple_image_analyzer import SimpleImageAnalyzer
 
 # Load environment variables from .env file
 load_dotenv()
@@ -109,7 +115,7 @@ def analyze_image_folder(folder_path: str) -> list[dict]:
     # Iterate through all files in the folder
     for filename in os.listdir(folder_path):
         if filename.lower().endswith(supported_extensions):
-            image_path = os.path.join("/Users/anthonycampos/Desktop/EmberAid/Backend/detected_objects", filename)
+            image_path = os.path.join(folder_path, filename)
             try:
                 analysis = analyze_image(image_path)
                 # Add filename to the analysis result
@@ -245,13 +251,27 @@ def print_analysis_results(results: list[dict]) -> None:
             print(f"🏗️ Material: {result['material']}\n")
 
 
-def produce_output():
-    agent = ImageAnalysisAgent()
-    analysis = agent.analyze_folder("detected_objects")
-    documentation = []
-    for result in analysis:
-        documentation.append(get_product_price(result))
-    return documentation
+def produce_output(folder_path: str = "detected_objects") -> list[dict]:
+    """
+    Analyzes and prices every cropped object in a folder (e.g. written by Bounding_Boxes).
+    
+    The crops go through the shared pipeline, so analyses are cached and batched and
+    prices are looked up concurrently, the same way as in the APIs.
+    
+    Args:
+        folder_path (str): Path to the folder containing the cropped images
+        
+    Returns:
+        list[dict]: The price lookup result for each image, in filename order (None if
+        it did not finish within the pipeline's deadline)
+    """
+    supported_extensions = ('.png', '.jpg', '.jpeg')
+    paths = [os.path.join(folder_path, filename) for filename in sorted(os.listdir(folder_path))
+             if filename.lower().endswith(supported_extensions)]
+    pipeline = DetectionPipeline(analyzer=SimpleImageAnalyzer())
+    results = pipeline.object_pipeline.run(pipeline.load_crops(paths), pipeline.analyze, pipeline.price,
+                                           batch_size=pipeline.analyzer.batch_size)
+    return [pricing_result for _, pricing_result in results]
 
 # def main():
 #     # Create an instance of the ImageAnalysisAgent
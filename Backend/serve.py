@@ -0,0 +1,243 @@
+"""
+Production server for the detection APIs: pre-forked gunicorn workers.
+
+`flask_api.run(debug=True)` and `uvicorn.run(reload=True)` serve from one process, so
+GIL-bound post-processing and page parsing serialize every request. This entry point
+runs N worker processes instead:
+
+- The app (and with it the detector) is imported once in the master before forking,
+  and the heap is frozen (gc.freeze), so workers share the model weights copy-on-write
+  instead of each loading a copy.
+- CPU thread pools are capped per worker (cores / workers, or SERVE_CPU_THREADS) so the
+  workers together do not oversubscribe the cores. Warm-up inference runs in each
+  worker once it has loaded (or inherited) the app, since thread pools started before
+  a fork do not survive it.
+- Workers are recycled after SERVE_MAX_REQUESTS requests (with jitter) to cap memory
+  growth. Flask workers are also recycled as soon as their RSS exceeds
+  SERVE_MAX_WORKER_RSS_MB (checked after each request).
+- `kill -HUP <master pid>` replaces the workers gracefully: in-flight requests finish
+  (up to SERVE_GRACEFUL_TIMEOUT) while new workers take over. With the app preloaded,
+  code changes need a full restart (or USR2 followed by QUIT to the old master).
+- Background jobs (flask_api's /api/detect-objects/jobs) are kept in the worker that
+  started them unless the app's JobStore is shared between processes. With the default
+  in-memory store and more than one worker the job endpoints answer 503 (a job could not
+  be read back from another worker), and a single worker holding the jobs is never
+  recycled, since that would drop them. Serve jobs with --workers 1, or plug in a
+  shared JobStore.
+
+Exported ONNX Runtime and OpenVINO models start their thread pools when they are
+loaded, so for those backends every worker loads its own model unless SERVE_PRELOAD=1.
+
+Usage (from the Backend directory):
+    python serve.py [flask|fastapi] [--workers N] [--bind 0.0.0.0:8000]
+"""
+import argparse
+import gc
+import importlib
+import os
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+SERVE_BIND = os.getenv("SERVE_BIND", "0.0.0.0:8000")
+# Worker processes; 0 means one per two cores (at least one)
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0"))
+# Request threads per Flask worker (the FastAPI worker is async)
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", "8"))
+# CPU threads for inference and numeric work per worker; 0 divides the cores evenly
+SERVE_CPU_THREADS = int(os.getenv("SERVE_CPU_THREADS", "0"))
+SERVE_MAX_REQUESTS = int(os.getenv("SERVE_MAX_REQUESTS", "1000"))
+SERVE_MAX_REQUESTS_JITTER = int(os.getenv("SERVE_MAX_REQUESTS_JITTER", "100"))
+# Recycle a worker once its resident memory exceeds this (0 disables)
+SERVE_MAX_WORKER_RSS_MB = int(os.getenv("SERVE_MAX_WORKER_RSS_MB", "0"))
+SERVE_TIMEOUT = int(os.getenv("SERVE_TIMEOUT", "300"))
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", "60"))
+# "auto" preloads only for the PyTorch detector (see above)
+SERVE_PRELOAD = os.getenv("SERVE_PRELOAD", "auto").lower()
+
+# Module and attribute of each app
+APPS = {
+    "flask": ("flask_api", "flask_api"),
+    "fastapi": ("api", "app"),
+}
+
+# Environment variables read by the BLAS/OpenMP runtimes when they start
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def default_workers():
+    return max((os.cpu_count() or 1) // 2, 1)
+
+
+def threads_per_worker(workers, cpu_threads=SERVE_CPU_THREADS):
+    """CPU threads each worker may use so that all workers together fit the cores"""
+    if cpu_threads > 0:
+        return cpu_threads
+    return max((os.cpu_count() or 1) // workers, 1)
+
+
+def should_preload(setting=SERVE_PRELOAD):
+    if setting in ("1", "true", "yes"):
+        return True
+    if setting in ("0", "false", "no"):
+        return False
+    return os.getenv("DETECTOR_BACKEND", "pytorch") == "pytorch"
+
+
+def cap_thread_environment(threads):
+    """Cap thread pools that are sized from the environment (before anything starts them)"""
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+    os.environ.setdefault("DETECTOR_INTRA_OP_THREADS", str(threads))
+    # Inference threads in the master would not survive the fork; every worker warms up
+    # once its app is loaded instead (post_worker_init)
+    os.environ["DETECTOR_WARMUP"] = "0"
+
+
+def cap_worker_threads(threads):
+    """Apply the per-worker thread cap to runtimes already loaded in this process"""
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(threads)
+    if "cv2" in sys.modules:
+        import cv2
+        cv2.setNumThreads(threads)
+
+
+def current_rss_mb():
+    """Resident memory of this process (Linux /proc, else the peak from getrusage)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def load_app(name):
+    """Import an app by name, returning the WSGI/ASGI application"""
+    module_name, attribute = APPS[name]
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def warm_up_detector():
+    """Run the detector's warm-up inference in this worker, if the app loaded one"""
+    if "detector" in sys.modules:
+        sys.modules["detector"].warm_up_detectors()
+
+
+def holds_local_jobs(name):
+    """Whether this worker's app keeps background jobs in a store only it can see"""
+    job_manager = getattr(sys.modules.get(APPS[name][0]), "job_manager", None)
+    return job_manager is not None and not job_manager.store.shared
+
+
+def build_options(name, workers, bind, threads):
+    """gunicorn settings for an app"""
+
+    def post_fork(server, worker):
+        cap_worker_threads(threads)
+
+    def post_worker_init(worker):
+        # Runs once the worker has the app, whether preloaded or imported after the fork
+        cap_worker_threads(threads)
+        warm_up_detector()
+        worker.keeps_jobs = False
+        if holds_local_jobs(name):
+            if workers > 1:
+                worker.log.warning("Background job endpoints are disabled: the in-memory job store "
+                                   "is not shared between workers")
+            else:
+                # Recycling the only worker would discard every job it holds
+                worker.keeps_jobs = True
+                worker.max_requests = sys.maxsize
+        worker.log.info(f"Worker {worker.pid} ready with {threads} CPU threads")
+
+    def post_request(worker, req, environ, resp):
+        if getattr(worker, "keeps_jobs", False):
+            return
+        if SERVE_MAX_WORKER_RSS_MB and current_rss_mb() > SERVE_MAX_WORKER_RSS_MB:
+            worker.log.info(f"Worker {worker.pid} exceeded {SERVE_MAX_WORKER_RSS_MB} MB, recycling")
+            worker.alive = False
+
+    options = {
+        "bind": bind,
+        "workers": workers,
+        "preload_app": should_preload(),
+        "max_requests": SERVE_MAX_REQUESTS,
+        "max_requests_jitter": SERVE_MAX_REQUESTS_JITTER,
+        "timeout": SERVE_TIMEOUT,
+        "graceful_timeout": SERVE_GRACEFUL_TIMEOUT,
+        "post_fork": post_fork,
+        "post_worker_init": post_worker_init,
+        "post_request": post_request,
+    }
+    if name == "flask":
+        options["worker_class"] = "gthread"
+        options["threads"] = SERVE_THREADS
+    else:
+        try:
+            import uvicorn_worker  # noqa: F401
+            options["worker_class"] = "uvicorn_worker.UvicornWorker"
+        except ImportError:
+            options["worker_class"] = "uvicorn.workers.UvicornWorker"
+    return options
+
+
+def serve(name="flask", workers=None, bind=SERVE_BIND):
+    """
+    Run an app on pre-forked gunicorn workers until the master is stopped
+
+    Args:
+        name (str): "flask" or "fastapi"
+        workers (int): Worker processes, SERVE_WORKERS or half the cores by default
+        bind (str): Address to listen on
+    """
+    from gunicorn.app.base import BaseApplication
+
+    workers = workers or SERVE_WORKERS or default_workers()
+    threads = threads_per_worker(workers)
+    cap_thread_environment(threads)
+    # Read by flask_api to tell whether its job endpoints can work
+    os.environ["SERVE_WORKER_PROCESSES"] = str(workers)
+
+    class EmberAidServer(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            self.application = None
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if self.application is None:
+                self.application = load_app(name)
+                if self.cfg.preload_app:
+                    # Keep the loaded objects out of the collector, so collections in the
+                    # workers never write to (and so copy) the shared pages
+                    gc.freeze()
+            return self.application
+
+    print(f"Serving {name} on {bind} with {workers} workers x {threads} CPU threads")
+    EmberAidServer(build_options(name, workers, bind, threads)).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a detection API on pre-forked workers")
+    parser.add_argument("app", nargs="?", choices=sorted(APPS), default="flask")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--bind", default=SERVE_BIND)
+    args = parser.parse_args()
+
+    # The app modules are imported by name from this directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    serve(args.app, args.workers, args.bind)
+
+
+if __name__ == "__main__":
+    main()
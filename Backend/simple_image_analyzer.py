@@ -1,9 +1,20 @@
 import os
-import base64
-from typing import Dict, Any, Optional
+import sys
+import json
+import re
+import threading
+import time
+from typing import Dict, Any, List, Optional, Union
 import openai
 from dotenv import load_dotenv
 import requests
+from analysis_cache import AnalysisCache
+from crops import EncodedCrop
+from metrics import stage
+
+# Single-flight coalescing is shared with the price scraper
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PriceScraper.single_flight import SingleFlight
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,94 +22,343 @@ load_dotenv()
 # Set OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Maximum number of crops packed into a single vision request
+ANALYZE_BATCH_SIZE = int(os.getenv("ANALYZE_BATCH_SIZE", "8"))
+
+SINGLE_PROMPT = (
+    "Analyze this image and provide the following details. For dimensions, provide your best estimate as a single number (not a range). Format your response exactly like this example:\n\n"
+    "Red\n"
+    "Coffee Table\n"
+    "45\n"
+    "90\n"
+    "60\n"
+    "Wood\n\n"
+    "Your response should contain exactly 6 lines in this order:\n"
+    "1. Main color (one word)\n"
+    "2. Object name (1-2 words)\n"
+    "3. Height in centimeters (single number)\n"
+    "4. Width in centimeters (single number)\n"
+    "5. Depth in centimeters (single number)\n"
+    "6. Primary material (1-2 words)"
+)
+
+BATCH_PROMPT = (
+    "You are given {count} images, each preceded by its index label (\"Image 0\", \"Image 1\", ...). "
+    "Analyze each image separately. For dimensions, provide your best estimate as a single number (not a range).\n\n"
+    "Respond with only a JSON array containing exactly one object per image, like this example:\n\n"
+    "[{{\"index\": 0, \"color\": \"Red\", \"name\": \"Coffee Table\", \"height\": 45, \"width\": 90, \"depth\": 60, \"material\": \"Wood\"}}]\n\n"
+    "Fields:\n"
+    "- index: the image's index label\n"
+    "- color: main color (one word)\n"
+    "- name: object name (1-2 words)\n"
+    "- height, width, depth: size in centimeters (single numbers)\n"
+    "- material: primary material (1-2 words)"
+)
+
+class VisionBackend:
+    """Transport for vision requests: sends a prompt plus images and returns the raw text reply"""
+    
+    def complete(self, content: List[Dict[str, Any]], max_tokens: int) -> str:
+        """
+        Args:
+            content (list): Chat message content parts (text and image_url entries)
+            max_tokens (int): Response token budget
+        
+        Returns:
+            str: The model's text response
+        """
+        raise NotImplementedError
+
+class OpenAIVisionBackend(VisionBackend):
+    """Vision backend using OpenAI chat completions, with one client reused for every call"""
+    
+    def __init__(self, model: str = "gpt-4o"):
+        self.model = model
+        self._client = None
+        self._client_lock = threading.Lock()
+    
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            return self._client
+    
+    def complete(self, content: List[Dict[str, Any]], max_tokens: int) -> str:
+        response = self._get_client().chat.completions.create(
+            model=self.model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+
+class FakeVisionBackend(VisionBackend):
+    """Local stand-in for the vision model, for tests and offline benchmarks"""
+    
+    def __init__(self, analysis: Optional[Dict[str, Any]] = None, latency: float = 0.0):
+        """
+        Args:
+            analysis (dict): Analysis returned for every image
+            latency (float): Simulated seconds per request
+        """
+        self.analysis = analysis or {
+            "color": "Brown",
+            "name": "Object",
+            "height": 50,
+            "width": 50,
+            "depth": 50,
+            "material": "Wood"
+        }
+        self.latency = latency
+        self.calls = 0
+    
+    def complete(self, content: List[Dict[str, Any]], max_tokens: int) -> str:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        
+        image_count = sum(1 for part in content if part["type"] == "image_url")
+        if image_count == 1:
+            a = self.analysis
+            return "\n".join(str(a[field]) for field in ("color", "name", "height", "width", "depth", "material"))
+        return json.dumps([dict(self.analysis, index=idx) for idx in range(image_count)])
+
 class SimpleImageAnalyzer:
     """A simplified image analyzer that uses OpenAI's vision model without the agents library"""
     
-    def analyze(self, image_path: str) -> Dict[str, Any]:
+    def __init__(self, cache: Optional[AnalysisCache] = None, backend: Optional[VisionBackend] = None,
+                 batch_size: int = ANALYZE_BATCH_SIZE):
+        """
+        Args:
+            cache (AnalysisCache): Cache of previous analyses, a new one is created if omitted
+            backend (VisionBackend): Vision model transport, OpenAI by default
+            batch_size (int): Maximum number of crops per batched request
+        """
+        self.cache = cache if cache is not None else AnalysisCache()
+        self.backend = backend if backend is not None else OpenAIVisionBackend()
+        self.batch_size = batch_size
+        # Concurrent requests for byte-identical crops share one vision call
+        self.flight = SingleFlight()
+    
+    @staticmethod
+    def _as_crop(image: Union[str, bytes, EncodedCrop]) -> EncodedCrop:
+        """Wrap an image given as an EncodedCrop, encoded bytes or a file path"""
+        if isinstance(image, EncodedCrop):
+            return image
+        if isinstance(image, (bytes, bytearray)):
+            return EncodedCrop(bytes(image))
+        with open(image, "rb") as image_file:
+            return EncodedCrop(image_file.read())
+    
+    @staticmethod
+    def _image_part(crop: EncodedCrop) -> Dict[str, Any]:
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{crop.base64}",
+            }
+        }
+    
+    @staticmethod
+    def _describe(image: Union[str, bytes, EncodedCrop]) -> str:
+        if isinstance(image, str):
+            return image
+        if isinstance(image, EncodedCrop) and image.label:
+            return image.label
+        return "<in-memory image>"
+    
+    @staticmethod
+    def _fallback(image: Union[str, bytes, EncodedCrop]) -> Dict[str, Any]:
+        if isinstance(image, EncodedCrop) and image.label:
+            name = image.label  # Use detector label as fallback
+        elif isinstance(image, str):
+            name = os.path.basename(image).split('_')[0]  # Use filename as fallback
+        else:
+            name = "Unknown"
+        return {
+            "name": name,
+            "color": "Unknown",
+            "height": 0,
+            "width": 0,
+            "depth": 0,
+            "material": "Unknown"
+        }
+    
+    @staticmethod
+    def _parse_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate and convert one analysis, raising on missing or malformed fields"""
+        return {
+            "color": str(fields["color"]).strip(),
+            "name": str(fields["name"]).strip(),
+            "height": float(fields["height"]),
+            "width": float(fields["width"]),
+            "depth": float(fields["depth"]),
+            "material": str(fields["material"]).strip()
+        }
+    
+    def analyze(self, image_path: Union[str, bytes, EncodedCrop]) -> Dict[str, Any]:
         """
         Analyzes an image using OpenAI's vision model.
         
+        Byte-identical and visually near-identical images are answered from the cache, and
+        concurrent calls for a byte-identical image share one vision request.
+        
         Args:
-            image_path (str): Path to the image file
-            
+            image_path (str | bytes | EncodedCrop): Path to the image file, or the encoded image itself
+        
         Returns:
             dict: Object details including color, name, dimensions, and material
         """
         try:
-            # Read the image file as binary data and encode properly
-            with open(image_path, "rb") as image_file:
-                image_data = image_file.read()
-                
-            # Convert binary data to base64 encoding
-            base64_encoded = base64.b64encode(image_data).decode('utf-8')
+            crop = self._as_crop(image_path)
             
-            # Call the OpenAI Vision API
-            client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text", 
-                                "text": "Analyze this image and provide the following details. For dimensions, provide your best estimate as a single number (not a range). Format your response exactly like this example:\n\n"
-                                       "Red\n"
-                                       "Coffee Table\n"
-                                       "45\n"
-                                       "90\n"
-                                       "60\n"
-                                       "Wood\n\n"
-                                       "Your response should contain exactly 6 lines in this order:\n"
-                                       "1. Main color (one word)\n"
-                                       "2. Object name (1-2 words)\n"
-                                       "3. Height in centimeters (single number)\n"
-                                       "4. Width in centimeters (single number)\n"
-                                       "5. Depth in centimeters (single number)\n"
-                                       "6. Primary material (1-2 words)"
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_encoded}",
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=300
-            )
+            cached, cache_keys = self.cache.lookup(crop.jpeg, crop.perceptual_hash, crop.label)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            print(f"Error reading image {self._describe(image_path)}: {str(e)}")
+            return self._fallback(image_path)
+        
+        return self.flight.do(cache_keys[0], self._analyze_uncached, image_path, crop, cache_keys)
+    
+    def _analyze_uncached(self, image: Union[str, bytes, EncodedCrop], crop: EncodedCrop, cache_keys) -> Dict[str, Any]:
+        """Send a single image to the vision model and cache a successful analysis"""
+        try:
+            with stage("vision_call"):
+                content = self.backend.complete(
+                    [{"type": "text", "text": SINGLE_PROMPT}, self._image_part(crop)],
+                    max_tokens=300
+                )
             
             # Parse the response into structured format
             try:
-                lines = response.choices[0].message.content.strip().split('\n')
-                return {
-                    "color": lines[0].strip(),
-                    "name": lines[1].strip(),
-                    "height": float(lines[2].strip()),
-                    "width": float(lines[3].strip()),
-                    "depth": float(lines[4].strip()),
-                    "material": lines[5].strip()
-                }
+                lines = content.strip().split('\n')
+                analysis = self._parse_fields({
+                    "color": lines[0],
+                    "name": lines[1],
+                    "height": lines[2],
+                    "width": lines[3],
+                    "depth": lines[4],
+                    "material": lines[5]
+                })
             except Exception as e:
                 print(f"Failed to parse response: {str(e)}")
-                print(f"Raw response: {response.choices[0].message.content}")
-                return {
-                    "name": os.path.basename(image_path).split('_')[0],  # Use filename as fallback
-                    "color": "Unknown",
-                    "height": 0,
-                    "width": 0,
-                    "depth": 0,
-                    "material": "Unknown"
-                }
-                
+                print(f"Raw response: {content}")
+                return self._fallback(image)
+            
+            # Only successful analyses are cached, so failures are retried next time
+            self.cache.store(cache_keys, analysis)
+            return analysis
+        
         except Exception as e:
-            print(f"Error analyzing image {image_path}: {str(e)}")
-            return {
-                "name": os.path.basename(image_path).split('_')[0],  # Use filename as fallback
-                "color": "Unknown", 
-                "height": 0,
-                "width": 0,
-                "depth": 0,
-                "material": "Unknown"
-            } 
\ No newline at end of file
+            print(f"Error analyzing image {self._describe(image)}: {str(e)}")
+            return self._fallback(image)
+    
+    def analyze_batch(self, crops: List[Union[str, bytes, EncodedCrop]]) -> List[Dict[str, Any]]:
+        """
+        Analyzes several images with as few vision requests as possible.
+        
+        Crops that miss the cache are packed up to batch_size per request and the indexed
+        JSON reply is mapped back to each crop. Any crop whose entry is missing or cannot
+        be parsed is retried on its own with analyze(). Crops already being analyzed by a
+        concurrent call (or repeated within this batch) wait for that result instead.
+        
+        Args:
+            crops (list): EncodedCrops, encoded images or image file paths
+        
+        Returns:
+            list[dict]: One analysis per crop, in input order
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(crops)
+        pending = []  # (position, crop, cache_keys, flight future) for crops this call analyzes
+        waiting = []  # (position, image, flight future) for crops another call is analyzing
+        
+        try:
+            for position, image in enumerate(crops):
+                try:
+                    crop = self._as_crop(image)
+                    cached, cache_keys = self.cache.lookup(crop.jpeg, crop.perceptual_hash, crop.label)
+                except Exception as e:
+                    print(f"Error reading image {self._describe(image)}: {str(e)}")
+                    results[position] = self._fallback(image)
+                    continue
+                if cached is not None:
+                    results[position] = cached
+                    continue
+                future, leader = self.flight.acquire(cache_keys[0])
+                if leader:
+                    pending.append((position, crop, cache_keys, future))
+                else:
+                    waiting.append((position, image, future))
+            
+            for start in range(0, len(pending), max(self.batch_size, 1)):
+                chunk = pending[start:start + self.batch_size]
+                if len(chunk) == 1:
+                    position, crop, cache_keys, future = chunk[0]
+                    results[position] = self._analyze_uncached(crops[position], crop, cache_keys)
+                    self.flight.release(cache_keys[0], future, result=results[position])
+                    continue
+                
+                parsed = {}
+                try:
+                    content = [{"type": "text", "text": BATCH_PROMPT.format(count=len(chunk))}]
+                    for idx, (_, crop, _, _) in enumerate(chunk):
+                        content.append({"type": "text", "text": f"Image {idx}"})
+                        content.append(self._image_part(crop))
+                    
+                    with stage("vision_call"):
+                        reply = self.backend.complete(content, max_tokens=100 + 80 * len(chunk))
+                    parsed = self._parse_batch_reply(reply)
+                except Exception as e:
+                    print(f"Batch analysis failed, falling back to single requests: {str(e)}")
+                
+                for idx, (position, crop, cache_keys, future) in enumerate(chunk):
+                    analysis = parsed.get(idx)
+                    if analysis is None:
+                        results[position] = self._analyze_uncached(crops[position], crop, cache_keys)
+                    else:
+                        self.cache.store(cache_keys, analysis)
+                        results[position] = analysis
+                    self.flight.release(cache_keys[0], future, result=results[position])
+        finally:
+            # Never leave other callers waiting on a flight this call abandoned
+            for _, _, cache_keys, future in pending:
+                if not future.done():
+                    self.flight.release(cache_keys[0], future, error=RuntimeError("Analysis was interrupted"))
+        
+        for position, image, future in waiting:
+            try:
+                results[position] = future.result()
+            except Exception as e:
+                print(f"Error analyzing image {self._describe(image)}: {str(e)}")
+                results[position] = self._fallback(image)
+        
+        return results
+    
+    def _parse_batch_reply(self, reply: str) -> Dict[int, Dict[str, Any]]:
+        """Map each index in a batched JSON reply to its analysis, skipping malformed entries"""
+        text = reply.strip()
+        # Models sometimes wrap JSON in a markdown code fence
+        fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+        if fenced:
+            text = fenced.group(1)
+        
+        parsed = {}
+        for entry in json.loads(text):
+            try:
+                parsed[int(entry["index"])] = self._parse_fields(entry)
+            except Exception as e:
+                print(f"Failed to parse batch entry {entry}: {str(e)}")
+        return parsed
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for the analysis cache"""
+        return self.cache.stats()
+    
+    def single_flight_stats(self) -> Dict[str, Any]:
+        """Return request-coalescing counters for vision calls"""
+        return self.flight.stats()
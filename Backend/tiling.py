@@ -0,0 +1,115 @@
+"""
+Tiled (sliced) inference helpers for high-resolution photos.
+
+At 640 px input, small objects in a large room photo shrink to a handful of pixels
+before the detector sees them. In tiled mode a frame is covered by overlapping
+tile-sized windows, which are run through the detector in batches alongside one
+full-frame pass that keeps large objects whole. Their boxes are shifted back to frame
+coordinates and merged.
+
+Merging is class-aware greedy non-maximum merging on intersection-over-smaller: an
+object cut by a tile edge produces a partial box that lies mostly inside the full
+box, so the two are merged into their union rather than kept as two detections.
+"""
+import math
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# "auto" tiles frames whose long edge reaches DETECTOR_TILE_MIN_LONG_EDGE, "always" or "off"
+DETECTOR_TILING = os.getenv("DETECTOR_TILING", "auto")
+DETECTOR_TILE_SIZE = int(os.getenv("DETECTOR_TILE_SIZE", "640"))
+DETECTOR_TILE_OVERLAP = float(os.getenv("DETECTOR_TILE_OVERLAP", "0.2"))
+# Upper bound on tiles per frame; tiles grow past DETECTOR_TILE_SIZE to stay under it
+DETECTOR_TILE_MAX = int(os.getenv("DETECTOR_TILE_MAX", "8"))
+DETECTOR_TILE_MIN_LONG_EDGE = int(os.getenv("DETECTOR_TILE_MIN_LONG_EDGE", "1280"))
+# Overlap (intersection over the smaller box) at which two same-class boxes are merged
+DETECTOR_TILE_MERGE_THRESHOLD = float(os.getenv("DETECTOR_TILE_MERGE_THRESHOLD", "0.5"))
+
+CLASS_OFFSET = 7680
+TILE_GROWTH = 1.25
+
+
+def _starts(length, tile, overlap):
+    """Evenly spaced window starts covering [0, length) with at least the given overlap"""
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - tile) / (tile * (1 - overlap))) + 1
+    return np.linspace(0, length - tile, count).round().astype(int).tolist()
+
+
+def tile_windows(height, width, tile_size=DETECTOR_TILE_SIZE, overlap=DETECTOR_TILE_OVERLAP,
+                 max_tiles=DETECTOR_TILE_MAX):
+    """
+    Plan overlapping tile windows over a frame
+
+    Args:
+        height (int): Frame height
+        width (int): Frame width
+        tile_size (int): Tile side in pixels
+        overlap (float): Fraction of a tile shared with its neighbour
+        max_tiles (int): Maximum number of tiles; the tile size grows until the grid fits
+
+    Returns:
+        list[tuple]: (x1, y1, x2, y2) windows in frame pixels
+    """
+    overlap = min(max(overlap, 0.0), 0.9)
+    tile = tile_size
+    while True:
+        xs, ys = _starts(width, tile, overlap), _starts(height, tile, overlap)
+        if len(xs) * len(ys) <= max(max_tiles, 1) or tile >= max(height, width):
+            break
+        tile = int(tile * TILE_GROWTH)
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in ys for x in xs]
+
+
+def greedy_merge(detections, threshold=DETECTOR_TILE_MERGE_THRESHOLD):
+    """
+    Merge same-class boxes that overlap by intersection-over-smaller
+
+    Each surviving box (highest confidence first) absorbs the boxes it overlaps by more
+    than ``threshold``, growing to their union and keeping its own confidence.
+
+    Args:
+        detections (np.ndarray): (N, 6) rows of [x1, y1, x2, y2, confidence, class_id]
+        threshold (float): Intersection over the smaller box's area needed to merge
+
+    Returns:
+        np.ndarray: Merged (M, 6) rows, highest confidence first
+    """
+    if len(detections) == 0:
+        return detections
+    # Offset each class into its own coordinate range so classes never interact
+    offsets = detections[:, 5:6] * CLASS_OFFSET
+    boxes = detections[:, :4] + offsets
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-detections[:, 4], kind="stable")
+
+    merged = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        inter_w = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]),
+                          0, None)
+        inter_h = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]),
+                          0, None)
+        overlap = inter_w * inter_h / np.maximum(np.minimum(areas[best], areas[rest]), 1e-9)
+        matched = np.concatenate([[best], rest[overlap > threshold]])
+
+        row = detections[best].copy()
+        row[:2] = detections[matched, :2].min(axis=0)
+        row[2:4] = detections[matched, 2:4].max(axis=0)
+        merged.append(row)
+        order = rest[overlap <= threshold]
+    return np.stack(merged).astype(np.float32)
+
+
+def should_tile(height, width, mode=DETECTOR_TILING, min_long_edge=DETECTOR_TILE_MIN_LONG_EDGE):
+    """Whether a frame of this size is detected in tiles"""
+    if mode == "always":
+        return True
+    if mode == "auto":
+        return max(height, width) >= min_long_edge
+    return False
@@ -1,9 +1,33 @@
-from .simple_scraper import validate_product_price_simple
+from .simple_scraper import search_simple_product_async, validate_product_price_simple
+from .price_cache import PriceCache, normalize_product_key
+from .price_parsing import ParsedPrice, parse_price, parse_prices
+from .single_flight import SingleFlight
+from .http_session import get_session_manager
+
+# Shared price cache for every lookup in this process
+price_cache = PriceCache()
+
+# Concurrent lookups of the same product share one scrape
+price_flight = SingleFlight()
+
+def _fetch_product_price(product_info):
+    """Scrape a product's price and cache the result"""
+    result = validate_product_price_simple(product_info)
+    price_cache.set(product_info, result)
+    return result
+
+async def _fetch_product_price_async(product_info):
+    """Scrape a product's price on the running event loop and cache the result"""
+    print(f"\nSearching for: {product_info.get('name', 'Unknown Product')}")
+    result = await search_simple_product_async(product_info)
+    print(f"Result: {result['name']} - {result['price']}")
+    price_cache.set(product_info, result)
+    return result
 
 def get_product_price(product_info):
     """
     Get pricing information for a product
-    
+
     Args:
         product_info (dict): Product information with keys:
             - name: Name of the product
@@ -12,8 +36,38 @@ def get_product_price(product_info):
             - width: Width in inches (optional)
             - depth: Depth in inches (optional)
             - material: Material of the product (optional)
-            
+
     Returns:
         dict: Product pricing information with name, price, link, etc.
     """
-    return validate_product_price_simple(product_info)
\ No newline at end of file
+    cached = price_cache.get(product_info)
+    if cached is not None:
+        return cached
+
+    return price_flight.do(normalize_product_key(product_info), _fetch_product_price, product_info)
+
+async def get_product_price_async(product_info):
+    """
+    Async version of get_product_price
+
+    The provider searches are awaited on the running loop (only the blocking page
+    requests use the per-host executors) and are shared with any concurrent lookup of
+    the same product, from threads or other tasks.
+    """
+    cached = price_cache.get(product_info)
+    if cached is not None:
+        return cached
+
+    return await price_flight.do_async(normalize_product_key(product_info), _fetch_product_price_async, product_info)
+
+def get_cache_stats():
+    """Return hit/miss/eviction counters for the price cache"""
+    return price_cache.stats()
+
+def get_single_flight_stats():
+    """Return request-coalescing counters for price lookups"""
+    return price_flight.stats()
+
+def get_retailer_stats():
+    """Return per-retailer breaker state and rate-limit counters"""
+    return get_session_manager().guards.stats()
@@ -0,0 +1,109 @@
+"""
+Parse-time benchmark and regression check for retailer page extraction.
+
+Runs every saved search page in fixtures/ through the extraction path used by the
+scrapers (streamed read_body + PageExtractor) and through the previous full-page
+BeautifulSoup html.parser path, checks the extracted products against
+fixtures/expected.json, and reports the mean parse time of each.
+
+Usage:
+    python -m PriceScraper.benchmark_parse [--iterations N] [--write-expected]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from bs4 import BeautifulSoup
+from .extraction import HTML_PARSER, read_body
+from .providers import TARGET_PAGE, WALMART_PAGE
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+EXPECTED_PATH = os.path.join(FIXTURES_DIR, "expected.json")
+
+# fixture file -> (page extractor, full-page card selector, page URL)
+FIXTURES = {
+    "walmart_search.html": (WALMART_PAGE, 'div[data-item-id]', "https://www.walmart.com/search?q=bowl"),
+    "walmart_search_cards.html": (WALMART_PAGE, 'div[data-item-id]', "https://www.walmart.com/search?q=bowl"),
+    "target_search.html": (TARGET_PAGE, 'li[data-test="product-list-item"]', "https://www.target.com/s?searchTerm=bowl"),
+}
+
+
+class FixtureResponse:
+    """Just enough of a streamed requests.Response to replay a saved page"""
+
+    def __init__(self, body):
+        self.body = body
+        self.encoding = "utf-8"
+        self.bytes_read = 0
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            self.bytes_read = min(start + chunk_size, len(self.body))
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def extract_fast(body, page, url):
+    response = FixtureResponse(body)
+    products = page.extract(read_body(response, page), url)
+    return products, response.bytes_read
+
+
+def extract_full_page(body, page, selector, url):
+    """The previous path: decode everything, build the whole DOM, then select the cards"""
+    soup = BeautifulSoup(body.decode("utf-8"), "html.parser")
+    return [page.parse_card(card, url) for card in soup.select(selector)[:3]]
+
+
+def mean_seconds(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--write-expected", action="store_true",
+                        help="Record the current extraction output as the expected results")
+    args = parser.parse_args()
+
+    expected = {}
+    if os.path.exists(EXPECTED_PATH) and not args.write_expected:
+        with open(EXPECTED_PATH) as expected_file:
+            expected = json.load(expected_file)
+
+    print(f"HTML parser for product cards: {HTML_PARSER}")
+    results = {}
+    failures = 0
+    for name, (page, selector, url) in FIXTURES.items():
+        with open(os.path.join(FIXTURES_DIR, name), "rb") as fixture_file:
+            body = fixture_file.read()
+
+        products, bytes_read = extract_fast(body, page, url)
+        results[name] = products
+        if name in expected and products != expected[name]:
+            failures += 1
+            print(f"MISMATCH {name}:\n  expected {expected[name]}\n  got      {products}")
+
+        fast = mean_seconds(lambda: extract_fast(body, page, url), args.iterations)
+        full = mean_seconds(lambda: extract_full_page(body, page, selector, url), args.iterations)
+        print(f"{name}: {len(body) / 1024:.0f} KB, read {bytes_read / 1024:.0f} KB, "
+              f"full page {full * 1000:.1f} ms -> extraction {fast * 1000:.1f} ms ({full / fast:.1f}x)")
+
+    if args.write_expected:
+        with open(EXPECTED_PATH, "w") as expected_file:
+            json.dump(results, expected_file, indent=2)
+            expected_file.write("\n")
+        print(f"Wrote {EXPECTED_PATH}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
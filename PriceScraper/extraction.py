@@ -0,0 +1,173 @@
+"""
+Fast product extraction from retailer search pages.
+
+Building a full BeautifulSoup DOM of a search page with the pure-Python html.parser
+costs as much CPU as running the detector, just to read three product cards. Each
+retailer instead describes its page with a PageExtractor, which tries in order:
+
+1. The JSON payload embedded in the page (e.g. the __NEXT_DATA__ script), parsed with
+   the json module and walked for product objects.
+2. The product cards only: BeautifulSoup with a SoupStrainer restricted to the card
+   elements, using the C-backed lxml parser when it is installed.
+
+read_body() streams the response and stops decoding as soon as the embedded payload
+is complete or enough product cards have been seen, so most of a large page is never
+decoded or parsed.
+"""
+import codecs
+import json
+import os
+import re
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Stop reading a page after this many bytes, and read it in chunks of this size
+SCRAPER_MAX_BODY_BYTES = int(os.getenv("SCRAPER_MAX_BODY_BYTES", str(4 * 1024 * 1024)))
+SCRAPER_CHUNK_SIZE = int(os.getenv("SCRAPER_CHUNK_SIZE", str(64 * 1024)))
+
+SCRIPT_END = "</script>"
+
+
+class PageExtractor:
+    """How to find products on one retailer's search page"""
+
+    def __init__(self, card_marker, card_strainer, parse_card, json_script_id=None, parse_json_product=None):
+        """
+        Args:
+            card_marker (str): Substring that starts every product card in the raw HTML
+            card_strainer (SoupStrainer): Matches the product card elements
+            parse_card (callable): parse_card(card_tag, page_url) -> product dict
+            json_script_id (str): id of the <script> holding the page's JSON payload
+            parse_json_product (callable): parse_json_product(node, page_url) -> product
+                dict if the JSON object is a product, else None
+        """
+        self.card_marker = card_marker
+        self.card_strainer = card_strainer
+        self.parse_card = parse_card
+        self.json_script_id = json_script_id
+        self.parse_json_product = parse_json_product
+        self.json_marker = f'id="{json_script_id}"' if json_script_id else None
+        self._json_pattern = (re.compile(r'<script[^>]*id="%s"[^>]*>(.*?)</script>' % re.escape(json_script_id),
+                                         re.DOTALL) if json_script_id else None)
+
+    def extract(self, text, page_url, limit=3):
+        """
+        Extract up to ``limit`` products from page HTML
+
+        Returns:
+            list[dict]: Products with name, price and link
+        """
+        products = self.extract_json(text, page_url, limit)
+        if products:
+            return products
+        return self.extract_cards(text, page_url, limit)
+
+    def extract_json(self, text, page_url, limit=3):
+        """Products from the embedded JSON payload (empty if there is none)"""
+        if self._json_pattern is None or self.json_marker not in text:
+            return []
+        match = self._json_pattern.search(text)
+        if not match:
+            return []
+        try:
+            data = json.loads(match.group(1))
+        except ValueError as e:
+            print(f"Could not parse embedded page data: {e}")
+            return []
+
+        products = []
+        # Depth-first walk in document order; product objects are not descended into
+        stack = [data]
+        while stack and len(products) < limit:
+            node = stack.pop()
+            if isinstance(node, dict):
+                product = self.parse_json_product(node, page_url)
+                if product:
+                    products.append(product)
+                    continue
+                stack.extend(reversed(list(node.values())))
+            elif isinstance(node, list):
+                stack.extend(reversed(node))
+        return products
+
+    def extract_cards(self, text, page_url, limit=3):
+        """Products from the product card markup, parsing nothing but the cards"""
+        first_card = text.find(self.card_marker)
+        if first_card < 0:
+            return []
+        # Parse from the tag containing the first card marker up to the tag containing
+        # the card after the last one needed
+        end = first_card
+        for _ in range(limit):
+            end = text.find(self.card_marker, end + len(self.card_marker))
+            if end < 0:
+                break
+        fragment = text[max(text.rfind("<", 0, first_card), 0):text.rfind("<", 0, end) if end >= 0 else None]
+        soup = BeautifulSoup(fragment, HTML_PARSER, parse_only=self.card_strainer)
+
+        products = []
+        for card in soup.find_all(True, recursive=False)[:limit]:
+            try:
+                products.append(self.parse_card(card, page_url))
+            except Exception as e:
+                print(f"Error extracting product info: {e}")
+        return products
+
+
+def read_body(response, extractor, limit=3, max_bytes=SCRAPER_MAX_BODY_BYTES, chunk_size=SCRAPER_CHUNK_SIZE):
+    """
+    Read and decode a streamed response only as far as the extractor needs
+
+    Reading stops once the embedded JSON payload has been closed, or once more than
+    ``limit`` product cards have started (so the first ``limit`` are complete). A
+    response that was cut short is closed instead of being returned to the pool.
+
+    Args:
+        response (requests.Response): A response requested with stream=True
+        extractor (PageExtractor): The page's extractor, for its markers
+        limit (int): Number of products needed
+        max_bytes (int): Never read more than this
+
+    Returns:
+        str: The decoded prefix of the body
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    overlap = max(len(extractor.card_marker), len(extractor.json_marker or ""), len(SCRIPT_END))
+    text = ""
+    read = 0
+    cards = 0
+    card_scan = 0
+    json_start = -1
+    stopped_early = False
+
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        scan_from = max(len(text) - overlap, 0)
+        text += decoder.decode(chunk)
+        read += len(chunk)
+
+        if extractor.json_marker:
+            if json_start < 0:
+                json_start = text.find(extractor.json_marker, scan_from)
+            if json_start >= 0 and text.find(SCRIPT_END, max(json_start, scan_from)) >= 0:
+                stopped_early = True
+                break
+
+        position = text.find(extractor.card_marker, max(card_scan, scan_from))
+        while position >= 0:
+            cards += 1
+            card_scan = position + len(extractor.card_marker)
+            position = text.find(extractor.card_marker, card_scan)
+        if cards > limit or read >= max_bytes:
+            stopped_early = True
+            break
+
+    if stopped_early:
+        response.close()
+    else:
+        text += decoder.decode(b"", final=True)
+    return text
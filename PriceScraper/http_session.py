@@ -0,0 +1,179 @@
+"""
+Connection-pooled HTTP sessions shared by the retailer scrapers.
+
+A bare requests.get opens a new TCP+TLS connection per call. The SessionManager keeps
+one keep-alive connection pool per retailer host (with its own size) plus a retry and
+backoff policy, and shares those pools across threads. Each thread gets its own
+lightweight requests.Session, but every session mounts the same adapters, so an open
+connection can be reused by whichever thread needs it next.
+
+Every request also goes through the host's rate limiter and circuit breaker
+(see resilience.py), so a retailer that is failing or blocking is skipped quickly
+instead of costing a full timeout per query.
+
+The manager is injectable through set_session_manager, and host_overrides can point a
+retailer host at another base URL (e.g. a local stub server).
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from . import telemetry
+from .resilience import FAILURE_STATUSES, CircuitOpenError, HostGuards, RateLimitExceeded
+
+# Pool and retry tuning (overridable through the environment)
+SCRAPER_POOL_SIZE = int(os.getenv("SCRAPER_POOL_SIZE", os.getenv("SCRAPER_HOST_CONCURRENCY", "4")))
+# Per-host pool sizes, e.g. "www.walmart.com=8,www.target.com=4"
+SCRAPER_POOL_SIZES = os.getenv("SCRAPER_POOL_SIZES", "")
+SCRAPER_RETRIES = int(os.getenv("SCRAPER_RETRIES", "1"))
+SCRAPER_BACKOFF_FACTOR = float(os.getenv("SCRAPER_BACKOFF_FACTOR", "0.3"))
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Connection": "keep-alive",
+}
+
+
+def parse_pool_sizes(spec):
+    """Parse a "host=size,host=size" string into a dict"""
+    pool_sizes = {}
+    for part in spec.split(","):
+        if "=" in part:
+            host, size = part.split("=", 1)
+            pool_sizes[host.strip()] = int(size)
+    return pool_sizes
+
+
+class SessionManager:
+    """Thread-safe access to keep-alive connection pools for the retailer hosts"""
+
+    def __init__(self, pool_sizes=None, default_pool_size=SCRAPER_POOL_SIZE, retries=SCRAPER_RETRIES,
+                 backoff_factor=SCRAPER_BACKOFF_FACTOR, headers=None, host_overrides=None, guards=None):
+        """
+        Args:
+            pool_sizes (dict): Maximum pooled connections per host
+            default_pool_size (int): Pool size for hosts not listed in pool_sizes
+            retries (int): Retries for connection errors and retryable status codes
+            backoff_factor (float): Exponential backoff factor between retries
+            headers (dict): Headers sent with every request
+            host_overrides (dict): Maps a host to a replacement base URL, e.g.
+                {"www.walmart.com": "http://127.0.0.1:8001"}
+            guards (HostGuards): Per-host rate limits and circuit breakers, defaults from the environment
+        """
+        self.pool_sizes = pool_sizes if pool_sizes is not None else parse_pool_sizes(SCRAPER_POOL_SIZES)
+        self.default_pool_size = default_pool_size
+        self.headers = dict(headers or DEFAULT_HEADERS)
+        self.host_overrides = dict(host_overrides or {})
+        self.guards = guards if guards is not None else HostGuards()
+        # A 429 is returned as is and counted by the host's breaker: honoring Retry-After
+        # would let a retailer park a pricing thread for as long as it asks
+        self.retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=("GET",),
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+        self._adapters = {}
+        self._adapters_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _adapter_for(self, host):
+        """Return the shared adapter (connection pool) for a host"""
+        with self._adapters_lock:
+            adapter = self._adapters.get(host)
+            if adapter is None:
+                pool_size = self.pool_sizes.get(host, self.default_pool_size)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=self.retry)
+                self._adapters[host] = adapter
+            return adapter
+
+    def _session(self):
+        """Return this thread's session"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
+
+    def resolve_url(self, url):
+        """Apply host_overrides to a URL"""
+        parts = urlsplit(url)
+        override = self.host_overrides.get(parts.hostname)
+        if not override:
+            return url
+        base = urlsplit(override)
+        return urlunsplit((base.scheme, base.netloc, base.path.rstrip("/") + parts.path, parts.query, parts.fragment))
+
+    def get(self, url, **kwargs):
+        """
+        Issue a GET through the pooled connection for the URL's host
+
+        Raises:
+            CircuitOpenError: If the retailer's breaker is open
+            RateLimitExceeded: If the retailer's rate limit would delay the request too long
+        """
+        # Limits and breakers apply to the retailer host, before any override
+        host = urlsplit(url).hostname
+        try:
+            self.guards.before_request(host)
+        except CircuitOpenError:
+            telemetry.record("http_request", host=host, status="circuit_open")
+            raise
+        except RateLimitExceeded:
+            telemetry.record("http_request", host=host, status="rate_limited")
+            raise
+
+        url = self.resolve_url(url)
+        parts = urlsplit(url)
+        session = self._session()
+        prefix = f"{parts.scheme}://{parts.netloc}/"
+        if prefix not in session.adapters:
+            session.mount(prefix, self._adapter_for(parts.netloc))
+        start = time.perf_counter()
+        try:
+            response = session.get(url, **kwargs)
+        except Exception:
+            self.guards.after_request(host, success=False)
+            telemetry.record("http_request", time.perf_counter() - start, host=host, status="error")
+            raise
+        self.guards.after_request(host, success=response.status_code not in FAILURE_STATUSES)
+        telemetry.record("http_request", time.perf_counter() - start, host=host, status=str(response.status_code))
+        return response
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._adapters_lock:
+            for adapter in self._adapters.values():
+                adapter.close()
+            self._adapters.clear()
+
+
+_session_manager = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    """Return the process-wide SessionManager, creating it on first use"""
+    global _session_manager
+    with _session_manager_lock:
+        if _session_manager is None:
+            _session_manager = SessionManager()
+        return _session_manager
+
+
+def set_session_manager(manager):
+    """Replace the process-wide SessionManager (e.g. to point scrapers at a stub server)"""
+    global _session_manager
+    with _session_manager_lock:
+        previous = _session_manager
+        _session_manager = manager
+    if previous is not None and previous is not manager:
+        previous.close()
@@ -0,0 +1,165 @@
+"""
+Two-tier cache for price lookups.
+
+Results are keyed on a normalized form of the product_info dict, so "Chair " / "brown"
+and "chair" / "Brown" share an entry. The first tier is an in-process LRU; the optional
+second tier is a SQLite file that survives restarts. "Not Found" results are cached with
+their own, shorter TTL so a temporary scraping failure is retried sooner.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache tuning (overridable through the environment)
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "1024"))
+PRICE_CACHE_TTL_SECONDS = float(os.getenv("PRICE_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+PRICE_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("PRICE_CACHE_NEGATIVE_TTL_SECONDS", str(30 * 60)))
+# Path of the SQLite file for the persistent tier; leave empty for memory only
+PRICE_CACHE_DB = os.getenv("PRICE_CACHE_DB", "")
+
+# product_info fields that influence the search queries
+KEY_TEXT_FIELDS = ("name", "color", "material")
+KEY_NUMBER_FIELDS = ("height", "width", "depth")
+
+
+def normalize_product_key(product_info):
+    """
+    Build a stable cache key from a product_info dict
+
+    Text fields are lowercased with whitespace collapsed, dimensions are rounded to one
+    decimal, and missing or empty values are dropped.
+    """
+    key = {}
+    for field in KEY_TEXT_FIELDS:
+        value = product_info.get(field)
+        if value:
+            key[field] = " ".join(str(value).lower().split())
+    for field in KEY_NUMBER_FIELDS:
+        value = product_info.get(field)
+        if value:
+            try:
+                key[field] = round(float(value), 1)
+            except (ValueError, TypeError):
+                pass
+    return json.dumps(key, sort_keys=True)
+
+
+def is_negative_result(result):
+    """Whether a pricing result represents a failed lookup"""
+    return not result or result.get("name") == "Not Found"
+
+
+class PriceCache:
+    """LRU price cache with per-entry TTLs and an optional SQLite tier"""
+
+    def __init__(self, max_entries=PRICE_CACHE_MAX_ENTRIES, ttl_seconds=PRICE_CACHE_TTL_SECONDS,
+                 negative_ttl_seconds=PRICE_CACHE_NEGATIVE_TTL_SECONDS, db_path=PRICE_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS price_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, product_info):
+        """Return a copy of the cached result for product_info, or None on a miss"""
+        key = normalize_product_key(product_info)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return dict(result)
+                del self._entries[key]
+                self._stats["expirations"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM price_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at > now:
+                        result = json.loads(value)
+                        self._store(key, result, expires_at)
+                        self._stats["disk_hits"] += 1
+                        return dict(result)
+                    self._db.execute("DELETE FROM price_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._stats["expirations"] += 1
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, product_info, result, ttl_seconds=None):
+        """
+        Cache a pricing result
+
+        Args:
+            product_info (dict): The product the result was looked up for
+            result (dict): The pricing result
+            ttl_seconds (float): Optional TTL overriding the positive/negative default
+        """
+        if ttl_seconds is None:
+            ttl_seconds = self.negative_ttl_seconds if is_negative_result(result) else self.ttl_seconds
+        if ttl_seconds <= 0:
+            return
+
+        key = normalize_product_key(product_info)
+        expires_at = time.time() + ttl_seconds
+
+        with self._lock:
+            self._store(key, dict(result), expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO price_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(result), expires_at)
+                )
+                self._db.commit()
+
+    def _store(self, key, result, expires_at):
+        """Insert into the LRU tier, evicting the least recently used entries (lock held)"""
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM price_cache")
+                self._db.commit()
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current LRU size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
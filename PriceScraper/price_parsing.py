@@ -0,0 +1,270 @@
+"""
+Price normalization: one parser for every scraped price string.
+
+Retailer price text comes in many shapes: "$44.19$44.19" (visible and screen-reader
+copies), "Now $219.99 $21999" (superscript cents with the decimal point lost),
+"$1,29999", "$12.99 - $24.99", "$19.99 Was $29.99", "$3.97 12.4 ¢/oz" or "Unknown".
+parse_price() turns any of them into a ParsedPrice with the amount, currency, range
+and was/now prices, the number of units in the listing ("Set of 4") and a confidence
+score, so callers never run their own regexes over price text.
+
+Usage:
+    python -m PriceScraper.price_parsing [--fuzz N] [--seed S]
+
+checks the parser against fixtures/prices.json and then fuzzes it with noisy variations
+of known prices.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+# amount:      listed price (the low end of a range), None if no price was found
+# currency:    ISO code, None if the text had no currency marker
+# unit_count:  items in the listing, e.g. 4 for "Set of 4"
+# unit_price:  amount / unit_count
+# low, high:   ends of a price range, None otherwise
+# was:         previous or list price when the text shows one
+# confidence:  0-1, how sure the parser is about amount
+# raw:         the original text
+ParsedPrice = namedtuple("ParsedPrice", ["amount", "currency", "unit_count", "unit_price", "low", "high", "was",
+                                         "confidence", "raw"])
+
+CURRENCY_CODES = {
+    "$": "USD", "us$": "USD", "usd": "USD",
+    "c$": "CAD", "ca$": "CAD", "cad": "CAD",
+    "a$": "AUD", "au$": "AUD", "aud": "AUD",
+    "£": "GBP", "gbp": "GBP",
+    "€": "EUR", "eur": "EUR",
+}
+
+# Listings above this many units are more likely part numbers than pack sizes
+MAX_UNIT_COUNT = 100
+
+_CURRENCY = r'(?:US\$|CA\$|AU\$|C\$|A\$|\$|£|€|\b(?:USD|CAD|AUD|GBP|EUR)\b)'
+# Symbols that may follow the amount ("12,99 €"); a trailing "$" starts the next price
+_CURRENCY_AFTER = r'(?:£|€|\b(?:USD|CAD|AUD|GBP|EUR)\b)'
+_NUMBER = r'(?:\d{1,3}(?:[,.]\d{3})+(?:[.,]\d{1,2}|\d{2})?|\d+(?:[.,]\d{1,2})?)'
+_AMOUNT = re.compile(r'(?P<before>%s)?\s*(?P<number>%s)(?!\d)(?:\s*(?P<after>%s|¢))?'
+                     % (_CURRENCY, _NUMBER, _CURRENCY_AFTER), re.IGNORECASE)
+# Per-unit prices ("$0.25/oz", "12.4 ¢/oz") describe the unit, not the listing
+_UNIT_PRICE = re.compile(r'%s?\s*\d+(?:[.,]\d+)?\s*¢?\s*/\s*(?:fl\.?\s*)?[a-z]+\.?' % _CURRENCY, re.IGNORECASE)
+_RANGE_SEPARATOR = re.compile(r'^\s*(?:-|–|—|to)\s*$', re.IGNORECASE)
+_WAS_MARKER = re.compile(r'\b(?:was|reg(?:ular)?|list(?:\s+price)?|orig(?:inal(?:ly)?)?|compare\s+at|msrp)\b\.?:?\s*$',
+                         re.IGNORECASE)
+# "$1,29999": thousands groups followed by cents that lost their decimal point
+_MISSING_DECIMAL = re.compile(r'^(\d{1,3}(?:,\d{3})*),(\d{3})(\d{2})$')
+_UNIT_COUNT = re.compile(r'\b(?:set|pack|box|case|bundle|lot)\s+of\s+(\d+)\b|\b(\d+)[\s-]*(?:pack|pk|count|ct)\b',
+                         re.IGNORECASE)
+
+_EMPTY = ParsedPrice(None, None, 1, None, None, None, None, 0.0, None)
+
+
+def _to_number(number):
+    """
+    Convert a number token to a float
+
+    Returns:
+        tuple: (value, has_decimals, repaired) where repaired means the decimal point was inferred
+    """
+    missing = _MISSING_DECIMAL.match(number)
+    if missing:
+        return float(missing.group(1).replace(",", "") + missing.group(2) + "." + missing.group(3)), True, True
+
+    comma, dot = number.rfind(","), number.rfind(".")
+    if comma >= 0 and dot >= 0:
+        # Whichever separator comes last is the decimal point
+        decimal, thousands = (".", ",") if dot > comma else (",", ".")
+        number = number.replace(thousands, "").replace(decimal, ".")
+    elif comma >= 0:
+        # "1,299" groups thousands; "12,99" is a decimal comma
+        number = number.replace(",", "") if len(number) - comma == 4 else number.replace(",", ".")
+    elif dot >= 0 and number.count(".") > 1:
+        number = number.replace(".", "")
+    return float(number), "." in number, False
+
+
+def _tokens(text):
+    """Every amount in the text as (value, currency, has_decimals, repaired, start, end)"""
+    tokens = []
+    for match in _AMOUNT.finditer(text):
+        value, has_decimals, repaired = _to_number(match.group("number"))
+        marker = match.group("before") or match.group("after")
+        if marker == "¢":
+            tokens.append((value / 100, "USD", True, False, match.start(), match.end()))
+            continue
+        currency = CURRENCY_CODES.get(marker.lower()) if marker else None
+        tokens.append((value, currency, has_decimals, repaired, match.start(), match.end()))
+    return tokens
+
+
+def unit_count(text):
+    """Number of items a listing name or price text describes ("Set of 4" -> 4)"""
+    match = _UNIT_COUNT.search(text or "")
+    if not match:
+        return 1
+    count = int(match.group(1) or match.group(2))
+    return count if 1 < count <= MAX_UNIT_COUNT else 1
+
+
+@lru_cache(maxsize=4096)
+def _parse(text, name):
+    count = unit_count(name) if name else 1
+    if count == 1:
+        count = unit_count(text)
+
+    cleaned = _UNIT_PRICE.sub(" ", text)
+    tokens = _tokens(cleaned)
+    # With any currency-marked amount present, bare numbers are counts or noise
+    if any(token[1] for token in tokens):
+        tokens = [token for token in tokens if token[1]]
+    # "$21999" next to "$219.99" is the same price with its superscript cents flattened
+    decimal_digits = {f"{token[0]:.2f}".replace(".", "") for token in tokens if token[2]}
+    tokens = [token for token in tokens if token[2] or str(int(token[0])) not in decimal_digits]
+    tokens = [token for token in tokens if token[0] > 0]
+    if not tokens:
+        return _EMPTY._replace(unit_count=count, raw=text)
+
+    confidence = 1.0
+    low = high = was = None
+    current = None
+    for idx, token in enumerate(tokens):
+        preceding = cleaned[tokens[idx - 1][5] if idx else 0:token[4]]
+        if _WAS_MARKER.search(preceding):
+            was = was if was is not None else token[0]
+        elif current is None:
+            current = token
+            following = tokens[idx + 1] if idx + 1 < len(tokens) else None
+            if following and _RANGE_SEPARATOR.match(cleaned[token[5]:following[4]]):
+                low, high = token[0], following[0]
+        elif low is None and token[0] != current[0] and was is None:
+            # An unlabeled second price is usually the struck-through list price
+            if token[0] > current[0]:
+                was = token[0]
+            confidence *= 0.8
+
+    if current is None:
+        # Only a "was" price: better than nothing, but not the selling price
+        current = tokens[0]
+        was = None
+        confidence *= 0.5
+
+    amount, currency, has_decimals, repaired = current[0], current[1], current[2], current[3]
+    if currency is None:
+        confidence *= 0.7
+    if repaired:
+        confidence *= 0.8
+    if not has_decimals and amount >= 1000:
+        # Possibly cents without their decimal point
+        confidence *= 0.6
+    if low is not None:
+        confidence *= 0.8
+
+    return ParsedPrice(amount, currency, count, round(amount / count, 2), low, high, was, round(confidence, 2), text)
+
+
+def parse_price(price, name=None):
+    """
+    Parse a scraped price
+
+    Args:
+        price: Price text (or a number) as scraped
+        name (str): Listing name, used to find the number of units ("Set of 4")
+
+    Returns:
+        ParsedPrice: amount is None if no price was found
+    """
+    if isinstance(price, bool) or price is None:
+        return _EMPTY._replace(raw=price)
+    if isinstance(price, (int, float)):
+        if not math.isfinite(price) or price <= 0:
+            return _EMPTY._replace(raw=price)
+        count = unit_count(name) if name else 1
+        return ParsedPrice(float(price), None, count, round(price / count, 2), None, None, None, 0.7, price)
+    return _parse(str(price), name or "")
+
+
+def parse_prices(products):
+    """
+    Parse the prices of many product dicts (e.g. every candidate from every provider)
+
+    Args:
+        products (list[dict]): Products with "price" and "name"
+
+    Returns:
+        list[ParsedPrice]: One result per product, in order
+    """
+    return [parse_price(product.get("price"), product.get("name")) for product in products]
+
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "prices.json")
+
+NOISE = ["", " ", "\n", "current price ", "Now ", "Sale ", " each", " + shipping", "From ", " (list)", " "]
+
+
+def check_corpus(path=FIXTURE_PATH):
+    """Compare the parser's output with the expected fields in the corpus, returning the failure count"""
+    with open(path) as corpus_file:
+        corpus = json.load(corpus_file)
+    failures = 0
+    for case in corpus:
+        parsed = parse_price(case["price"], case.get("name"))
+        wrong = {field: (expected, getattr(parsed, field)) for field, expected in case["expected"].items()
+                 if getattr(parsed, field) != expected}
+        if wrong:
+            failures += 1
+            print(f"MISMATCH {case['price']!r}: " + ", ".join(f"{field} expected {expected!r} got {got!r}"
+                                                             for field, (expected, got) in wrong.items()))
+    print(f"{len(corpus) - failures}/{len(corpus)} corpus cases passed")
+    return failures
+
+
+def fuzz(iterations, seed=0):
+    """Parse noisy variations of known prices, returning the failure count"""
+    rng = random.Random(seed)
+    failures = 0
+    for _ in range(iterations):
+        cents = rng.randint(1, 999999)
+        amount = cents / 100
+        text = f"${amount:,.2f}"
+        if rng.random() < 0.3:
+            text += text  # duplicated screen-reader copy
+        text = rng.choice(NOISE) + text + rng.choice(NOISE)
+        parsed = parse_price(text)
+        if parsed.amount != amount:
+            failures += 1
+            print(f"FUZZ {text!r}: expected {amount} got {parsed.amount}")
+
+        # Arbitrary junk must never raise or produce a nonsensical amount
+        junk = "".join(rng.choice("$€£¢0123456789.,- /abcWasNow") for _ in range(rng.randint(0, 24)))
+        try:
+            parsed = parse_price(junk)
+        except Exception as e:
+            failures += 1
+            print(f"FUZZ {junk!r}: raised {e!r}")
+            continue
+        if parsed.amount is not None and not (math.isfinite(parsed.amount) and parsed.amount > 0):
+            failures += 1
+            print(f"FUZZ {junk!r}: invalid amount {parsed.amount}")
+    print(f"{iterations - failures}/{iterations} fuzz cases passed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the price parser against its corpus and fuzz it")
+    parser.add_argument("--fuzz", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = check_corpus() + fuzz(args.fuzz, args.seed)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Price providers: pluggable sources of product search results.
+
+A PriceProvider takes a search query and returns product dicts (name, price, link,
+source). Walmart and Target are RetailerPageProviders that fetch and extract their
+search pages; FixtureProvider answers from a local JSON catalog so the whole pricing
+path can run offline.
+
+Providers are registered by key in PROVIDER_FACTORIES and selected with PRICE_PROVIDERS
+(e.g. "walmart,target"). Each has its own time budget, PRICE_PROVIDER_TIMEOUT by
+default or per key through PRICE_PROVIDER_TIMEOUTS (e.g. "walmart=4,target=6").
+"""
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import quote_plus
+from bs4 import SoupStrainer
+from .extraction import PageExtractor, read_body
+from .http_session import get_session_manager
+
+# Providers queried for every product, in priority order
+PRICE_PROVIDERS = os.getenv("PRICE_PROVIDERS", "walmart,target")
+# Seconds each provider may spend on one product (across all its query variations)
+PRICE_PROVIDER_TIMEOUT = float(os.getenv("PRICE_PROVIDER_TIMEOUT", "10"))
+PRICE_PROVIDER_TIMEOUTS = os.getenv("PRICE_PROVIDER_TIMEOUTS", "")
+# Catalog used by the "fixture" provider
+PRICE_FIXTURE_CATALOG = os.getenv(
+    "PRICE_FIXTURE_CATALOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "catalog.json"),
+)
+
+# Products returned per search
+RESULTS_PER_SEARCH = 3
+
+
+class PriceProvider:
+    """A source of product search results"""
+
+    def __init__(self, name, host, timeout=PRICE_PROVIDER_TIMEOUT):
+        """
+        Args:
+            name (str): Display name, used as the result's source
+            host (str): Host used to limit concurrent requests
+            timeout (float): Time budget for one product's searches, in seconds
+        """
+        self.name = name
+        self.host = host
+        self.timeout = timeout
+
+    def search(self, query):
+        """
+        Search for a query
+
+        Returns:
+            list[dict]: Products with name, price, link and source (empty if none found)
+        """
+        raise NotImplementedError
+
+
+def parse_walmart_card(item, url):
+    """Extract a product from a Walmart result card"""
+    # Extract name
+    name_elem = item.select_one('.w_V_DM')
+    if not name_elem:
+        name_elem = item.select_one('span[data-automation-id="product-title"]')
+    name = name_elem.text.strip() if name_elem else "Unknown"
+
+    # Extract price
+    price_elem = item.select_one('.b_p')
+    if not price_elem:
+        price_elem = item.select_one('div[data-automation-id="product-price"]')
+    price = price_elem.text.strip() if price_elem else "Unknown"
+
+    # Clean up price format (numbers are normalized by price_parsing)
+    price = re.sub(r'current price ', '', price) if price else "Unknown"
+
+    # Extract link
+    link_elem = item.select_one('a')
+    link = "https://www.walmart.com" + link_elem['href'] if link_elem and 'href' in link_elem.attrs else url
+
+    # Fix malformed URLs
+    if 'https://www.walmart.comhttps://' in link:
+        link = link.replace('https://www.walmart.comhttps://', 'https://')
+
+    return {
+        "name": name,
+        "price": price,
+        "link": link,
+        "source": "Walmart"
+    }
+
+
+def parse_walmart_json_product(node, url):
+    """Extract a product from an item object in Walmart's __NEXT_DATA__ payload"""
+    if node.get("__typename") != "Product" or not node.get("name"):
+        return None
+
+    price_info = node.get("priceInfo") or {}
+    current_price = price_info.get("currentPrice") or {}
+    price = price_info.get("linePrice") or current_price.get("priceString")
+    if not price and node.get("price") is not None:
+        price = f"${node['price']}"
+
+    link = node.get("canonicalUrl") or url
+    if link.startswith("/"):
+        link = "https://www.walmart.com" + link
+
+    return {
+        "name": node["name"].strip(),
+        "price": price or "Unknown",
+        "link": link,
+        "source": "Walmart"
+    }
+
+
+def parse_target_card(item, url):
+    """Extract a product from a Target result card"""
+    # Extract name
+    name_elem = item.select_one('a[data-test="product-title"]')
+    name = name_elem.text.strip() if name_elem else "Unknown"
+
+    # Extract price
+    price_elem = item.select_one('span[data-test="product-price"]')
+    price = price_elem.text.strip() if price_elem else "Unknown"
+
+    # Extract link
+    link_elem = item.select_one('a[data-test="product-title"]')
+    link = "https://www.target.com" + link_elem['href'] if link_elem and 'href' in link_elem.attrs else url
+
+    return {
+        "name": name,
+        "price": price,
+        "link": link,
+        "source": "Target"
+    }
+
+
+def parse_target_json_product(node, url):
+    """Extract a product from a search result in Target's __NEXT_DATA__ payload"""
+    description = (node.get("item") or {}).get("product_description")
+    price_info = node.get("price")
+    if not isinstance(description, dict) or not isinstance(price_info, dict) or not description.get("title"):
+        return None
+
+    link = ((node["item"].get("enrichment") or {}).get("buy_url")) or url
+    if link.startswith("/"):
+        link = "https://www.target.com" + link
+
+    return {
+        "name": description["title"].strip(),
+        "price": price_info.get("formatted_current_price") or "Unknown",
+        "link": link,
+        "source": "Target"
+    }
+
+
+# How to read products off each retailer's search page
+WALMART_PAGE = PageExtractor(
+    card_marker='data-item-id=',
+    card_strainer=SoupStrainer('div', attrs={'data-item-id': True}),
+    parse_card=parse_walmart_card,
+    json_script_id='__NEXT_DATA__',
+    parse_json_product=parse_walmart_json_product,
+)
+
+TARGET_PAGE = PageExtractor(
+    card_marker='data-test="product-list-item"',
+    card_strainer=SoupStrainer('li', attrs={'data-test': 'product-list-item'}),
+    parse_card=parse_target_card,
+    json_script_id='__NEXT_DATA__',
+    parse_json_product=parse_target_json_product,
+)
+
+
+def fetch_products(url, page, timeout=PRICE_PROVIDER_TIMEOUT, limit=RESULTS_PER_SEARCH):
+    """Fetch a search page and extract its first products, reading only as much as needed"""
+    response = get_session_manager().get(url, timeout=timeout, stream=True)
+    try:
+        response.raise_for_status()
+        text = read_body(response, page, limit=limit)
+    except Exception:
+        # An unread streamed response keeps its pooled connection until it is closed
+        response.close()
+        raise
+    return page.extract(text, url, limit=limit)
+
+
+class RetailerPageProvider(PriceProvider):
+    """A retailer whose search result page is fetched and extracted"""
+
+    def __init__(self, name, host, search_url, page, timeout=PRICE_PROVIDER_TIMEOUT):
+        """
+        Args:
+            name (str): Retailer name
+            host (str): Retailer host
+            search_url (str): Search URL with a {query} placeholder
+            page (PageExtractor): How to read products off the result page
+            timeout (float): Time budget for one product's searches, in seconds
+        """
+        super().__init__(name, host, timeout)
+        self.search_url = search_url
+        self.page = page
+
+    def search(self, query):
+        url = self.search_url.format(query=quote_plus(query))
+
+        print(f"Searching {self.name} for: {query}")
+
+        try:
+            return fetch_products(url, self.page, timeout=self.timeout)
+        except Exception as e:
+            print(f"Error searching {self.name}: {e}")
+            return []
+
+
+class FixtureProvider(PriceProvider):
+    """Offline provider answering from a JSON catalog of products"""
+
+    def __init__(self, catalog_path=PRICE_FIXTURE_CATALOG, name="Fixture", timeout=PRICE_PROVIDER_TIMEOUT,
+                 latency=0.0):
+        """
+        Args:
+            catalog_path (str): JSON file with a "products" list of name/price/link entries
+            name (str): Source name reported for its products
+            timeout (float): Time budget for one product's searches, in seconds
+            latency (float): Simulated seconds per search
+        """
+        super().__init__(name, f"fixture:{catalog_path}", timeout)
+        self.catalog_path = catalog_path
+        self.latency = latency
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
+
+    def _products(self):
+        with self._catalog_lock:
+            if self._catalog is None:
+                with open(self.catalog_path) as catalog_file:
+                    self._catalog = json.load(catalog_file)["products"]
+            return self._catalog
+
+    def search(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        # Every word of the query must appear in the product name
+        words = query.lower().split()
+        matches = [product for product in self._products()
+                   if all(word in product["name"].lower() for word in words)]
+        return [dict(product, source=product.get("source", self.name))
+                for product in matches[:RESULTS_PER_SEARCH]]
+
+
+WALMART_SEARCH_URL = "https://www.walmart.com/search?q={query}"
+TARGET_SEARCH_URL = "https://www.target.com/s?searchTerm={query}"
+
+# Provider key -> factory taking the provider's timeout
+PROVIDER_FACTORIES = {
+    "walmart": lambda timeout: RetailerPageProvider("Walmart", "www.walmart.com", WALMART_SEARCH_URL,
+                                                    WALMART_PAGE, timeout),
+    "target": lambda timeout: RetailerPageProvider("Target", "www.target.com", TARGET_SEARCH_URL,
+                                                   TARGET_PAGE, timeout),
+    "fixture": lambda timeout: FixtureProvider(PRICE_FIXTURE_CATALOG, timeout=timeout),
+}
+
+
+def register_provider(key, factory):
+    """Make a provider available to PRICE_PROVIDERS under a key"""
+    PROVIDER_FACTORIES[key] = factory
+
+
+def parse_timeouts(spec):
+    """Parse a "key=seconds,key=seconds" string into a dict"""
+    timeouts = {}
+    for part in spec.split(","):
+        if "=" in part:
+            key, timeout = part.split("=", 1)
+            timeouts[key.strip()] = float(timeout)
+    return timeouts
+
+
+def load_providers(spec=PRICE_PROVIDERS, timeouts=None):
+    """
+    Build the providers named in a comma-separated spec, in order
+
+    Raises:
+        ValueError: If a key has no registered factory
+    """
+    timeouts = timeouts if timeouts is not None else parse_timeouts(PRICE_PROVIDER_TIMEOUTS)
+    providers = []
+    for key in [key.strip() for key in spec.split(",") if key.strip()]:
+        if key not in PROVIDER_FACTORIES:
+            raise ValueError(f"Unknown price provider: {key}")
+        providers.append(PROVIDER_FACTORIES[key](timeouts.get(key, PRICE_PROVIDER_TIMEOUT)))
+    return providers
+
+
+_providers = None
+_providers_lock = threading.Lock()
+
+
+def get_providers():
+    """Return the configured providers, building them on first use"""
+    global _providers
+    with _providers_lock:
+        if _providers is None:
+            _providers = load_providers()
+        return _providers
+
+
+def set_providers(providers):
+    """Replace the configured providers (e.g. with a FixtureProvider for offline runs)"""
+    global _providers
+    with _providers_lock:
+        _providers = list(providers)
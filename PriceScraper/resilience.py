@@ -0,0 +1,236 @@
+"""
+Per-retailer rate limiting and circuit breaking for scraper requests.
+
+Each retailer host gets a token bucket that paces requests to it, and a circuit
+breaker that trips after repeated failures (errors, timeouts, blocking or 5xx
+responses) within a window. While a breaker is open, requests to that host fail
+immediately instead of each waiting out its timeout; after a cool-down a single trial
+request is let through, and its outcome closes or re-opens the breaker.
+
+Rejections are raised as requests exceptions, so scrapers handle them like any other
+failed request.
+"""
+import os
+import threading
+import time
+from collections import deque
+import requests
+
+# Token bucket per host: sustained requests per second and burst size (0 disables pacing)
+SCRAPER_RATE_LIMIT = float(os.getenv("SCRAPER_RATE_LIMIT", "5"))
+SCRAPER_RATE_BURST = int(os.getenv("SCRAPER_RATE_BURST", "5"))
+# Per-host rates, e.g. "www.walmart.com=2,www.target.com=4"
+SCRAPER_RATE_LIMITS = os.getenv("SCRAPER_RATE_LIMITS", "")
+# A request that would have to wait longer than this for a token is rejected instead
+SCRAPER_RATE_LIMIT_MAX_WAIT = float(os.getenv("SCRAPER_RATE_LIMIT_MAX_WAIT", "2"))
+# Breaker: open after this many failures within the window, for the cool-down
+SCRAPER_BREAKER_FAILURES = int(os.getenv("SCRAPER_BREAKER_FAILURES", "5"))
+SCRAPER_BREAKER_WINDOW_SECONDS = float(os.getenv("SCRAPER_BREAKER_WINDOW_SECONDS", "60"))
+SCRAPER_BREAKER_COOLDOWN_SECONDS = float(os.getenv("SCRAPER_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Responses that mean the retailer is failing or pushing back
+FAILURE_STATUSES = (403, 429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request to a host whose breaker is open"""
+
+
+class RateLimitExceeded(requests.exceptions.RequestException):
+    """Raised when a request would wait too long for its host's rate limit"""
+
+
+def parse_rates(spec):
+    """Parse a "host=rate,host=rate" string into a dict"""
+    rates = {}
+    for part in spec.split(","):
+        if "=" in part:
+            host, rate = part.split("=", 1)
+            rates[host.strip()] = float(rate)
+    return rates
+
+
+class TokenBucket:
+    """Thread-safe token bucket; waiting callers reserve tokens in arrival order"""
+
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate (float): Tokens added per second
+            burst (int): Bucket capacity
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """
+        Take a token, returning how long the caller must wait before using it
+
+        Returns:
+            float: Seconds to wait, or None if that would exceed max_wait (no token taken)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            # The balance may go negative: later callers queue behind this reservation
+            self._tokens -= 1
+            return wait
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial after the cool-down"""
+
+    def __init__(self, failure_threshold, window_seconds, cooldown_seconds):
+        self.failure_threshold = failure_threshold
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = "closed"
+        self.opened_count = 0
+        self._failures = deque()
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may be sent now (claims the trial slot when half-open)"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release_trial(self):
+        """Give back a half-open trial slot whose request was never sent"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures.clear()
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.window_seconds:
+                self._failures.popleft()
+            if self.state == "half_open" or len(self._failures) >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened_count += 1
+                self.state = "open"
+                self._opened_at = now
+                self._trial_in_flight = False
+
+    def recent_failures(self):
+        with self._lock:
+            return len(self._failures)
+
+
+class HostGuards:
+    """Rate limiter and circuit breaker for every host, with per-host counters"""
+
+    def __init__(self, rate=SCRAPER_RATE_LIMIT, burst=SCRAPER_RATE_BURST, rates=None,
+                 max_wait=SCRAPER_RATE_LIMIT_MAX_WAIT, failure_threshold=SCRAPER_BREAKER_FAILURES,
+                 window_seconds=SCRAPER_BREAKER_WINDOW_SECONDS, cooldown_seconds=SCRAPER_BREAKER_COOLDOWN_SECONDS):
+        """
+        Args:
+            rate (float): Default requests per second per host (0 for no pacing)
+            burst (int): Requests allowed back to back before pacing applies
+            rates (dict): Per-host requests per second, overriding rate
+            max_wait (float): Longest a request may wait for a token
+            failure_threshold (int): Failures within the window that open a breaker (0 disables)
+            window_seconds (float): Failure counting window
+            cooldown_seconds (float): How long a breaker stays open before a trial request
+        """
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates if rates is not None else parse_rates(SCRAPER_RATE_LIMITS)
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                rate = self.rates.get(host, self.rate)
+                state = {
+                    "bucket": TokenBucket(rate, self.burst) if rate > 0 else None,
+                    "breaker": CircuitBreaker(self.failure_threshold, self.window_seconds, self.cooldown_seconds),
+                    "requests": 0,
+                    "failures": 0,
+                    "breaker_rejections": 0,
+                    "rate_limit_rejections": 0,
+                    "rate_limit_waits": 0,
+                    "rate_limit_wait_seconds": 0.0,
+                }
+                self._hosts[host] = state
+            return state
+
+    def _count(self, state, counter, amount=1):
+        with self._lock:
+            state[counter] += amount
+
+    def before_request(self, host):
+        """
+        Wait for the host's rate limit and check its breaker
+
+        Raises:
+            CircuitOpenError: If the host's breaker is open
+            RateLimitExceeded: If the wait for a token would exceed max_wait
+        """
+        state = self._host(host)
+        if self.failure_threshold and not state["breaker"].allow():
+            self._count(state, "breaker_rejections")
+            raise CircuitOpenError(f"Circuit open for {host}, skipping request")
+        if state["bucket"] is not None:
+            wait = state["bucket"].reserve(self.max_wait)
+            if wait is None:
+                state["breaker"].release_trial()
+                self._count(state, "rate_limit_rejections")
+                raise RateLimitExceeded(f"Rate limit for {host} exceeded")
+            if wait > 0:
+                self._count(state, "rate_limit_waits")
+                self._count(state, "rate_limit_wait_seconds", wait)
+                time.sleep(wait)
+        self._count(state, "requests")
+
+    def after_request(self, host, success):
+        """Record a request's outcome with the host's breaker"""
+        state = self._host(host)
+        if success:
+            state["breaker"].record_success()
+        else:
+            self._count(state, "failures")
+            state["breaker"].record_failure()
+
+    def stats(self):
+        """Per-host breaker state and rate-limit counters"""
+        with self._lock:
+            hosts = {host: (state["breaker"], {key: value for key, value in state.items()
+                                               if key not in ("bucket", "breaker")})
+                     for host, state in self._hosts.items()}
+        stats = {}
+        for host, (breaker, host_stats) in hosts.items():
+            host_stats["breaker_state"] = breaker.state
+            host_stats["breaker_opened"] = breaker.opened_count
+            host_stats["recent_failures"] = breaker.recent_failures()
+            stats[host] = host_stats
+        return stats
@@ -0,0 +1,182 @@
+"""
+Asyncio fan-out search across query variations and price providers.
+
+All query x provider searches are started at once. Each provider host has its own
+bounded thread pool, which caps how many requests hit that host concurrently across
+every search in the process, and each provider has its own time budget: once it is
+spent, that provider's outstanding searches are abandoned without holding up the
+others.
+
+The most specific query wins. fan_out_search keeps one global priority order (within a
+query, earlier providers win) and returns the single best hit; search_providers keeps
+the best hit of every provider so the results can be aggregated. Either way, searches
+that can no longer win are cancelled as soon as a better one succeeds.
+"""
+import asyncio
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from . import telemetry
+
+# Maximum concurrent requests per retailer host (overridable through the environment)
+HOST_CONCURRENCY = int(os.getenv("SCRAPER_HOST_CONCURRENCY", "4"))
+
+# A retailer search: display name, host used for concurrency limits, and a blocking
+# search function taking a query and returning a list of product dicts. PriceProvider
+# objects have the same attributes plus a per-provider timeout.
+Retailer = namedtuple("Retailer", ["name", "host", "search"])
+
+# One provider's best result: the provider, the query that found it and its products
+ProviderHit = namedtuple("ProviderHit", ["provider", "query", "products"])
+
+_host_executors = {}
+_host_executors_lock = threading.Lock()
+
+
+def _host_executor(host):
+    """Return the shared executor for a host, creating it on first use"""
+    with _host_executors_lock:
+        executor = _host_executors.get(host)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=HOST_CONCURRENCY,
+                                          thread_name_prefix=f"search-{host}")
+            _host_executors[host] = executor
+        return executor
+
+
+def _timed_search(provider, query):
+    """Run one provider search, reporting its duration and outcome"""
+    with telemetry.timed("provider_search", provider=provider.name) as labels:
+        labels["outcome"] = "error"
+        products = provider.search(query)
+        labels["outcome"] = "hit" if products else "empty"
+        return products
+
+
+async def _search(queries, providers, per_provider):
+    """
+    Run every query on every provider and keep the best hit(s)
+
+    Args:
+        queries (list[str]): Search queries, most specific first
+        providers (list): Providers (or Retailers) in priority order
+        per_provider (bool): Keep the best hit of each provider instead of one overall
+
+    Returns:
+        dict: Best (rank, query, products) per provider index, or under None overall
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    # Identical queries (e.g. when a product has no color or dimensions) only need one search
+    unique_queries = list(dict.fromkeys(queries))
+
+    # future -> (provider index, rank); lower ranks win
+    searches = {}
+    for query_idx, query in enumerate(unique_queries):
+        for provider_idx, provider in enumerate(providers):
+            future = loop.run_in_executor(_host_executor(provider.host), _timed_search, provider, query)
+            rank = query_idx if per_provider else query_idx * len(providers) + provider_idx
+            searches[future] = (provider_idx, rank, query)
+
+    deadlines = {}
+    for provider_idx, provider in enumerate(providers):
+        timeout = getattr(provider, "timeout", None)
+        if timeout:
+            deadlines[provider_idx] = start + timeout
+
+    def key_of(future):
+        return searches[future][0] if per_provider else None
+
+    pending = set(searches)
+    best = {}
+
+    try:
+        while pending:
+            pending_deadlines = [deadlines[searches[f][0]] for f in pending if searches[f][0] in deadlines]
+            timeout = max(min(pending_deadlines) - loop.time(), 0) if pending_deadlines else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    products = future.result()
+                except Exception as e:
+                    print(f"Search failed: {e}")
+                    continue
+                _, rank, query = searches[future]
+                key = key_of(future)
+                if products and (key not in best or rank < best[key][0]):
+                    best[key] = (rank, query, products)
+
+            # Providers whose time budget is spent are not waited on any longer
+            now = loop.time()
+            expired = [f for f in pending if deadlines.get(searches[f][0], now + 1) <= now]
+            for provider_idx in {searches[f][0] for f in expired}:
+                print(f"{providers[provider_idx].name} timed out, skipping its remaining searches")
+            # Lower-priority searches can no longer win
+            beaten = [f for f in pending if key_of(f) in best and searches[f][1] > best[key_of(f)][0]]
+            for future in expired + beaten:
+                future.cancel()
+                pending.discard(future)
+    finally:
+        for future in pending:
+            future.cancel()
+
+    return best
+
+
+async def fan_out_search(queries, retailers):
+    """
+    Search every query on every retailer concurrently and keep the highest-priority hit
+
+    Args:
+        queries (list[str]): Search queries, most specific first
+        retailers (list): Retailers or providers in priority order
+
+    Returns:
+        tuple: (query, product) for the winning search, or (None, None) if nothing was found
+    """
+    best = await _search(queries, retailers, per_provider=False)
+    if None not in best:
+        return None, None
+    _, query, products = best[None]
+    return query, products[0]
+
+
+async def search_providers(queries, providers):
+    """
+    Search every query on every provider concurrently and keep each provider's best hit
+
+    Args:
+        queries (list[str]): Search queries, most specific first
+        providers (list): Providers in priority order
+
+    Returns:
+        list[ProviderHit]: One hit per provider that found anything, in provider order
+    """
+    best = await _search(queries, providers, per_provider=True)
+    return [ProviderHit(providers[provider_idx], query, products)
+            for provider_idx, (_, query, products) in sorted(best.items())]
+
+
+def _run(coroutine_function, *args):
+    """Run a coroutine to completion from plain threads or from inside an event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine_function(*args))
+
+    # asyncio.run cannot be nested, so run the search on its own loop in a helper thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine_function(*args)).result()
+
+
+def run_search(queries, retailers):
+    """Synchronous wrapper around fan_out_search"""
+    return _run(fan_out_search, queries, retailers)
+
+
+def run_provider_search(queries, providers):
+    """Synchronous wrapper around search_providers"""
+    return _run(search_providers, queries, providers)
@@ -2,131 +2,42 @@
 A simplified scraper that uses direct HTTP requests and basic parsing.
 This provides a more reliable way to get product information without triggering anti-bot measures.
 """
-import requests
 import json
-import re
-from bs4 import BeautifulSoup
+import os
 from urllib.parse import quote_plus
+from .http_session import DEFAULT_HEADERS
+from .price_parsing import parse_prices
+from .providers import PRICE_PROVIDER_TIMEOUT, PROVIDER_FACTORIES, get_providers
+from .search_engine import fan_out_search, run_provider_search, run_search, search_providers
+
+# How results from several providers are combined: "priority" (the most specific hit of
+# the highest-priority provider), "min" (cheapest), "median" or "best_match"
+AGGREGATION_MODES = ("priority", "min", "median", "best_match")
+
+def check_aggregation(mode):
+    """
+    Return an aggregation mode, rejecting unknown ones
+    
+    Raises:
+        ValueError: If mode is not one of AGGREGATION_MODES
+    """
+    if mode not in AGGREGATION_MODES:
+        raise ValueError(f"Unknown price aggregation: {mode!r} (expected one of {', '.join(AGGREGATION_MODES)})")
+    return mode
+
+PRICE_AGGREGATION = check_aggregation(os.getenv("PRICE_AGGREGATION", "priority").strip())
 
 def get_user_agent():
     """Return a realistic user agent string"""
-    return "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    return DEFAULT_HEADERS["User-Agent"]
 
 def search_walmart(query):
     """Search for products on Walmart"""
-    encoded_query = quote_plus(query)
-    url = f"https://www.walmart.com/search?q={encoded_query}"
-    
-    headers = {
-        "User-Agent": get_user_agent(),
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Connection": "keep-alive",
-    }
-    
-    print(f"Searching Walmart for: {query}")
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find product items
-        products = []
-        product_items = soup.select('div[data-item-id]')
-        
-        for item in product_items[:3]:  # Get first 3 items
-            try:
-                # Extract name
-                name_elem = item.select_one('.w_V_DM')
-                if not name_elem:
-                    name_elem = item.select_one('span[data-automation-id="product-title"]')
-                name = name_elem.text.strip() if name_elem else "Unknown"
-                
-                # Extract price
-                price_elem = item.select_one('.b_p')
-                if not price_elem:
-                    price_elem = item.select_one('div[data-automation-id="product-price"]')
-                price = price_elem.text.strip() if price_elem else "Unknown"
-                
-                # Clean up price format
-                price = re.sub(r'current price ', '', price) if price else "Unknown"
-                price = re.sub(r'([0-9]),([0-9]{3})([0-9]{2})', r'\1,\2.\3', price)
-                
-                # Extract link
-                link_elem = item.select_one('a')
-                link = "https://www.walmart.com" + link_elem['href'] if link_elem and 'href' in link_elem.attrs else url
-                
-                # Fix malformed URLs
-                if 'https://www.walmart.comhttps://' in link:
-                    link = link.replace('https://www.walmart.comhttps://', 'https://')
-                
-                products.append({
-                    "name": name,
-                    "price": price,
-                    "link": link,
-                    "source": "Walmart"
-                })
-            except Exception as e:
-                print(f"Error extracting product info: {e}")
-        
-        return products
-    except Exception as e:
-        print(f"Error searching Walmart: {e}")
-        return []
+    return PROVIDER_FACTORIES["walmart"](PRICE_PROVIDER_TIMEOUT).search(query)
 
 def search_target(query):
     """Search for products on Target"""
-    encoded_query = quote_plus(query)
-    url = f"https://www.target.com/s?searchTerm={encoded_query}"
-    
-    headers = {
-        "User-Agent": get_user_agent(),
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Connection": "keep-alive",
-    }
-    
-    print(f"Searching Target for: {query}")
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find product items
-        products = []
-        product_items = soup.select('li[data-test="product-list-item"]')
-        
-        for item in product_items[:3]:  # Get first 3 items
-            try:
-                # Extract name
-                name_elem = item.select_one('a[data-test="product-title"]')
-                name = name_elem.text.strip() if name_elem else "Unknown"
-                
-                # Extract price
-                price_elem = item.select_one('span[data-test="product-price"]')
-                price = price_elem.text.strip() if price_elem else "Unknown"
-                
-                # Extract link
-                link_elem = item.select_one('a[data-test="product-title"]')
-                link = "https://www.target.com" + link_elem['href'] if link_elem and 'href' in link_elem.attrs else url
-                
-                products.append({
-                    "name": name,
-                    "price": price,
-                    "link": link,
-                    "source": "Target"
-                })
-            except Exception as e:
-                print(f"Error extracting Target product info: {e}")
-        
-        return products
-    except Exception as e:
-        print(f"Error searching Target: {e}")
-        return []
+    return PROVIDER_FACTORIES["target"](PRICE_PROVIDER_TIMEOUT).search(query)
 
 def format_dimensions(product_info, simple=False):
     """Format dimensions from height, width, depth into a string"""
@@ -204,42 +115,124 @@ def create_search_variations(product_info):
     
     return queries
 
-def search_simple_product(product_info):
-    """Search for product information using simple HTTP requests with multiple strategies"""
+def aggregate_hits(product_info, hits, mode):
+    """
+    Pick one product out of every provider's best hit
+    
+    Args:
+        product_info: Dictionary with product details
+        hits (list[ProviderHit]): Each provider's best hit, in provider order
+        mode (str): "min", "median" or "best_match"
+        
+    Returns:
+        tuple: (query, product, parsed price) or (None, None, None) if no hit has a usable product
+    """
+    # Parse every candidate from every provider in one pass
+    candidates = [(hit_idx, hit.query, product) for hit_idx, hit in enumerate(hits) for product in hit.products]
+    parsed = parse_prices([product for _, _, product in candidates])
+    priced = [(price, hit_idx, query, product) for (hit_idx, query, product), price in zip(candidates, parsed)
+              if price.amount is not None]
+    if not priced:
+        return None, None, None
+    
+    if mode == "best_match":
+        ranks = {"high": 2, "medium": 1, "low": 0}
+        # max() keeps the first of equal matches, so ties go to the higher-priority provider
+        price, _, query, product = max(priced, key=lambda candidate: ranks[calculate_match_quality(product_info, candidate[3])])
+        return query, product, price
+    
+    # Compare each provider's top priced product by price per unit
+    top = {}
+    for candidate in priced:
+        top.setdefault(candidate[1], candidate)
+    ordered = sorted(top.values(), key=lambda candidate: candidate[0].unit_price)
+    if mode == "min":
+        price, _, query, product = ordered[0]
+    elif mode == "median":
+        # The lower middle for an even count, so the result is always a real listing
+        price, _, query, product = ordered[(len(ordered) - 1) // 2]
+    else:
+        raise ValueError(f"Unknown price aggregation: {mode!r}")
+    return query, product, price
+
+def search_simple_product(product_info, providers=None, aggregation=None):
+    """
+    Search for product information using simple HTTP requests with multiple strategies
+    
+    Args:
+        product_info: Dictionary with product details
+        providers (list[PriceProvider]): Providers to query (defaults to PRICE_PROVIDERS)
+        aggregation (str): How to combine the providers' results (defaults to PRICE_AGGREGATION)
+        
+    Returns:
+        Dictionary with the chosen product and the sources consulted
+    """
+    providers = providers if providers is not None else get_providers()
+    aggregation = check_aggregation(aggregation or PRICE_AGGREGATION)
+    
     # Create variations of the search query from specific to general
     search_queries = create_search_variations(product_info)
     
-    # Try each query until we find products
-    for query in search_queries:
-        # First try Walmart
-        walmart_products = search_walmart(query)
-        if walmart_products:
-            best_product = walmart_products[0]
-            match_quality = calculate_match_quality(product_info, best_product)
-            
-            return {
-                "name": best_product["name"],
-                "price": best_product["price"],
-                "link": best_product["link"],
-                "match_quality": match_quality,
-                "price_reasonable": "yes",
-                "notes": f"Found on {best_product['source']} using query: '{query}'"
-            }
+    if aggregation == "priority":
+        # Search every query on every provider at once, keeping the most specific hit
+        return build_search_result(product_info, aggregation, best=run_search(search_queries, providers))
+    
+    # Keep every provider's most specific hit and combine them
+    return build_search_result(product_info, aggregation, hits=run_provider_search(search_queries, providers))
+
+async def search_simple_product_async(product_info, providers=None, aggregation=None):
+    """
+    Async version of search_simple_product
+    
+    The provider fan-out runs on the caller's event loop (each provider's blocking
+    requests on its host's bounded executor), so no thread or loop is spent waiting.
+    """
+    providers = providers if providers is not None else get_providers()
+    aggregation = check_aggregation(aggregation or PRICE_AGGREGATION)
+    search_queries = create_search_variations(product_info)
+    
+    if aggregation == "priority":
+        return build_search_result(product_info, aggregation, best=await fan_out_search(search_queries, providers))
+    return build_search_result(product_info, aggregation, hits=await search_providers(search_queries, providers))
+
+def build_search_result(product_info, aggregation, best=None, hits=None):
+    """
+    Turn search results into the pricing result returned to callers
+    
+    Args:
+        product_info: Dictionary with product details
+        aggregation (str): How the providers' results are combined
+        best (tuple): (query, product) of a "priority" search
+        hits (list[ProviderHit]): Every provider's hits, for the other aggregations
+        
+    Returns:
+        Dictionary with the chosen product and the sources consulted
+    """
+    sources = []
+    if hits is not None:
+        sources = [{"source": hit.provider.name, "name": hit.products[0]["name"],
+                    "price": hit.products[0]["price"], "link": hit.products[0]["link"]} for hit in hits]
+        query, best_product, _ = aggregate_hits(product_info, hits, aggregation)
+    else:
+        query, best_product = best
+    
+    if best_product:
+        match_quality = calculate_match_quality(product_info, best_product)
+        notes = f"Found on {best_product['source']} using query: '{query}'"
+        if aggregation != "priority":
+            notes += f" ({aggregation} of {len(sources)} providers)"
         
-        # If Walmart fails, try Target
-        target_products = search_target(query)
-        if target_products:
-            best_product = target_products[0]
-            match_quality = calculate_match_quality(product_info, best_product)
-            
-            return {
-                "name": best_product["name"],
-                "price": best_product["price"],
-                "link": best_product["link"],
-                "match_quality": match_quality,
-                "price_reasonable": "yes",
-                "notes": f"Found on {best_product['source']} using query: '{query}'"
-            }
+        return {
+            "name": best_product["name"],
+            "price": best_product["price"],
+            "link": best_product["link"],
+            "source": best_product["source"],
+            "match_quality": match_quality,
+            "price_reasonable": "yes",
+            "aggregation": aggregation,
+            "sources": sources,
+            "notes": notes
+        }
     
     # If all searches fail, return default response
     return {
@@ -0,0 +1,140 @@
+"""
+Single-flight request coalescing.
+
+When many workers ask for the same key at the same moment (e.g. a household's photos
+all containing chairs), only the first caller (the leader) runs the computation; the
+others wait for it and receive the same result or exception. Waiting works from plain
+threads and from asyncio tasks alike, since the shared slot is a
+concurrent.futures.Future that both can wait on.
+
+Results are shared between callers, so they should be treated as read-only. A leader
+that is cancelled (e.g. its request hit a deadline) or interrupted does not pass that
+on: the flight is abandoned and its waiters retry, one of them becoming the new leader.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future
+
+
+class FlightAbandoned(Exception):
+    """The leader stopped without a result (it was cancelled or interrupted)"""
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one in-flight computation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._stats = {
+            "executions": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "abandoned": 0,
+        }
+
+    def acquire(self, key):
+        """
+        Join the in-flight call for a key, or start one
+
+        Returns:
+            tuple: (future, is_leader). The leader must call release() exactly once;
+            everyone else waits on the future.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self._stats["executions"] += 1
+            return future, True
+
+    def release(self, key, future, result=None, error=None):
+        """Publish the leader's result (or error) to every waiter and end the flight"""
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            if isinstance(error, FlightAbandoned):
+                self._stats["abandoned"] += 1
+            elif error is not None:
+                self._stats["errors"] += 1
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _fail(self, key, future, error):
+        """End the leader's flight with its error; cancellation and interrupts abandon it instead"""
+        if not isinstance(error, Exception):
+            error = FlightAbandoned(f"Leader for {key!r} stopped: {type(error).__name__}")
+        self.release(key, future, error=error)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs), sharing the call with concurrent callers of the same key
+
+        Returns:
+            The result of the leader's call
+
+        Raises:
+            Exception: Whatever the leader's call raised
+        """
+        while True:
+            future, leader = self.acquire(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except FlightAbandoned:
+                continue
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self.release(key, future, result=result)
+        return result
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """
+        Async version of do()
+
+        fn may be a coroutine function, which the leader awaits, or a blocking callable,
+        which the leader runs in the loop's default executor. Waiting never blocks the
+        event loop, and calls are shared with threads using do() on the same key. A
+        cancelled waiter only stops waiting; it never cancels the shared call.
+        """
+        while True:
+            future, leader = self.acquire(key)
+            if leader:
+                break
+            try:
+                # Shielded so cancelling this waiter does not cancel the shared future
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except FlightAbandoned:
+                continue
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                result = await fn(*args, **kwargs)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self.release(key, future, result=result)
+        return result
+
+    def stats(self):
+        """Return coalescing counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._in_flight)
+        calls = stats["executions"] + stats["coalesced"]
+        stats["coalesced_ratio"] = stats["coalesced"] / calls if calls else 0.0
+        return stats
@@ -0,0 +1,62 @@
+"""
+Telemetry hooks for the price scraper.
+
+The scraper has no metrics dependency of its own. It reports what it does as events,
+and whatever host application embeds it (e.g. the Backend's Prometheus metrics) can
+subscribe with add_listener. Events currently emitted:
+
+- "http_request": one retailer request; labels host and status (the HTTP status code,
+  "error", "circuit_open" or "rate_limited").
+- "provider_search": one provider search; labels provider and outcome ("hit", "empty"
+  or "error").
+
+Listeners are called as listener(event, seconds, labels) on the thread that did the
+work, so they should be quick and thread-safe.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+def add_listener(listener):
+    """Subscribe to scraper events"""
+    with _listeners_lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def remove_listener(listener):
+    """Unsubscribe from scraper events"""
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def record(event, seconds=None, **labels):
+    """Report an event (with its duration, if it has one) to every listener"""
+    if not _listeners:
+        return
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(event, seconds, labels)
+        except Exception as e:
+            print(f"Telemetry listener failed for {event}: {e}")
+
+
+@contextmanager
+def timed(event, **labels):
+    """
+    Time a block and report it as an event
+
+    The block receives the labels dict and may add to it (e.g. an outcome) before it ends.
+    """
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        record(event, time.perf_counter() - start, **labels)
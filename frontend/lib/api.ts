@@ -26,6 +26,90 @@ export async function uploadImageForDetection(imageFile: File): Promise<Detected
   }
 }
 
+// Per-image result of a batch upload: the detected items, or why the image failed
+export type BatchDetectionResult = { items: DetectedItem[] } | { detail: string }
+
+// Upload all photos of a claim at once and get detected objects keyed by filename
+export async function uploadImagesForDetection(imageFiles: File[]): Promise<Record<string, BatchDetectionResult>> {
+  try {
+    const formData = new FormData()
+    for (const imageFile of imageFiles) {
+      formData.append("files", imageFile)
+    }
+
+    const response = await fetch(`${API_BASE_URL}/api/detect-objects/batch`, {
+      method: "POST",
+      body: formData,
+    })
+
+    if (!response.ok) {
+      const errorData = await response.json()
+      throw new Error(errorData.detail || "Failed to process images")
+    }
+
+    return await response.json()
+  } catch (error) {
+    console.error("Error uploading images:", error)
+    throw error
+  }
+}
+
+// Events streamed by a detection job as it makes progress
+export type DetectionJobEvent =
+  | { type: "item"; image: string; item: DetectedItem }
+  | { type: "error"; image: string; detail: string }
+  | { type: "status"; status: "done" | "failed"; error?: string }
+
+// Start a background detection job and return its id right away
+export async function startDetectionJob(imageFiles: File[]): Promise<string> {
+  const formData = new FormData()
+  for (const imageFile of imageFiles) {
+    formData.append("files", imageFile)
+  }
+
+  const response = await fetch(`${API_BASE_URL}/api/detect-objects/jobs`, {
+    method: "POST",
+    body: formData,
+  })
+
+  if (!response.ok) {
+    const errorData = await response.json()
+    throw new Error(errorData.detail || "Failed to start detection job")
+  }
+
+  const { jobId } = await response.json()
+  return jobId
+}
+
+// Follow a detection job, calling onEvent for each item as soon as it is priced
+export async function streamDetectionJob(jobId: string, onEvent: (event: DetectionJobEvent) => void): Promise<void> {
+  const response = await fetch(`${API_BASE_URL}/api/detect-objects/jobs/${jobId}/events?format=ndjson`)
+
+  if (!response.ok || !response.body) {
+    throw new Error("Failed to stream detection job")
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffered = ""
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+
+    buffered += decoder.decode(value, { stream: true })
+    const lines = buffered.split("\n")
+    buffered = lines.pop() ?? ""
+
+    for (const line of lines) {
+      // Blank lines are keep-alives
+      if (line.trim()) {
+        onEvent(JSON.parse(line))
+      }
+    }
+  }
+}
+
 // Fallback to simulation if needed during development
 export async function fallbackToSimulation(imageDataUrl: string): Promise<DetectedItem[]> {
   // Simulate API delay
@@ -19,6 +19,8 @@ export interface DetectedItem {
   valueSource?: string
   sourceUrl?: string
   isPriceModified?: boolean
+  quantity?: number // Near-duplicate detections sharing this item's analysis and price
+  groupId?: string // Id of the detection that represents the group
   details?: ItemDetails
 }
 